@@ -1,13 +1,19 @@
 import asyncio
 import datetime
+import hmac
+import io
 import logging
+import multiprocessing
 import time
 import json
 import pytz
 
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils import executor
+from aiogram.utils.exceptions import MessageNotModified, TelegramAPIError
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import psycopg2
 from psycopg2 import OperationalError
@@ -15,6 +21,13 @@ from psycopg2 import OperationalError
 from config import (
     API_TOKEN,
     DB_URI,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_COMMAND_TIMEOUT_SEC,
+    LOT_CACHE_SIZE,
+    LOT_CACHE_TTL_SEC,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL_SEC,
     AUCTION_CHANNEL,
     TIMEZONE,
     MIN_STEP,
@@ -24,10 +37,67 @@ from config import (
     PAYMENT_TIMEOUT_MIN,
     BAN_DAYS,
     ADMIN_IDS,
+    SHEETS_SYNC_MODE,
+    REPORT_FLUSH_INTERVAL_SEC,
+    REPORT_BATCH_SIZE,
+    REPORT_RETRY_BASE_SEC,
+    REPORT_RETRY_MAX_SEC,
+    NOTIFY_COALESCE_SEC,
+    NOTIFY_CONCURRENCY,
+    PAYMENT_CHECK_INTERVAL_SEC,
+    PAYMENT_POLL_WINDOW_SEC,
+    PAYMENT_RECOVERY_GRACE_SEC,
+    PAYMENT_RECOVERY_HORIZON_HOURS,
+    YOOKASSA_MAX_CONNECTIONS,
+    YOOKASSA_CONCURRENCY,
+    YOOKASSA_RETRIES,
+    QR_PATH,
+    QR_CLEANUP_LEGACY,
+    LIFECYCLE_CONCURRENCY,
+    CHANNEL_POSTS_PER_MIN,
+    CHANNEL_POSTS_BURST,
+    CHANNEL_EDIT_INTERVAL_SEC,
+    CHANNEL_REFRESH_INTERVAL_SEC,
+    CHANNEL_REFRESH_SHARE,
+    MEDIA_PREFETCH_CHAT,
+    MEDIA_CHECK_CONCURRENCY,
+    PERSONAL_CARDS_CACHE_SIZE,
+    PERSONAL_CARDS_TTL_SEC,
+    BID_LOG_DETACH_AFTER_DAYS,
+    BID_USER_RATE_PER_SEC,
+    BID_USER_BURST,
+    BID_LOT_RATE_PER_SEC,
+    BID_LOT_BURST,
+    REDIS_HOST,
+    REDIS_PORT,
+    HOT_STATE_BACKEND,
+    LEADER_ELECTION,
+    LEADER_LOCK_KEY,
+    LEADER_RETRY_SEC,
+    LEADER_HEALTH_CHECK_SEC,
+    BOT_MODE,
+    BOT_WEBHOOK_PATH,
+    BOT_WEBHOOK_URL,
+    BOT_WEBHOOK_SECRET,
+    BOT_WEBHOOK_MAX_CONNECTIONS,
+    BOT_WEBAPP_HOST,
+    BOT_WEBAPP_PORT,
+    BOT_WORKERS,
+    TELEGRAM_API_SERVER,
 )
-from models import Database
-from google_sheets import fetch_base_lots, append_report_row
-from payment import generate_payment_url, generate_qr, check_payment_status
+from cache import TTLCache
+from models import AsyncDatabase, PAYMENT_EVENTS_CHANNEL, active_ban_until
+from google_sheets import fetch_base_lots_incremental, build_report_values, append_report_values
+from channel_updater import ChannelPostUpdater
+from leader import LeaderElector
+from lifecycle import LifecycleExecutor
+from media_cache import MediaCache
+from lot_timers import LotTimers
+from notifications import BidNotifier
+from hot_state import RedisHotState
+from ratelimit import TokenBucket, per_worker
+from throttling import BidThrottlingMiddleware
+from payment import YooKassaClient, render_qr, cleanup_legacy_qr_files
 
 # Настройка логирования
 logging.basicConfig(
@@ -61,12 +131,78 @@ if not wait_for_db(DB_URI):
     logger.error("❌ Failed to connect to database after multiple attempts")
     exit(1)
 
-# Теперь можно инициализировать базу данных
-db = Database(DB_URI)
+# Пул соединений создаётся в on_startup, внутри event loop
+db = AsyncDatabase(
+    DB_URI,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    command_timeout=DB_COMMAND_TIMEOUT_SEC,
+    lot_cache_size=LOT_CACHE_SIZE,
+    lot_cache_ttl=LOT_CACHE_TTL_SEC,
+    user_cache_size=USER_CACHE_SIZE,
+    user_cache_ttl=USER_CACHE_TTL_SEC,
+)
 
-bot = Bot(token=API_TOKEN)
+# Горячее состояние активных лотов в Redis (HOT_STATE_BACKEND=redis), иначе ставки идут в Postgres
+hot_state = RedisHotState.from_url(REDIS_HOST, REDIS_PORT) if HOT_STATE_BACKEND == "redis" else None
+
+if TELEGRAM_API_SERVER:
+    bot = Bot(token=API_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER))
+else:
+    bot = Bot(token=API_TOKEN)
 dp = Dispatcher(bot)
+
+# Лимиты частоты в config заданы на весь бот, а бакеты и семафоры живут в памяти процесса.
+# С BOT_WORKERS воркерами (webhook) каждый получает свою долю, чтобы в сумме лимит не рос в N раз.
+WORKERS = BOT_WORKERS if BOT_MODE == "webhook" else 1
+
+# Ставки ограничиваются по частоте до хендлеров (без обращения к БД).
+# Приближение: скорость и запас делятся между воркерами, но не ниже одной ставки в секунду
+# и одной в запасе — апдейты пользователя обычно приходят в один воркер, и деление в N раз
+# молча ужесточило бы лимит. В худшем случае (апдейты по всем воркерам) суммарный лимит
+# выше заданного, но не больше чем в BOT_WORKERS раз.
+dp.middleware.setup(BidThrottlingMiddleware(
+    user_rate=per_worker(BID_USER_RATE_PER_SEC, WORKERS),
+    user_burst=per_worker(BID_USER_BURST, WORKERS),
+    lot_rate=per_worker(BID_LOT_RATE_PER_SEC, WORKERS),
+    lot_burst=per_worker(BID_LOT_BURST, WORKERS),
+))
 scheduler = AsyncIOScheduler(timezone=pytz.timezone(TIMEZONE))
+bid_notifier = BidNotifier(
+    bot,
+    hot_state.get_participants if hot_state else db.get_participants,
+    window_sec=NOTIFY_COALESCE_SEC,
+    concurrency=int(per_worker(NOTIFY_CONCURRENCY, WORKERS)),
+)
+
+yookassa = YooKassaClient(
+    max_connections=YOOKASSA_MAX_CONNECTIONS,
+    concurrency=YOOKASSA_CONCURRENCY,
+    retries=YOOKASSA_RETRIES,
+)
+
+# file_id загруженных картинок лотов: повторные отправки не скачивают их заново
+media_cache = MediaCache(bot, db, prefetch_chat=MEDIA_PREFETCH_CHAT or None, concurrency=MEDIA_CHECK_CONCURRENCY)
+
+# Telegram ограничивает частоту сообщений в один канал (~20 в минуту);
+# публикации лотов берут токены вне очереди, правки постов ждут.
+# Лимит канала общий для всех воркеров, поэтому скорость делится без нижней границы
+channel_limiter = TokenBucket(
+    rate=per_worker(CHANNEL_POSTS_PER_MIN / 60, WORKERS, minimum=0),
+    capacity=per_worker(CHANNEL_POSTS_BURST, WORKERS),
+)
+
+# Последняя карточка лота в ЛС: (user_id, auction_id) -> (message_id, photo/text)
+personal_cards = TTLCache(maxsize=PERSONAL_CARDS_CACHE_SIZE, ttl=PERSONAL_CARDS_TTL_SEC)
+
+# Задачи, которые выполняет только ведущая реплика (LISTEN платежей, запись ставок из Redis)
+leader_tasks: set[asyncio.Task] = set()
+
+# Фоновые задачи (ссылки держим, чтобы задачи не собрал GC)
+background_tasks: set[asyncio.Task] = set()
+
+# Отпечаток листа лотов, успешно записанного в БД (для инкрементальной синхронизации)
+sheets_fingerprint: str | None = None
 
 
 # ========== ХЕЛПЕРЫ ==========
@@ -81,52 +217,141 @@ def format_dt(dt: datetime.datetime | None) -> str:
     return dt.strftime("%Y-%m-%d %H:%M")
 
 
-def format_remaining(end_time: datetime.datetime | None) -> str:
+def as_local(dt: datetime.datetime) -> datetime.datetime:
+    """Колонки TIMESTAMP приходят из БД без зоны — считаем их временем TIMEZONE"""
+    tz = pytz.timezone(TIMEZONE)
+    return tz.localize(dt) if dt.tzinfo is None else dt.astimezone(tz)
+
+
+async def get_live_lot(auction_id: int, fresh: bool = False):
+    """Лот из БД; с hot_state цена и end_time берутся из Redis (БД может отставать)"""
+    lot = await db.get_lot(auction_id, fresh=fresh)
+    if hot_state is not None and lot and lot.get('status') == "active":
+        await hot_state.overlay(lot)
+    return lot
+
+
+async def place_bid(auction_id: int, user_id: int, amount=None, increment=None) -> dict:
+    """Ставка через Redis (hot_state) или одним запросом к Postgres"""
+    if hot_state is None:
+        return await db.place_bid(auction_id, user_id, amount=amount, increment=increment)
+
+    result = await hot_state.place_bid(auction_id, user_id, amount=amount, increment=increment)
+    if result['outcome'] != "not_found":
+        return result
+
+    # Лота нет в Redis (ещё не загружен или Redis перезапускался) — подгружаем из БД
+    # мимо кэша: загруженное состояние LOAD_LOT_LUA уже не перезапишет
+    lot = await db.get_lot(auction_id, fresh=True)
+    if not lot:
+        return result
+    if lot.get('status') != "active" or not lot.get('end_time'):
+        return {**result, 'outcome': "not_active", 'previous_price': lot.get('current_price')}
+    participants = [row.get('user_id') for row in await db.get_participants(auction_id)]
+    await hot_state.load_lot(lot, participants)
+    return await hot_state.place_bid(auction_id, user_id, amount=amount, increment=increment)
+
+
+async def mirror_ban(user_id: int, until: datetime.datetime | None):
+    """Бан из БД дублируется в Redis: там его проверяет скрипт ставки (hot_state)"""
+    if hot_state is not None:
+        await hot_state.set_ban(user_id, until)
+
+
+def lot_main_image(lot) -> str | None:
+    """Первая картинка лота (колонка images — JSON-массив URL)"""
+    images_raw = lot.get('images')
+    images = []
+    if images_raw:
+        try:
+            images = json.loads(images_raw) if isinstance(images_raw, str) else images_raw
+        except ValueError:
+            images = [images_raw] if isinstance(images_raw, str) else []
+    return images[0] if images else None
+
+
+def format_remaining(end_time: datetime.datetime | None, coarse: bool = False) -> str:
+    """Время до окончания. coarse — для поста в канале: шаг 15 минут, за час до конца 5 минут,
+    в последние 10 минут поминутно; подпись меняется редко и правок поста меньше"""
     if not end_time:
         return "—"
+    end_time = as_local(end_time)
     now = datetime.datetime.now(pytz.timezone(TIMEZONE))
     delta = end_time - now
     if delta.total_seconds() <= 0:
         return "завершается"
     minutes = int(delta.total_seconds() // 60)
+    if coarse:
+        step = 15 if minutes >= 60 else 5 if minutes >= 10 else 1
+        minutes -= minutes % step
     hours = minutes // 60
     minutes = minutes % 60
     return f"{hours} ч {minutes} мин"
 
 
-async def sync_lots_from_sheets():
-    """Читает базу лотов из Google Sheets и создаёт новые в БД."""
+async def sync_lots_from_sheets(force: bool = False):
+    """Читает базу лотов из Google Sheets, создаёт новые и обновляет изменённые pending-лоты.
+    В инкрементальном режиме без изменений в листе обходится одним запросом к API."""
+    global sheets_fingerprint
     try:
-        logger.info("🔄 Начинаю синхронизацию с Google Sheets...")
-        lots = fetch_base_lots()
+        logger.debug("🔄 Начинаю синхронизацию с Google Sheets...")
+        known = None if force or SHEETS_SYNC_MODE == "full" else sheets_fingerprint
+
+        # Запрос к Google выполняется в потоке, чтобы не блокировать event loop
+        fingerprint, lots = await asyncio.to_thread(fetch_base_lots_incremental, known)
+        if lots is None:
+            return
+
         logger.info(f"📥 Получено {len(lots)} лотов из Google Sheets")
 
-        for lot in lots:
-            auction_id = lot["auction_id"]
-            if not db.lot_exists(auction_id):
-                db.create_lot(
-                    auction_id=auction_id,
-                    name=lot["name"],
-                    article=lot["article"],
-                    start_price=lot["start_price"],
-                    images=lot["images"],
-                    video_url=lot["video_url"],
-                    description=lot["description"],
-                    start_time=lot["start_time"],
-                )
-                logger.info(f"✅ Создан лот {auction_id} из Google Sheets")
-            else:
-                logger.debug(f"Лот {auction_id} уже существует в БД")
+        result = await db.sync_lots(lots)
+        start_times = {lot["auction_id"]: lot["start_time"] for lot in lots}
+        for auction_id in result["created"]:
+            await db.ensure_bid_partition(auction_id)
+            lot_timers.arm_start(auction_id, start_times[auction_id])
+            logger.info(f"✅ Создан лот {auction_id} из Google Sheets")
+        for auction_id in result["updated"]:
+            lot_timers.arm_start(auction_id, start_times[auction_id])
+            logger.info(f"✏️ Обновлён лот {auction_id} по изменённой строке таблицы")
+
+        sheets_fingerprint = fingerprint
+
+        changed = set(result["created"]) | set(result["updated"])
+        await check_lot_images([lot for lot in lots if lot["auction_id"] in changed])
 
     except Exception as e:
         logger.error(f"❌ Ошибка синхронизации с Google Sheets: {e}")
 
 
-async def start_auction(auction_id: int):
-    """Перевод лота в active, установка end_time и публикация в канал."""
+async def check_lot_images(lots: list[dict]):
+    """Проверка картинок новых/изменённых лотов до старта; о битых ссылках узнают админы"""
+    main_images = {lot["auction_id"]: lot_main_image(lot) for lot in lots}
+    broken = await media_cache.prefetch(url for url in main_images.values() if url)
+    if not broken:
+        return
+
+    lines = [
+        f"№{auction_id}: {url} — {broken[url]}"
+        for auction_id, url in main_images.items()
+        if url in broken
+    ]
+    logger.warning(f"⚠️ Битые картинки лотов: {'; '.join(lines)}")
+    text = "⚠️ <b>Битые картинки лотов:</b>\n\n" + "\n".join(lines)
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text, parse_mode="HTML", disable_web_page_preview=True)
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки админу {admin_id}: {e}")
+
+
+async def start_auction(auction_id: int, force: bool = False, publish: bool = True):
+    """Перевод лота в active, установка end_time, таймера завершения и публикация в канал.
+    Без force срабатывает только для pending-лота, время старта которого наступило.
+    Возвращает запущенный лот; с publish=False публикацию выполняет вызывающий."""
     try:
         logger.info(f"🚀 Запуск аукциона {auction_id}")
-        lot = db.get_lot(auction_id)
+        # Мимо кэша: статус мог смениться в другом процессе или реплике
+        lot = await db.get_lot(auction_id, fresh=True)
         if not lot:
             logger.warning(f"❌ Попытка стартовать несуществующий аукцион {auction_id}")
             return
@@ -140,217 +365,271 @@ async def start_auction(auction_id: int):
         if isinstance(start_time, str):
             start_time = datetime.datetime.fromisoformat(start_time)
 
+        if not force:
+            if status != "pending":
+                logger.info(f"ℹ️ Аукцион {auction_id} в статусе {status}, старт по таймеру пропущен")
+                return
+            if as_local(start_time) > datetime.datetime.now(pytz.timezone(TIMEZONE)):
+                # Время старта перенесли в таблице после установки таймера
+                lot_timers.arm_start(auction_id, start_time)
+                return
+
+        # Секция журнала ставок обычно создана ещё при синхронизации;
+        # без неё ставки по лоту некуда писать — старт повторяется через минуту
+        if not await db.ensure_bid_partition(auction_id):
+            logger.warning(f"⏳ Нет секции ставок для аукциона {auction_id}, старт отложен")
+            retry_at = datetime.datetime.now(pytz.timezone(TIMEZONE)) + datetime.timedelta(minutes=1)
+            lot_timers.arm_start(auction_id, retry_at)
+            return
+
         end_time = start_time + datetime.timedelta(hours=AUCTION_DURATION_HOURS)
-        db.set_lot_end_time(auction_id, end_time)
-        db.set_lot_status(auction_id, "active")
+        # Статус меняется условно: второй одновременный запуск ничего не изменит
+        lot = await db.start_lot(auction_id, end_time, force=force)
+        if lot is None:
+            logger.info(f"ℹ️ Аукцион {auction_id} уже запущен или не готов к старту")
+            return
+        lot_timers.arm_finish(auction_id, lot['end_time'])
+        if hot_state is not None:
+            await hot_state.load_lot(lot)
+
+        if not publish:
+            logger.info(f"✅ Аукцион {auction_id} запущен")
+            return lot
 
         await publish_lot_to_channel(auction_id, lot)
         logger.info(f"✅ Аукцион {auction_id} успешно запущен и опубликован в канале")
+        return lot
 
     except Exception as e:
         logger.error(f"❌ Ошибка запуска аукциона {auction_id}: {e}")
 
 
-async def publish_lot_to_channel(auction_id: int, lot):
-    """Публикация карточки лота в канал AUCTION_CHANNEL"""
-    try:
-        name = lot.get('name', 'Неизвестно')
-        article = lot.get('article', 'Не указан')
-        start_price = float(lot.get('start_price', 0))
-        current_price = float(lot.get('current_price', start_price))
-        description = lot.get('description', '')
-
-        end_time = lot.get('end_time')
-        if end_time and isinstance(end_time, str):
-            end_time = datetime.datetime.fromisoformat(end_time)
-
-        remaining = format_remaining(end_time)
+def render_channel_post(auction_id: int, lot) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Подпись и клавиатура поста лота в канале по текущему состоянию лота"""
+    name = lot.get('name', 'Неизвестно')
+    article = lot.get('article', 'Не указан')
+    start_price = float(lot.get('start_price', 0))
+    current_price = float(lot.get('current_price') or start_price)
+    description = lot.get('description', '')
 
+    if lot.get('status') == "finished":
         caption = (
             f"🧾 Аукцион №{auction_id}\n\n"
             f"🛒 Товар: {name}\n"
             f"📋 Артикул: {article}\n"
             f"💰 Стартовая цена: {start_price}₽\n"
-            f"💎 Текущее предложение: {current_price}₽\n"
-            f"⏳ До окончания: {remaining}\n\n"
-            f"📝 Описание: {description}\n\n"
-            f"👇 Нажмите кнопку ниже, чтобы участвовать в аукционе"
+            f"🏁 Аукцион завершён. Итоговая цена: {current_price}₽\n\n"
+            f"📝 Описание: {description}"
         )
+        return caption, None
+
+    end_time = lot.get('end_time')
+    if end_time and isinstance(end_time, str):
+        end_time = datetime.datetime.fromisoformat(end_time)
+
+    remaining = format_remaining(end_time, coarse=True)
+
+    caption = (
+        f"🧾 Аукцион №{auction_id}\n\n"
+        f"🛒 Товар: {name}\n"
+        f"📋 Артикул: {article}\n"
+        f"💰 Стартовая цена: {start_price}₽\n"
+        f"💎 Текущее предложение: {current_price}₽\n"
+        f"⏳ До окончания: {remaining}\n\n"
+        f"📝 Описание: {description}\n\n"
+        f"👇 Нажмите кнопку ниже, чтобы участвовать в аукционе"
+    )
 
-        kb = InlineKeyboardMarkup()
-        kb.add(InlineKeyboardButton("🎯 Участвовать в аукционе", callback_data=f"join:{auction_id}"))
+    kb = InlineKeyboardMarkup()
+    kb.add(InlineKeyboardButton("🎯 Участвовать в аукционе", callback_data=f"join:{auction_id}"))
+    return caption, kb
 
-        # Если есть картинки
-        images_raw = lot.get('images')
-        images = []
-        if images_raw:
-            try:
-                images = json.loads(images_raw) if isinstance(images_raw, str) else images_raw
-            except:
-                images = [images_raw] if isinstance(images_raw, str) else []
 
-        if images and len(images) > 0:
-            main_image = images[0]
+async def publish_lot_to_channel(auction_id: int, lot):
+    """Публикация карточки лота в канал AUCTION_CHANNEL; id поста сохраняется для живых правок"""
+    try:
+        caption, kb = render_channel_post(auction_id, lot)
+
+        main_image = lot_main_image(lot)
+        if main_image:
             try:
-                await bot.send_photo(
+                await channel_limiter.acquire(urgent=True)
+                sent = await media_cache.send_photo(
                     AUCTION_CHANNEL,
-                    photo=main_image,
+                    main_image,
                     caption=caption,
                     reply_markup=kb,
                     parse_mode="HTML"
                 )
+                await db.set_channel_message(auction_id, sent.message_id, "photo")
                 logger.info(f"✅ Лот {auction_id} опубликован в канал с фото")
                 return
             except Exception as e:
                 logger.error(f"❌ Ошибка отправки фото в канал: {e}")
 
         # Если нет фото или ошибка - отправляем текстом
-        await bot.send_message(AUCTION_CHANNEL, caption, reply_markup=kb, parse_mode="HTML")
+        await channel_limiter.acquire(urgent=True)
+        sent = await bot.send_message(AUCTION_CHANNEL, caption, reply_markup=kb, parse_mode="HTML")
+        await db.set_channel_message(auction_id, sent.message_id, "text")
         logger.info(f"✅ Лот {auction_id} опубликован в канал (текст)")
 
     except Exception as e:
         logger.error(f"❌ Ошибка публикации лота {auction_id} в канал: {e}")
 
 
-async def notify_participants_new_bid(auction_id: int, bidder_id: int, amount):
-    """Уведомление всех участников о новой ставке"""
-    try:
-        participants = db.get_participants(auction_id)
-        for participant in participants:
-            uid = participant.get('user_id')
-            if uid == bidder_id:
-                continue
-            try:
-                await bot.send_message(
-                    uid,
-                    f"🔔 Новая ставка по аукциону №{auction_id}!\n"
-                    f"💰 Сумма: {amount}₽\n\n"
-                    f"Проверьте свою карточку лота, чтобы сделать ставку!",
-                )
-            except Exception as e:
-                logger.debug(f"Не удалось отправить уведомление пользователю {uid}: {e}")
-    except Exception as e:
-        logger.error(f"❌ Ошибка уведомления участников: {e}")
+def render_personal_card(auction_id: int, lot, note: str | None = None) -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура карточки лота в ЛС; note выводится над карточкой"""
+    name = lot.get('name', 'Неизвестно')
+    article = lot.get('article', 'Не указан')
+    current_price = float(lot.get('current_price', 0))
+    description = lot.get('description', '')
 
+    end_time = lot.get('end_time')
+    if end_time and isinstance(end_time, str):
+        end_time = datetime.datetime.fromisoformat(end_time)
 
-async def send_personal_lot_card(user_id: int, auction_id: int):
-    """Карточка лота в ЛС пользователя"""
-    try:
-        lot = db.get_lot(auction_id)
-        if not lot:
-            await bot.send_message(user_id, "Такого аукциона не существует.")
-            return
+    remaining = format_remaining(end_time)
 
-        name = lot.get('name', 'Неизвестно')
-        article = lot.get('article', 'Не указан')
-        current_price = float(lot.get('current_price', 0))
-        description = lot.get('description', '')
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("+50₽", callback_data=f"bidquick:{auction_id}:50"),
+        InlineKeyboardButton("+100₽", callback_data=f"bidquick:{auction_id}:100"),
+        InlineKeyboardButton("+200₽", callback_data=f"bidquick:{auction_id}:200"),
+    )
+    kb.add(InlineKeyboardButton("✏️ Ввести свою сумму", callback_data=f"bidcustom:{auction_id}"))
+
+    text = (
+        f"💼 Ваш лот №{auction_id}\n\n"
+        f"🛒 Товар: {name}\n"
+        f"📋 Артикул: {article}\n"
+        f"💰 Текущая цена: {current_price}₽\n"
+        f"⏳ До окончания: {remaining}\n\n"
+        f"📝 Описание: {description}\n\n"
+        f"👇 Выберите быстрый шаг или введите свою сумму через /bid."
+    )
+    if note:
+        text = f"{note}\n\n{text}"
+    return text, kb
 
-        end_time = lot.get('end_time')
-        if end_time and isinstance(end_time, str):
-            end_time = datetime.datetime.fromisoformat(end_time)
 
-        remaining = format_remaining(end_time)
+def remember_personal_card(user_id: int, auction_id: int, message: types.Message):
+    """Запоминает последнюю карточку лота у пользователя, чтобы дальше править её"""
+    kind = "photo" if message.photo else "text"
+    personal_cards.set((user_id, auction_id), (message.message_id, kind))
 
-        kb = InlineKeyboardMarkup()
-        kb.row(
-            InlineKeyboardButton("+50₽", callback_data=f"bidquick:{auction_id}:50"),
-            InlineKeyboardButton("+100₽", callback_data=f"bidquick:{auction_id}:100"),
-            InlineKeyboardButton("+200₽", callback_data=f"bidquick:{auction_id}:200"),
-        )
-        kb.add(InlineKeyboardButton("✏️ Ввести свою сумму", callback_data=f"bidcustom:{auction_id}"))
 
-        text = (
-            f"💼 Ваш лот №{auction_id}\n\n"
-            f"🛒 Товар: {name}\n"
-            f"📋 Артикул: {article}\n"
-            f"💰 Текущая цена: {current_price}₽\n"
-            f"⏳ До окончания: {remaining}\n\n"
-            f"📝 Описание: {description}\n\n"
-            f"👇 Выберите быстрый шаг или введите свою сумму через /bid."
-        )
+async def send_personal_lot_card(user_id: int, auction_id: int, note: str | None = None):
+    """Карточка лота в ЛС пользователя (новым сообщением)"""
+    try:
+        lot = await get_live_lot(auction_id)
+        if not lot:
+            await bot.send_message(user_id, "Такого аукциона не существует.")
+            return
 
-        # Если есть фото
-        images_raw = lot.get('images')
-        images = []
-        if images_raw:
-            try:
-                images = json.loads(images_raw) if isinstance(images_raw, str) else images_raw
-            except:
-                images = [images_raw] if isinstance(images_raw, str) else []
+        text, kb = render_personal_card(auction_id, lot, note)
 
-        if images and len(images) > 0:
-            main_image = images[0]
+        main_image = lot_main_image(lot)
+        if main_image:
             try:
-                await bot.send_photo(user_id, photo=main_image, caption=text, reply_markup=kb, parse_mode="HTML")
+                sent = await media_cache.send_photo(user_id, main_image, caption=text, reply_markup=kb, parse_mode="HTML")
+                remember_personal_card(user_id, auction_id, sent)
                 return
             except Exception as e:
                 logger.error(f"❌ Ошибка отправки фото в ЛС: {e}")
 
-        await bot.send_message(user_id, text, reply_markup=kb, parse_mode="HTML")
+        sent = await bot.send_message(user_id, text, reply_markup=kb, parse_mode="HTML")
+        remember_personal_card(user_id, auction_id, sent)
     except Exception as e:
         logger.error(f"❌ Ошибка отправки карточки лота {auction_id}: {e}")
         await bot.send_message(user_id, f"Ошибка загрузки лота №{auction_id}")
 
 
-async def finish_auction(auction_id: int):
-    """Завершение аукциона"""
+async def update_personal_lot_card(user_id: int, auction_id: int, note: str | None = None):
+    """Обновляет последнюю карточку лота у пользователя на месте;
+    новое сообщение отправляется, только если править нечего или правка не удалась"""
+    card = personal_cards.get((user_id, auction_id))
+    lot = await get_live_lot(auction_id) if card else None
+    if card and lot:
+        message_id, kind = card
+        text, kb = render_personal_card(auction_id, lot, note)
+        try:
+            if kind == "photo":
+                await bot.edit_message_caption(user_id, message_id, caption=text, reply_markup=kb, parse_mode="HTML")
+            else:
+                await bot.edit_message_text(text, user_id, message_id, reply_markup=kb, parse_mode="HTML")
+            return
+        except MessageNotModified:
+            return
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось обновить карточку лота {auction_id} у {user_id}: {e}")
+            personal_cards.invalidate((user_id, auction_id))
+
+    await send_personal_lot_card(user_id, auction_id, note)
+
+
+async def finish_auction(auction_id: int, force: bool = False):
+    """Завершение аукциона: лот закрывается для ставок, затем оплату предлагают старшей ставке.
+    Ожидание оплаты ведёт job_advance_payments по записи в payments.
+    Без force лот, чей end_time успели продлить, не закрывается — таймер переставляется."""
     try:
         logger.info(f"🏁 Завершение аукциона {auction_id}")
-        bids = db.get_bids_desc(auction_id)
-        lot = db.get_lot(auction_id)
+        # Мимо кэша: лот мог завершить или продлить другой процесс
+        lot = await db.get_lot(auction_id, fresh=True)
         if not lot:
             return
 
-        name = lot.get('name')
-        article = lot.get('article')
-        start_price = float(lot.get('start_price', 0))
-
-        if not bids:
-            db.set_lot_status(auction_id, "finished")
-            try:
-                append_report_row(auction_id, name, article, start_price, None, "Ставок не было")
-            except Exception as e:
-                logger.error(f"❌ Ошибка записи в отчет: {e}")
-            logger.info(f"📝 Аукцион {auction_id} завершен без ставок")
+        if lot.get('status') == "finished":
+            logger.info(f"ℹ️ Аукцион {auction_id} уже завершён")
             return
 
-        db.set_lot_status(auction_id, "finished")
+        if hot_state is not None:
+            # Закрываем приём ставок в Redis, если ставка не успела продлить лот,
+            # и дописываем в БД все принятые ставки до выбора победителя
+            extended_to = await hot_state.close_lot(auction_id, force=force)
+            if extended_to:
+                lot_timers.arm_finish(auction_id, extended_to)
+                return
+            await hot_state.drain(db)
+
+        # Статус меняется условно (end_time наступил или force); строка отчёта
+        # «Ставок не было» уходит в outbox в той же транзакции
+        finished = await db.finish_lot(auction_id, force=force, no_bids_report="Ставок не было")
+        if finished is None:
+            # Ставка успела продлить лот — переставляем таймер на новый end_time
+            lot = await db.get_lot(auction_id, fresh=True)
+            if lot and lot.get('status') == "active" and lot.get('end_time'):
+                lot_timers.arm_finish(auction_id, lot.get('end_time'))
+            return
 
-        for bid in bids:
-            user_id = bid.get('user_id')
-            final_price = float(bid.get('amount', 0))
+        lot_timers.cancel(auction_id)
+        channel_updater.mark_dirty(auction_id)
+        if not finished['has_bids']:
+            logger.info(f"📝 Аукцион {auction_id} завершен без ставок")
+            return
 
-            logger.info(f"👑 Победитель аукциона {auction_id}: пользователь {user_id}, цена {final_price}₽")
-
-            ok = await process_winner_payment_cycle(
-                auction_id, user_id, name, article, start_price, final_price
-            )
-            if ok:
-                break
+        # Победитель выбирается после закрытия: новых ставок по лоту уже не будет
+        bidder = await db.get_next_bidder(auction_id)
+        if bidder:
+            await offer_lot_to_bidder(auction_id, bidder.get('user_id'), float(bidder.get('amount', 0)))
 
     except Exception as e:
         logger.error(f"❌ Ошибка завершения аукциона {auction_id}: {e}")
 
 
-async def process_winner_payment_cycle(
-        auction_id: int,
-        user_id: int,
-        name: str,
-        article: str,
-        start_price: float,
-        final_price: float,
-) -> bool:
-    """Цикл оплаты для победителя с ЮKassa"""
+async def offer_lot_to_bidder(auction_id: int, user_id: int, final_price: float):
+    """Назначает победителя, создаёт платёж с дедлайном и отправляет ссылку с QR-кодом"""
     try:
-        db.set_winner(auction_id, user_id)
+        logger.info(f"👑 Победитель аукциона {auction_id}: пользователь {user_id}, цена {final_price}₽")
+        lot = await db.get_lot(auction_id)
+        name = lot.get('name') if lot else None
 
         # Генерируем платежную ссылку
-        payment_url, payment_id = generate_payment_url(auction_id, user_id, final_price)
-        db.insert_payment(auction_id, user_id, final_price, payment_id, "pending")
+        payment_url, payment_id = await yookassa.create_payment(auction_id, user_id, final_price)
+        expires_at = datetime.datetime.now() + datetime.timedelta(minutes=PAYMENT_TIMEOUT_MIN)
+        await db.create_payment_offer(auction_id, user_id, final_price, payment_id, payment_url, expires_at)
 
-        # Генерируем QR-код
-        qr_path = generate_qr(payment_url)
+        # Генерируем QR-код (в памяти, вне event loop)
+        qr_png = await render_qr(payment_url)
 
         text = (
             f"🎉 ПОЗДРАВЛЯЕМ! Вы стали победителем аукциона №{auction_id}!\n\n"
@@ -362,47 +641,116 @@ async def process_winner_payment_cycle(
         )
 
         try:
-            with open(qr_path, "rb") as f:
-                await bot.send_photo(user_id, f, caption=text, parse_mode="HTML")
+            if qr_png is None:
+                raise ValueError("QR-код не сгенерирован")
+            qr_file = types.InputFile(io.BytesIO(qr_png), filename=f"qr_{auction_id}.png")
+            await bot.send_photo(user_id, qr_file, caption=text, parse_mode="HTML")
             logger.info(f"✅ QR-код отправлен победителю {user_id} аукциона {auction_id}")
         except Exception as e:
             logger.error(f"❌ Ошибка отправки QR-кода: {e}")
             await bot.send_message(user_id, text, parse_mode="HTML")
 
-        # Ждем оплаты
         logger.info(f"⏳ Ожидание оплаты от пользователя {user_id} для аукциона {auction_id}")
-        for i in range(PAYMENT_TIMEOUT_MIN * 2):  # Проверяем каждые 30 секунд
-            await asyncio.sleep(30)
 
-            # Проверяем статус платежа
-            status = check_payment_status(payment_id)
-            if status == "succeeded":
-                db.update_payment_status(auction_id, user_id, "completed")
-                try:
-                    append_report_row(auction_id, name, article, start_price, final_price, "Оплата совершена")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка записи в отчет: {e}")
-                logger.info(f"✅ Оплата подтверждена для аукциона {auction_id}")
-                return True
-
-            logger.debug(f"Проверка оплаты {i+1}/{PAYMENT_TIMEOUT_MIN*2}: статус {status}")
-
-        # Время вышло, не оплатил
-        db.add_warning_auto_ban(user_id, BAN_DAYS)
+    except Exception as e:
+        logger.error(f"❌ Ошибка предложения оплаты по аукциону {auction_id}: {e}")
+
+
+async def confirm_payment(payment_id: str):
+    """Оплата получена: фиксируем её, ставим строку отчёта в outbox и сообщаем победителю"""
+    payment = await db.complete_payment(payment_id, report_status="Оплата совершена")
+    if not payment:
+        return
+
+    auction_id = payment.get('auction_id')
+    user_id = payment.get('user_id')
+    logger.info(f"✅ Оплата подтверждена для аукциона {auction_id}")
+    try:
+        await bot.send_message(
+            user_id,
+            f"✅ Оплата по аукциону №{auction_id} получена. Спасибо!",
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки подтверждения оплаты: {e}")
+
+
+def on_payment_event(payload: str):
+    """NOTIFY от webhook.py: оплата подтверждается сразу, без ожидания опроса"""
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        logger.warning(f"⚠️ Некорректное событие платежа: {payload}")
+        return
+
+    if event.get('status') != "completed" or not event.get('payment_id'):
+        return
+
+    logger.info(f"🔔 Webhook: оплата {event.get('payment_id')} по аукциону {event.get('auction_id')}")
+    task = asyncio.create_task(confirm_payment(event.get('payment_id')))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def handle_payment_expired(payment: dict):
+    """Время оплаты вышло: предупреждение/бан и предложение лота следующей ставке"""
+    auction_id = payment.get('auction_id')
+    user_id = payment.get('user_id')
+
+    banned_until = await db.add_warning_auto_ban(user_id, BAN_DAYS)
+    if banned_until:
         try:
-            await bot.send_message(
-                user_id,
-                "⏰ Время оплаты истекло. Результат аукциона пересмотрен, вы можете получить предупреждение/бан.",
-            )
+            await mirror_ban(user_id, banned_until)
         except Exception as e:
-            logger.error(f"❌ Ошибка отправки сообщения о таймауте: {e}")
+            logger.error(f"❌ Не удалось передать бан {user_id} в Redis: {e}")
+    try:
+        await bot.send_message(
+            user_id,
+            "⏰ Время оплаты истекло. Результат аукциона пересмотрен, вы можете получить предупреждение/бан.",
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки сообщения о таймауте: {e}")
 
-        logger.warning(f"⏰ Таймаут оплаты для пользователя {user_id} (аукцион {auction_id})")
-        return False
+    logger.warning(f"⏰ Таймаут оплаты для пользователя {user_id} (аукцион {auction_id})")
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка в цикле оплаты для аукциона {auction_id}: {e}")
-        return False
+    bidder = await db.get_next_bidder(auction_id)
+    if not bidder:
+        logger.warning(f"⚠️ Аукцион {auction_id}: не осталось участников для оплаты")
+        return
+
+    await offer_lot_to_bidder(auction_id, bidder.get('user_id'), float(bidder.get('amount', 0)))
+
+
+async def start_auction_unpublished(auction_id: int):
+    return await start_auction(auction_id, publish=False)
+
+
+async def get_channel_lot(auction_id: int):
+    # Пост правят все воркеры: кэш лота в воркере не знает о ставках, принятых соседями
+    return await get_live_lot(auction_id, fresh=WORKERS > 1)
+
+
+# Живой пост лота в канале: правки по ставкам объединяются, время обновляется пакетно.
+# Каждый воркер правит пост сам, поэтому интервал правок у воркера в WORKERS раз длиннее
+channel_updater = ChannelPostUpdater(
+    bot,
+    AUCTION_CHANNEL,
+    get_lot=get_channel_lot,
+    render=render_channel_post,
+    limiter=channel_limiter,
+    min_interval_sec=CHANNEL_EDIT_INTERVAL_SEC * WORKERS,
+)
+
+
+# Старты/завершения, сработавшие одновременно, обрабатываются пакетом параллельно
+lifecycle = LifecycleExecutor(
+    on_start=start_auction_unpublished,
+    on_publish=publish_lot_to_channel,
+    on_finish=finish_auction,
+    concurrency=LIFECYCLE_CONCURRENCY,
+)
+
+# Точные таймеры старта/завершения лотов (вместо поминутного опроса таблицы lots)
+lot_timers = LotTimers(scheduler, lifecycle.submit_start, lifecycle.submit_finish, enabled=not LEADER_ELECTION)
 
 
 # ========== HANDLERS ==========
@@ -412,16 +760,12 @@ async def cmd_start(message: types.Message):
     try:
         user_id = message.from_user.id
         user_name = message.from_user.full_name
-        db.upsert_user(user_id, user_name)
+        user = await db.upsert_user(user_id, user_name)
 
-        user = db.get_user(user_id)
         banned_text = ""
-        if user and user.get('banned_until'):
-            banned_until = user.get('banned_until')
-            if isinstance(banned_until, str):
-                banned_until = datetime.datetime.fromisoformat(banned_until)
-            if banned_until > datetime.datetime.now():
-                banned_text = f"\n\n⚠ Вы заблокированы для участия до {format_dt(banned_until)}"
+        banned_until = active_ban_until(user)
+        if banned_until:
+            banned_text = f"\n\n⚠ Вы заблокированы для участия до {format_dt(banned_until)}"
 
         kb = InlineKeyboardMarkup()
         kb.row(
@@ -467,7 +811,7 @@ async def cb_help(callback: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data == "view_auctions")
 async def cb_view_auctions(callback: types.CallbackQuery):
     try:
-        rows = db.get_active_or_pending_lots()
+        rows = await db.get_active_or_pending_lots()
         if not rows:
             await callback.message.answer("📭 Сейчас нет активных аукционов.\n\nЗагляните позже!")
             await callback.answer()
@@ -493,17 +837,7 @@ async def cb_view_auctions(callback: types.CallbackQuery):
 async def cb_my_auctions(callback: types.CallbackQuery):
     try:
         user_id = callback.from_user.id
-        rows = db.fetchall(
-            """
-            SELECT DISTINCT b.auction_id, l.start_time, l.status
-            FROM bids b
-            JOIN lots l ON b.auction_id = l.auction_id
-            WHERE b.user_id = %s
-            ORDER BY l.start_time DESC
-            LIMIT 10
-            """,
-            (user_id,),
-        )
+        rows = await db.get_user_auctions(user_id, limit=10)
 
         if not rows:
             await callback.message.answer("📭 Вы ещё не участвовали в аукционах.\n\nВыберите активный аукцион и сделайте свою первую ставку!")
@@ -532,17 +866,11 @@ async def cb_join(callback: types.CallbackQuery):
     try:
         user_id = callback.from_user.id
         user_name = callback.from_user.full_name
-        db.upsert_user(user_id, user_name)
-
-        user = db.get_user(user_id)
-        if user and user.get('banned_until'):
-            banned_until = user.get('banned_until')
-            if isinstance(banned_until, str):
-                banned_until = datetime.datetime.fromisoformat(banned_until)
-            if banned_until > datetime.datetime.now():
-                await callback.message.answer("🚫 Вы временно заблокированы для участия в аукционах.")
-                await callback.answer()
-                return
+        user = await db.upsert_user(user_id, user_name)
+        if active_ban_until(user):
+            await callback.message.answer("🚫 Вы временно заблокированы для участия в аукционах.")
+            await callback.answer()
+            return
 
         _, auction_id_str = callback.data.split(":")
         auction_id = int(auction_id_str)
@@ -569,16 +897,8 @@ async def cb_bidquick(callback: types.CallbackQuery):
         auction_id = int(auction_id_str)
         delta = int(delta_str)
 
-        lot = db.get_lot(auction_id)
-        if not lot or lot.get('status') != "active":
-            await callback.message.answer("❌ Этот аукцион не активен.")
-            await callback.answer()
-            return
-
-        current_price = float(lot.get('current_price', 0))
-        amount = current_price + delta
-        await process_bid(callback.message, user_id, auction_id, amount)
-        await callback.answer()
+        # Сумма считается от актуальной цены внутри той же транзакции, что и ставка
+        await process_bid(callback.message, user_id, auction_id, increment=delta, callback=callback)
     except Exception as e:
         logger.error(f"❌ Ошибка быстрой ставки: {e}")
         await callback.answer("❌ Ошибка", show_alert=True)
@@ -638,21 +958,49 @@ async def process_bid(
         message_or_msg: types.Message,
         user_id: int,
         auction_id: int,
-        bid_amount: float,
+        bid_amount: float | None = None,
+        increment: int | None = None,
+        callback: types.CallbackQuery | None = None,
 ):
+    """Ставка: сумма bid_amount либо шаг increment от текущей цены.
+    Для кнопки на карточке (callback) итог показывается ответом на callback,
+    а сама карточка правится на месте."""
+
+    async def answer(text: str):
+        if callback is not None:
+            await callback.answer(text, show_alert=True)
+        else:
+            await message_or_msg.reply(text, parse_mode="HTML")
+
     try:
-        lot = db.get_lot(auction_id)
-        if not lot:
-            await message_or_msg.reply("❌ Такого аукциона не существует.")
+        # Бан проверяется по кэшу без транзакции; place_bid перепроверяет его в БД или в Redis
+        if await db.is_banned(user_id):
+            await answer("🚫 Вы заблокированы для участия в аукционах.")
             return
 
-        status = lot.get('status')
-        if status != "active":
-            await message_or_msg.reply("❌ Этот аукцион сейчас не активен.")
+        result = await place_bid(auction_id, user_id, amount=bid_amount, increment=increment)
+        outcome = result.get('outcome')
+
+        if outcome == "not_found":
+            await answer("❌ Такого аукциона не существует.")
+            return
+
+        if outcome == "not_active":
+            await answer("❌ Этот аукцион сейчас не активен.")
+            return
+
+        if outcome == "banned":
+            await answer("🚫 Вы заблокированы для участия в аукционах.")
             return
 
-        current_price = float(lot.get('current_price', 0))
-        if bid_amount < current_price + MIN_STEP:
+        if outcome == "too_low":
+            current_price = float(result.get('previous_price', 0))
+            if callback is not None:
+                await callback.answer(
+                    f"❌ Минимальная ставка: не менее {current_price + MIN_STEP}₽",
+                    show_alert=True,
+                )
+                return
             await message_or_msg.reply(
                 f"❌ <b>Минимальная ставка:</b> не менее {current_price + MIN_STEP}₽\n\n"
                 f"Текущая цена: {current_price}₽\n"
@@ -661,52 +1009,30 @@ async def process_bid(
             )
             return
 
-        # Проверяем бан пользователя
-        user = db.get_user(user_id)
-        if user and user.get('banned_until'):
-            banned_until = user.get('banned_until')
-            if isinstance(banned_until, str):
-                banned_until = datetime.datetime.fromisoformat(banned_until)
-            if banned_until > datetime.datetime.now():
-                await message_or_msg.reply("🚫 Вы заблокированы для участия в аукционах.")
-                return
-
-        # Делаем ставку
-        db.add_bid(auction_id, user_id, bid_amount)
-        db.update_current_price(auction_id, bid_amount)
-
+        bid_amount = float(result.get('amount'))
         logger.info(f"💰 Ставка на аукцион {auction_id}: пользователь {user_id}, сумма {bid_amount}₽")
 
-        # Правило 10 минут
-        end_time = lot.get('end_time')
-        if end_time:
-            if isinstance(end_time, str):
-                end_time = datetime.datetime.fromisoformat(end_time)
-
-            now = datetime.datetime.now(pytz.timezone(TIMEZONE))
-            remaining = (end_time - now).total_seconds()
-            if remaining < EXTEND_THRESHOLD_MIN * 60:
-                new_end = now + datetime.timedelta(minutes=EXTEND_TO_MIN)
-                db.set_lot_end_time(auction_id, new_end)
-                logger.info(f"⏰ Аукцион {auction_id} продлен до {new_end}")
-
-        # Уведомляем других участников
-        await notify_participants_new_bid(auction_id, user_id, bid_amount)
-
-        await message_or_msg.reply(
-            f"✅ <b>Ваша ставка принята!</b>\n\n"
-            f"💰 Сумма: {bid_amount}₽\n"
-            f"🎯 Аукцион №{auction_id}\n\n"
-            f"👇 Обновленная карточка лота:",
-            parse_mode="HTML"
-        )
+        # Правило 10 минут применяется тем же запросом; таймер завершения переставляем
+        if result.get('extended'):
+            lot_timers.arm_finish(auction_id, result.get('end_time'))
+            logger.info(f"⏰ Аукцион {auction_id} продлен до {result.get('end_time')}")
 
-        # Обновляем карточку у пользователя
-        await send_personal_lot_card(user_id, auction_id)
+        # Уведомляем других участников (в фоне, с объединением частых ставок)
+        bid_notifier.notify(auction_id, user_id, bid_amount)
+        channel_updater.mark_dirty(auction_id)
+
+        # Карточка правится на месте вместо отправки новой; отметка о ставке — в её заголовке
+        note = f"✅ <b>Ваша ставка {bid_amount}₽ принята!</b>"
+        if callback is not None:
+            remember_personal_card(user_id, auction_id, callback.message)
+            await callback.answer(f"✅ Ставка {bid_amount}₽ принята!")
+        else:
+            await message_or_msg.reply(note, parse_mode="HTML")
+        await update_personal_lot_card(user_id, auction_id, note)
 
     except Exception as e:
         logger.error(f"❌ Ошибка обработки ставки: {e}")
-        await message_or_msg.reply("❌ Ошибка обработки ставки.")
+        await answer("❌ Ошибка обработки ставки.")
 
 
 # ========== ТЕСТОВЫЕ КОМАНДЫ ==========
@@ -725,7 +1051,7 @@ async def cmd_test_publish(message: types.Message):
             return
 
         auction_id = int(parts[1])
-        lot = db.get_lot(auction_id)
+        lot = await db.get_lot(auction_id)
 
         if not lot:
             await message.reply(f"❌ Лот {auction_id} не найден")
@@ -777,11 +1103,11 @@ async def cmd_test_sync(message: types.Message):
             return
 
         await message.reply("🔄 Тест синхронизации с Google Sheets...")
-        await sync_lots_from_sheets()
+        await sync_lots_from_sheets(force=True)
         await message.reply("✅ Синхронизация завершена")
 
         # Показываем что синхронизировалось
-        rows = db.get_active_or_pending_lots()
+        rows = await db.get_active_or_pending_lots()
         if rows:
             await message.reply(f"📊 Синхронизировано лотов: {len(rows)}")
         else:
@@ -794,6 +1120,48 @@ async def cmd_test_sync(message: types.Message):
         await message.reply(f"❌ Ошибка: {str(e)[:100]}")
 
 
+@dp.message_handler(commands=["cache_stats"])
+async def cmd_cache_stats(message: types.Message):
+    """Статистика кэшей лотов и пользователей (для разработчика)"""
+    if not is_admin(message.from_user.id):
+        await message.reply("🚫 Нет прав")
+        return
+
+    titles = {"lots": "Кэш лотов", "users": "Кэш пользователей"}
+    blocks = [
+        f"🗄 <b>{titles[name]}:</b>\n"
+        f"Записей: {stats['size']}\n"
+        f"Попаданий: {stats['hits']}\n"
+        f"Промахов: {stats['misses']}\n"
+        f"Сбросов: {stats['invalidations']}\n"
+        f"Hit rate: {stats['hit_rate']:.1%}"
+        for name, stats in db.cache_stats().items()
+    ]
+    await message.reply("\n\n".join(blocks), parse_mode="HTML")
+
+
+@dp.message_handler(commands=["lifecycle_stats"])
+async def cmd_lifecycle_stats(message: types.Message):
+    """Тайминг последнего прогона старта/завершения лотов (для разработчика)"""
+    if not is_admin(message.from_user.id):
+        await message.reply("🚫 Нет прав")
+        return
+
+    run = lifecycle.last_run
+    if not run:
+        await message.reply("⚙️ Прогонов ещё не было")
+        return
+    await message.reply(
+        "⚙️ <b>Последний прогон лотов:</b>\n\n"
+        f"Стартов: {run['starts']}\n"
+        f"Завершений: {run['finishes']}\n"
+        f"Обработка: {run['process_sec']} с\n"
+        f"Публикаций: {run['published']}\n"
+        f"Всего: {run['total_sec']} с",
+        parse_mode="HTML"
+    )
+
+
 # ========== АДМИН-ХЕНДЛЕРЫ ==========
 
 @dp.message_handler(commands=["admin"])
@@ -843,7 +1211,7 @@ async def cb_admin_lots(callback: types.CallbackQuery):
         await callback.answer("🚫 Нет прав", show_alert=True)
         return
 
-    rows = db.get_active_or_pending_lots()
+    rows = await db.get_active_or_pending_lots()
     if not rows:
         await callback.message.answer("📭 Аукционов (pending/active) нет.")
     else:
@@ -872,7 +1240,7 @@ async def cb_admin_start(callback: types.CallbackQuery):
         return
     _, auction_id_str = callback.data.split(":")
     auction_id = int(auction_id_str)
-    await start_auction(auction_id)
+    await start_auction(auction_id, force=True)
     await callback.message.answer(f"✅ Форс-старт аукциона №{auction_id} выполнен.")
     await callback.answer()
 
@@ -884,7 +1252,7 @@ async def cb_admin_finish(callback: types.CallbackQuery):
         return
     _, auction_id_str = callback.data.split(":")
     auction_id = int(auction_id_str)
-    await finish_auction(auction_id)
+    await finish_auction(auction_id, force=True)
     await callback.message.answer(f"✅ Аукцион №{auction_id} принудительно завершён.")
     await callback.answer()
 
@@ -896,7 +1264,7 @@ async def cb_admin_sync(callback: types.CallbackQuery):
         return
 
     await callback.message.answer("🔄 Начинаю синхронизацию с Google Sheets...")
-    await sync_lots_from_sheets()
+    await sync_lots_from_sheets(force=True)
     await callback.message.answer("✅ Синхронизация завершена.")
     await callback.answer()
 
@@ -960,7 +1328,8 @@ async def cmd_ban(message: types.Message):
         days = int(days_str)
 
         until = datetime.datetime.now() + datetime.timedelta(days=days)
-        db.set_ban(user_id, until)
+        await db.set_ban(user_id, until)
+        await mirror_ban(user_id, until)
         await message.reply(f"✅ Пользователь {user_id} забанен до {format_dt(until)}.")
         logger.info(f"🔨 Бан пользователя {user_id} на {days} дней")
 
@@ -985,7 +1354,8 @@ async def cmd_unban(message: types.Message):
         _, user_id_str = parts
         user_id = int(user_id_str)
 
-        db.set_ban(user_id, None)
+        await db.set_ban(user_id, None)
+        await mirror_ban(user_id, None)
         await message.reply(f"✅ Бан с пользователя {user_id} снят.")
         logger.info(f"🔓 Разбан пользователя {user_id}")
 
@@ -1010,7 +1380,7 @@ async def cmd_warn(message: types.Message):
         _, user_id_str = parts
         user_id = int(user_id_str)
 
-        db.increment_warning(user_id)
+        await db.increment_warning(user_id)
         await message.reply(f"⚠ Пользователю {user_id} добавлено предупреждение.")
         logger.info(f"⚠ Предупреждение пользователю {user_id}")
 
@@ -1023,70 +1393,200 @@ async def cmd_warn(message: types.Message):
 
 # ========== SCHEDULER ==========
 
-async def job_sync_and_start():
-    """Задача для планировщика - автоматический запуск и завершение аукционов"""
+async def job_sync_lots():
+    """Задача для планировщика — синхронизация с Google Sheets.
+    Старт и завершение лотов ведут таймеры LotTimers, ставящиеся при синхронизации."""
     try:
         logger.debug("🔄 Запуск scheduled job...")
-
-        # 1. Синхронизация с Google Sheets
         await sync_lots_from_sheets()
+        logger.debug("✅ Scheduled job выполнен")
 
-        # 2. Запуск лотов, у которых наступило время старта
-        now = datetime.datetime.now(pytz.timezone(TIMEZONE))
+    except Exception as e:
+        logger.error(f"❌ Ошибка в scheduled job: {e}")
 
-        # Получаем лоты, у которых время старта наступило, но статус ещё pending
-        pending_lots = db.fetchall("""
-            SELECT auction_id, start_time 
-            FROM lots 
-            WHERE status = 'pending' 
-            AND start_time <= %s
-            ORDER BY start_time ASC
-        """, (now,))
 
-        logger.info(f"⏰ Найдено {len(pending_lots)} лотов для запуска")
+async def job_advance_payments():
+    """Продвижение платежей победителей: оплаченные — подтверждаем, открытые — проверяем
+    в ЮKassa, просроченные — закрываем и предлагаем лот следующему участнику,
+    зависшие без платежа лоты — предлагаем заново."""
+    try:
+        # 1. Оплата отмечена webhook'ом, но NOTIFY не дошёл (например, бот перезапускался)
+        for payment in await db.get_paid_unprocessed_payments():
+            await confirm_payment(payment.get('payment_id'))
 
-        for lot in pending_lots:
-            auction_id = lot.get('auction_id')
-            start_time = lot.get('start_time')
+        # 2. Страховочный опрос ЮKassa — только по платежам, у которых скоро дедлайн
+        open_payments = await db.get_open_payments(expiring_within_sec=PAYMENT_POLL_WINDOW_SEC)
 
-            # Преобразуем строку в datetime если нужно
-            if isinstance(start_time, str):
-                start_time = datetime.datetime.fromisoformat(start_time)
+        async def check(payment_id: str):
+            # Параллелизм ограничивает сам клиент ЮKassa
+            status = await yookassa.get_payment_status(payment_id)
+            if status == "succeeded":
+                await confirm_payment(payment_id)
 
-            # Проверяем, что время действительно наступило
-            if start_time <= now:
-                await start_auction(auction_id)
-                await asyncio.sleep(1)  # Небольшая пауза между запусками
+        await asyncio.gather(*(check(payment.get('payment_id')) for payment in open_payments))
 
-        # 3. Завершение лотов, у которых истекло время
-        to_finish = db.get_finished_lots_to_close()
+        # 3. Время оплаты вышло
+        for payment in await db.expire_due_payments():
+            await handle_payment_expired(payment)
 
-        if to_finish:
-            logger.info(f"🏁 Найдено {len(to_finish)} лотов для завершения")
+        # 4. Лот завершён или платёж просрочен, а следующий платёж так и не создан
+        #    (процесс упал между шагами или не удалось создать платёж)
+        recovery_horizon = datetime.timedelta(hours=PAYMENT_RECOVERY_HORIZON_HOURS)
+        for auction_id in await db.get_lots_awaiting_offer(PAYMENT_RECOVERY_GRACE_SEC, recovery_horizon):
+            bidder = await db.get_next_bidder(auction_id)
+            if bidder:
+                logger.warning(f"🔁 Аукцион {auction_id}: оплата никому не предложена, предлагаем повторно")
+                await offer_lot_to_bidder(auction_id, bidder.get('user_id'), float(bidder.get('amount', 0)))
 
-        for row in to_finish:
-            auction_id = row.get('auction_id')
-            await finish_auction(auction_id)
-            await asyncio.sleep(1)  # Небольшая пауза между завершениями
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки платежей: {e}")
 
-        logger.debug("✅ Scheduled job выполнен")
 
+async def job_detach_bid_partitions():
+    """Секции ставок давно завершённых лотов отсоединяются от журнала bid_log"""
+    try:
+        await db.detach_finished_bid_partitions(datetime.timedelta(days=BID_LOG_DETACH_AFTER_DAYS))
     except Exception as e:
-        logger.error(f"❌ Ошибка в scheduled job: {e}")
+        logger.error(f"❌ Ошибка отсоединения секций ставок: {e}")
+
+
+async def job_refresh_channel_posts():
+    """Пакетное обновление «до окончания» в постах активных лотов.
+    За проход — не больше CHANNEL_REFRESH_SHARE лимита канала на интервал;
+    если лотов больше, каждый пост обновляется реже (по кругу)"""
+    try:
+        budget = int(channel_limiter.rate * CHANNEL_REFRESH_INTERVAL_SEC * CHANNEL_REFRESH_SHARE)
+        channel_updater.refresh(await db.get_live_channel_posts(), budget=max(1, budget))
+    except Exception as e:
+        logger.error(f"❌ Ошибка обновления постов в канале: {e}")
+
+
+async def job_flush_reports():
+    """Выгрузка накопившихся строк отчёта в лист REPORT пачками.
+    Пачка, которую не удалось выгрузить или отметить, остаётся в outbox и уходит повторно"""
+    try:
+        while True:
+            rows = await db.get_pending_reports(REPORT_BATCH_SIZE)
+            if not rows:
+                return
+
+            ids = [row['id'] for row in rows]
+            values = [
+                build_report_values(
+                    row['created_at'],
+                    row['auction_id'],
+                    row['name'],
+                    row['article'],
+                    row['start_price'],
+                    row['final_price'],
+                    row['status'],
+                )
+                for row in rows
+            ]
+
+            try:
+                await asyncio.to_thread(append_report_values, values)
+            except Exception as e:
+                logger.error(f"❌ Ошибка выгрузки отчёта в Google Sheets ({len(ids)} строк): {e}")
+                await db.mark_reports_failed(ids, str(e), REPORT_RETRY_BASE_SEC, REPORT_RETRY_MAX_SEC)
+                return
+
+            await db.mark_reports_sent(ids)
+            if len(rows) < REPORT_BATCH_SIZE:
+                return
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки outbox отчёта: {e}")
+
+
+async def job_sync_bans():
+    """Перенос действующих банов в Redis (после рестарта Redis или пропущенной записи)"""
+    try:
+        await hot_state.sync_bans(await db.get_active_bans())
+    except Exception as e:
+        logger.error(f"❌ Ошибка синхронизации банов с Redis: {e}")
+
+
+async def job_rebuild_timers():
+    """Сверка таймеров с БД: подхватывает лоты, созданные или продлённые другими репликами"""
+    try:
+        lot_timers.rebuild(await db.get_lots_for_timers())
+    except Exception as e:
+        logger.error(f"❌ Ошибка сверки таймеров лотов: {e}")
 
 
 def scheduler_setup():
-    scheduler.add_job(job_sync_and_start, "interval", minutes=1)
-    scheduler.start()
+    scheduler.add_job(job_sync_lots, "interval", minutes=1, id="sync_lots", replace_existing=True)
+    scheduler.add_job(job_flush_reports, "interval", seconds=REPORT_FLUSH_INTERVAL_SEC,
+                      id="flush_reports", replace_existing=True)
+    scheduler.add_job(job_advance_payments, "interval", seconds=PAYMENT_CHECK_INTERVAL_SEC,
+                      id="advance_payments", replace_existing=True)
+    scheduler.add_job(job_refresh_channel_posts, "interval", seconds=CHANNEL_REFRESH_INTERVAL_SEC,
+                      id="refresh_channel_posts", replace_existing=True)
+    if BID_LOG_DETACH_AFTER_DAYS > 0:
+        scheduler.add_job(job_detach_bid_partitions, "interval", hours=1,
+                          id="detach_bid_partitions", replace_existing=True)
+    if hot_state is not None:
+        scheduler.add_job(job_sync_bans, "interval", minutes=1, id="sync_bans", replace_existing=True)
+    if LEADER_ELECTION:
+        scheduler.add_job(job_rebuild_timers, "interval", minutes=1, id="rebuild_timers", replace_existing=True)
+
+
+def start_leader_task(coro):
+    task = asyncio.create_task(coro)
+    leader_tasks.add(task)
+    task.add_done_callback(leader_tasks.discard)
+
+
+async def on_became_leader():
+    """Ведущая реплика: синхронизация, старт/завершение лотов, платежи, отчёты"""
+    lot_timers.enabled = True
+    scheduler_setup()
+    start_leader_task(db.listen(PAYMENT_EVENTS_CHANNEL, on_payment_event))
+    if hot_state is not None:
+        start_leader_task(hot_state.run_writer(db))
+        start_leader_task(job_sync_bans())
+
+    # Таймеры лотов восстанавливаются из БД; просроченные срабатывают сразу
+    lot_timers.rebuild(await db.get_lots_for_timers())
+    logger.info("✅ Задачи ведущей реплики запущены")
+
+    # Синхронизация при старте (в фоне, чтобы не задерживать проверку лидерства)
+    start_leader_task(sync_lots_from_sheets())
+
+
+async def on_lost_leadership():
+    """Реплика продолжает обрабатывать сообщения, но фоновые задачи останавливает"""
+    lot_timers.enabled = False
+    scheduler.remove_all_jobs()
+    tasks = list(leader_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    logger.info("⏸ Задачи ведущей реплики остановлены")
 
 
 async def on_startup(dispatcher: Dispatcher):
     """Действия при запуске бота"""
-    scheduler_setup()
-    logger.info("✅ Scheduler started, bot is up.")
+    await db.connect()
+    if QR_CLEANUP_LEGACY:
+        await asyncio.to_thread(cleanup_legacy_qr_files, ".", QR_PATH)
+    await media_cache.load()
+    scheduler.start()
 
-    # Синхронизация при старте
-    await sync_lots_from_sheets()
+    if LEADER_ELECTION:
+        # Фоновые задачи запустит реплика, получившая advisory lock; хендлеры работают на всех
+        elector = LeaderElector(
+            DB_URI,
+            LEADER_LOCK_KEY,
+            on_elected=on_became_leader,
+            on_demoted=on_lost_leadership,
+            retry_sec=LEADER_RETRY_SEC,
+            health_check_sec=LEADER_HEALTH_CHECK_SEC,
+        )
+        background_tasks.add(asyncio.create_task(elector.run()))
+    else:
+        await on_became_leader()
+    logger.info("✅ Scheduler started, bot is up.")
 
     # Тестовое сообщение админам
     for admin_id in ADMIN_IDS:
@@ -1104,14 +1604,106 @@ async def on_startup(dispatcher: Dispatcher):
             logger.error(f"Не удалось отправить сообщение админу {admin_id}: {e}")
 
 
+async def on_shutdown(dispatcher: Dispatcher):
+    """Действия при остановке бота"""
+    scheduler.shutdown(wait=False)
+    for task in background_tasks | leader_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, *leader_tasks, return_exceptions=True)
+    await lifecycle.close()
+    await channel_updater.close()
+    await media_cache.close()
+    await bid_notifier.close()
+    await yookassa.close()
+    if hot_state is not None:
+        try:
+            await hot_state.drain(db)
+        except Exception as e:
+            logger.error(f"❌ Не удалось дописать ставки из Redis: {e}")
+        await hot_state.close()
+    await db.close()
+
+
+# ========== ПОЛУЧЕНИЕ АПДЕЙТОВ ==========
+
+async def ensure_polling(dispatcher: Dispatcher):
+    """getUpdates не работает при установленном webhook; накопленные апдейты сохраняются"""
+    info = await bot.get_webhook_info()
+    if info.url:
+        await bot.delete_webhook(drop_pending_updates=False)
+        logger.info(f"🔌 Webhook {info.url} снят, переходим на polling")
+
+
+async def ensure_webhook(dispatcher: Dispatcher):
+    """Регистрирует webhook, если он ещё не указывает на нас (воркеры делают это одинаково)"""
+    info = await bot.get_webhook_info()
+    if info.url != BOT_WEBHOOK_URL:
+        await bot.set_webhook(
+            BOT_WEBHOOK_URL,
+            max_connections=BOT_WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=False,
+            secret_token=BOT_WEBHOOK_SECRET or None,
+        )
+        logger.info(f"🔗 Webhook установлен: {BOT_WEBHOOK_URL}")
+    if info.pending_update_count:
+        logger.info(f"📬 Ожидают доставки апдейтов: {info.pending_update_count}")
+
+
+@web.middleware
+async def check_webhook_secret(request: web.Request, handler):
+    """Апдейты без секрета Telegram (X-Telegram-Bot-Api-Secret-Token) отклоняются"""
+    if BOT_WEBHOOK_SECRET and request.path == BOT_WEBHOOK_PATH:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, BOT_WEBHOOK_SECRET):
+            return web.Response(status=403)
+    return await handler(request)
+
+
+def run_polling():
+    # skip_updates=False: ставки, отправленные во время рестарта, не теряются
+    executor.start_polling(
+        dp,
+        skip_updates=False,
+        on_startup=[ensure_polling, on_startup],
+        on_shutdown=on_shutdown,
+    )
+
+
+def run_webhook():
+    # Webhook при остановке не снимается: Telegram копит апдейты и дошлёт их после рестарта
+    webhook_executor = executor.set_webhook(
+        dp,
+        BOT_WEBHOOK_PATH,
+        skip_updates=False,
+        on_startup=[on_startup, ensure_webhook],
+        on_shutdown=on_shutdown,
+        web_app=web.Application(middlewares=[check_webhook_secret]),
+    )
+    webhook_executor.run_app(host=BOT_WEBAPP_HOST, port=BOT_WEBAPP_PORT, reuse_port=True)
+
+
 if __name__ == "__main__":
     # Проверяем подключение к каналу
     logger.info(f"🚀 Бот запускается...")
     logger.info(f"📢 Канал для публикации: {AUCTION_CHANNEL}")
     logger.info(f"👑 Админы: {ADMIN_IDS}")
     logger.info(f"🌍 Часовой пояс: {TIMEZONE}")
+    logger.info(f"📡 Режим получения апдейтов: {BOT_MODE}")
 
     try:
-        executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+        if BOT_MODE != "webhook":
+            run_polling()
+        elif BOT_WORKERS > 1:
+            # Каждый воркер — отдельная реплика; фоновые задачи выполняет ведущая
+            if not LEADER_ELECTION:
+                # Иначе таймеры лотов и платежи отработали бы в каждом воркере
+                raise RuntimeError("BOT_WORKERS > 1 требует LEADER_ELECTION=1")
+            workers = [multiprocessing.Process(target=run_webhook) for _ in range(BOT_WORKERS)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            run_webhook()
     except Exception as e:
         logger.error(f"❌ Ошибка запуска бота: {e}")
\ No newline at end of file
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import (
+    MessageNotModified,
+    MessageToEditNotFound,
+    RetryAfter,
+    TelegramAPIError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelPostUpdater:
+    """
+    Поддерживает пост лота в канале актуальным (цена, время до окончания).
+    Изменения по лоту копятся: пост редактируется не чаще раза в min_interval_sec,
+    сколько бы ставок ни пришло. Подпись строится из свежего состояния лота
+    в момент правки; если она не изменилась, запрос в Telegram не отправляется.
+    Все правки проходят через общий limiter канала без приоритета: публикации
+    новых лотов (limiter.acquire(urgent=True)) идут вперёд них.
+
+    get_lot(auction_id) -> lot | None                — строка лота с channel_message_id/kind
+    render(auction_id, lot) -> (caption, keyboard)   — содержимое поста
+    """
+
+    def __init__(self, bot, chat_id, get_lot, render, limiter, min_interval_sec: float = 5.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.get_lot = get_lot
+        self.render = render
+        self.limiter = limiter
+        self.min_interval_sec = min_interval_sec
+        self.edits = 0
+        self.skipped = 0
+        self._last_caption: dict[int, str] = {}
+        self._last_edit_at: dict[int, float] = {}
+        self._refreshed_at: dict[int, float] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def mark_dirty(self, auction_id: int):
+        """Запрашивает обновление поста; повторные вызовы до правки объединяются"""
+        if auction_id not in self._tasks:
+            self._tasks[auction_id] = asyncio.create_task(self._flush_later(auction_id))
+
+    def refresh(self, auction_ids, budget: int | None = None) -> list[int]:
+        """Пакетное обновление времени до окончания по списку лотов.
+        За проход проверяется не больше budget постов — дольше всех не проверявшиеся,
+        так что при большом числе лотов каждый пост обновляется реже, а правки
+        не выбирают весь лимит канала. Возвращает отобранные лоты."""
+        auction_ids = list(auction_ids)
+        if budget is not None and len(auction_ids) > budget:
+            auction_ids.sort(key=lambda auction_id: self._refreshed_at.get(auction_id, 0.0))
+            auction_ids = auction_ids[:max(0, budget)]
+        now = time.monotonic()
+        for auction_id in auction_ids:
+            self._refreshed_at[auction_id] = now
+            self.mark_dirty(auction_id)
+        return auction_ids
+
+    def forget(self, auction_id: int):
+        self._last_caption.pop(auction_id, None)
+        self._last_edit_at.pop(auction_id, None)
+        self._refreshed_at.pop(auction_id, None)
+
+    async def _flush_later(self, auction_id: int):
+        try:
+            last_edit_at = self._last_edit_at.get(auction_id)
+            if last_edit_at is not None:
+                delay = last_edit_at + self.min_interval_sec - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # Изменения, пришедшие во время правки, попадут уже в следующую
+            del self._tasks[auction_id]
+            await self._edit(auction_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления поста лота {auction_id}: {e}")
+        finally:
+            if self._tasks.get(auction_id) is asyncio.current_task():
+                del self._tasks[auction_id]
+
+    async def _edit(self, auction_id: int):
+        lot = await self.get_lot(auction_id)
+        if not lot or not lot.get('channel_message_id'):
+            return
+
+        caption, kb = self.render(auction_id, lot)
+        if self._last_caption.get(auction_id) == caption:
+            self.skipped += 1
+            return
+
+        message_id = lot.get('channel_message_id')
+        for attempt in range(2):
+            await self.limiter.acquire()
+            try:
+                if lot.get('channel_message_kind') == "photo":
+                    await self.bot.edit_message_caption(
+                        self.chat_id, message_id, caption=caption, reply_markup=kb, parse_mode="HTML"
+                    )
+                else:
+                    await self.bot.edit_message_text(
+                        caption, self.chat_id, message_id, reply_markup=kb, parse_mode="HTML"
+                    )
+                self.edits += 1
+                break
+            except MessageNotModified:
+                break
+            except RetryAfter as e:
+                if attempt:
+                    raise
+                await asyncio.sleep(e.timeout)
+            except MessageToEditNotFound:
+                logger.warning(f"⚠️ Пост лота {auction_id} в канале не найден")
+                break
+            except TelegramAPIError as e:
+                logger.warning(f"⚠️ Не удалось обновить пост лота {auction_id}: {e}")
+                return
+
+        self._last_caption[auction_id] = caption
+        self._last_edit_at[auction_id] = time.monotonic()
+        if lot.get('status') == "finished":
+            self.forget(auction_id)
+
+    def stats(self) -> dict:
+        return {"edits": self.edits, "skipped": self.skipped, "pending": len(self._tasks)}
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
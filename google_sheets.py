@@ -1,9 +1,14 @@
 import datetime
+import hashlib
+import json
 import logging
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional, Tuple
 
+import httplib2
 from googleapiclient.discovery import build
 from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 import pytz
 
 from config import (
@@ -15,146 +20,212 @@ from config import (
 )
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+HTTP_TIMEOUT_SEC = 30
 
 logger = logging.getLogger(__name__)
 
+_credentials: Optional[Credentials] = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+# Разобранные строки листа лотов по хэшу содержимого строки
+_row_cache: Dict[str, Optional[Dict]] = {}
+_row_cache_lock = threading.Lock()
+
+
+def _get_credentials() -> Credentials:
+    """Учётные данные сервисного аккаунта читаются с диска один раз на процесс;
+    обновлённый токен переиспользуется всеми клиентами."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = Credentials.from_service_account_file(
+                GOOGLE_SHEET_CREDENTIALS,
+                scopes=SCOPES,
+            )
+        return _credentials
+
 
 def _get_service():
-    """Получение сервиса Google Sheets"""
+    """Получение сервиса Google Sheets.
+    Клиент создаётся один раз на поток (httplib2 не потокобезопасен) из встроенного
+    discovery-документа и держит keep-alive соединение с API."""
+    service = getattr(_local, "service", None)
+    if service is not None:
+        return service
     try:
-        creds = Credentials.from_service_account_file(
-            GOOGLE_SHEET_CREDENTIALS,
-            scopes=SCOPES,
-        )
-        return build("sheets", "v4", credentials=creds)
+        http = AuthorizedHttp(_get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT_SEC))
+        service = build("sheets", "v4", http=http, static_discovery=True, cache_discovery=False)
+        _local.service = service
+        logger.info("✅ Клиент Google Sheets создан")
+        return service
     except Exception as e:
         logger.error(f"❌ Ошибка получения сервиса Google Sheets: {e}")
         raise
 
 
-def fetch_base_lots() -> List[Dict]:
-    """Чтение лотов из Google Sheets"""
-    try:
-        service = _get_service()
-        sheet = service.spreadsheets()
-        range_str = f"{LOTS_SHEET_NAME}!A2:H1000"
+def _fetch_lot_rows() -> List[List[str]]:
+    """Сырые строки листа LOTS_BASE"""
+    service = _get_service()
+    sheet = service.spreadsheets()
+    range_str = f"{LOTS_SHEET_NAME}!A2:H1000"
 
-        logger.info(f"📥 Чтение данных из Google Sheets: {range_str}")
+    logger.info(f"📥 Чтение данных из Google Sheets: {range_str}")
 
-        result = sheet.values().get(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range=range_str,
-        ).execute()
+    result = sheet.values().get(
+        spreadsheetId=GOOGLE_SHEET_ID,
+        range=range_str,
+    ).execute()
 
-        rows = result.get("values", [])
-        logger.info(f"📊 Получено {len(rows)} строк из Google Sheets")
+    rows = result.get("values", [])
+    logger.info(f"📊 Получено {len(rows)} строк из Google Sheets")
+    return rows
 
-        lots: List[Dict] = []
-        tz = pytz.timezone(TIMEZONE)
 
-        for idx, row in enumerate(rows, start=2):
-            if len(row) < 8:
-                logger.warning(f"⚠️ Строка {idx}: недостаточно данных ({len(row)} колонок)")
-                continue
-
-            try:
-                # Проверяем обязательные поля
-                if not row[0] or not row[1] or not row[3] or not row[7]:
-                    logger.warning(f"⚠️ Строка {idx}: пропущены обязательные поля")
+def _parse_lot_row(idx: int, row: List[str], tz) -> Optional[Dict]:
+    """Разбор одной строки листа в словарь лота (None — строка пропущена)"""
+    if len(row) < 8:
+        logger.warning(f"⚠️ Строка {idx}: недостаточно данных ({len(row)} колонок)")
+        return None
+
+    try:
+        # Проверяем обязательные поля
+        if not row[0] or not row[1] or not row[3] or not row[7]:
+            logger.warning(f"⚠️ Строка {idx}: пропущены обязательные поля")
+            return None
+
+        auction_id = int(row[0])
+        name = row[1].strip()
+        article = row[2].strip() if len(row) > 2 and row[2] else "Не указан"
+        start_price = float(row[3])
+
+        # Изображения (могут быть несколько через запятую)
+        images_raw = row[4] if len(row) > 4 and row[4] else ""
+        images = [url.strip() for url in images_raw.split(",") if url.strip()]
+
+        video_url = row[5] if len(row) > 5 and row[5] else None
+        description = row[6] if len(row) > 6 and row[6] else ""
+
+        # Парсим время старта
+        start_time_str = row[7].strip()
+        try:
+            # Пробуем разные форматы времени
+            formats = [
+                "%Y-%m-%d %H:%M",
+                "%d.%m.%Y %H:%M",
+                "%Y/%m/%d %H:%M",
+                "%d/%m/%Y %H:%M"
+            ]
+
+            start_time = None
+            for fmt in formats:
+                try:
+                    start_time = datetime.datetime.strptime(start_time_str, fmt)
+                    break
+                except ValueError:
                     continue
 
-                auction_id = int(row[0])
-                name = row[1].strip()
-                article = row[2].strip() if len(row) > 2 and row[2] else "Не указан"
-                start_price = float(row[3])
+            if not start_time:
+                raise ValueError(f"Неизвестный формат времени: {start_time_str}")
 
-                # Изображения (могут быть несколько через запятую)
-                images_raw = row[4] if len(row) > 4 and row[4] else ""
-                images = [url.strip() for url in images_raw.split(",") if url.strip()]
+            # Устанавливаем часовой пояс
+            start_time = tz.localize(start_time)
 
-                video_url = row[5] if len(row) > 5 and row[5] else None
-                description = row[6] if len(row) > 6 and row[6] else ""
+        except ValueError as e:
+            logger.error(f"❌ Строка {idx}: ошибка парсинга времени '{start_time_str}': {e}")
+            return None
 
-                # Парсим время старта
-                start_time_str = row[7].strip()
-                try:
-                    # Пробуем разные форматы времени
-                    formats = [
-                        "%Y-%m-%d %H:%M",
-                        "%d.%m.%Y %H:%M",
-                        "%Y/%m/%d %H:%M",
-                        "%d/%m/%Y %H:%M"
-                    ]
-
-                    start_time = None
-                    for fmt in formats:
-                        try:
-                            start_time = datetime.datetime.strptime(start_time_str, fmt)
-                            break
-                        except ValueError:
-                            continue
-
-                    if not start_time:
-                        raise ValueError(f"Неизвестный формат времени: {start_time_str}")
-
-                    # Устанавливаем часовой пояс
-                    start_time = tz.localize(start_time)
-
-                except ValueError as e:
-                    logger.error(f"❌ Строка {idx}: ошибка парсинга времени '{start_time_str}': {e}")
-                    continue
+        logger.debug(f"✅ Строка {idx}: добавлен лот {auction_id} '{name}' на {start_time}")
 
-                lots.append({
-                    "auction_id": auction_id,
-                    "name": name,
-                    "article": article,
-                    "start_price": start_price,
-                    "images": images,
-                    "video_url": video_url,
-                    "description": description,
-                    "start_time": start_time,
-                })
-
-                logger.debug(f"✅ Строка {idx}: добавлен лот {auction_id} '{name}' на {start_time}")
-
-            except ValueError as e:
-                logger.error(f"❌ Строка {idx}: ошибка преобразования типов: {e}")
-                continue
-            except Exception as e:
-                logger.error(f"❌ Строка {idx}: непредвиденная ошибка: {e}")
-                continue
-
-        logger.info(f"✅ Успешно обработано {len(lots)} лотов")
-        return lots
+        return {
+            "auction_id": auction_id,
+            "name": name,
+            "article": article,
+            "start_price": start_price,
+            "images": images,
+            "video_url": video_url,
+            "description": description,
+            "start_time": start_time,
+        }
 
+    except ValueError as e:
+        logger.error(f"❌ Строка {idx}: ошибка преобразования типов: {e}")
+        return None
     except Exception as e:
-        logger.error(f"❌ Ошибка чтения Google Sheets: {e}")
-        return []
+        logger.error(f"❌ Строка {idx}: непредвиденная ошибка: {e}")
+        return None
+
+
+def _hash_values(values) -> str:
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 
-def append_report_row(auction_id, name, article, start_price, final_price, status: str):
-    """Добавление строки в отчетный лист"""
+def fetch_base_lots_incremental(last_fingerprint: Optional[str]) -> Tuple[Optional[str], Optional[List[Dict]]]:
+    """
+    Инкрементальное чтение лотов: возвращает (fingerprint, lots).
+    Если диапазон не изменился с last_fingerprint — lots = None, и разбор
+    с записью в БД можно пропустить. Изменившиеся строки разбираются заново,
+    остальные берутся из кэша по хэшу строки.
+    Блокирующая функция — вызывать из потока (asyncio.to_thread).
+    """
     try:
-        service = _get_service()
-        sheet = service.spreadsheets()
+        rows = _fetch_lot_rows()
+    except Exception as e:
+        logger.error(f"❌ Ошибка чтения Google Sheets: {e}")
+        return last_fingerprint, None
 
-        # Форматируем данные
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    fingerprint = _hash_values(rows)
+    if fingerprint == last_fingerprint:
+        logger.debug("📊 Лист лотов не изменился, синхронизация не нужна")
+        return fingerprint, None
 
-        if final_price is None:
-            final_price_str = "—"
-        else:
-            final_price_str = f"{final_price:.2f}"
+    tz = pytz.timezone(TIMEZONE)
+    lots: List[Dict] = []
+    parsed_rows: Dict[str, Optional[Dict]] = {}
+    reparsed = 0
 
-        values = [[
-            timestamp,
-            auction_id,
-            name,
-            article,
-            f"{start_price:.2f}",
-            final_price_str,
-            status
-        ]]
+    with _row_cache_lock:
+        for idx, row in enumerate(rows, start=2):
+            row_hash = _hash_values(row)
+            if row_hash in _row_cache:
+                lot = _row_cache[row_hash]
+            else:
+                lot = _parse_lot_row(idx, row, tz)
+                reparsed += 1
+            parsed_rows[row_hash] = lot
+            if lot is not None:
+                lots.append(lot)
+
+        _row_cache.clear()
+        _row_cache.update(parsed_rows)
+
+    logger.info(f"✅ Лист лотов изменился: {len(lots)} лотов, заново разобрано строк: {reparsed}")
+    return fingerprint, lots
+
+
+def build_report_values(timestamp: datetime.datetime, auction_id, name, article, start_price, final_price, status: str) -> list:
+    """Строка листа REPORT"""
+    if final_price is None:
+        final_price_str = "—"
+    else:
+        final_price_str = f"{final_price:.2f}"
+
+    return [
+        timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        auction_id,
+        name,
+        article,
+        f"{start_price:.2f}",
+        final_price_str,
+        status
+    ]
+
+
+def append_report_values(values: List[list]):
+    """Добавление нескольких строк в отчетный лист одним запросом"""
+    try:
+        service = _get_service()
+        sheet = service.spreadsheets()
 
         body = {"values": values}
         range_str = f"{REPORT_SHEET_NAME}!A2"
@@ -167,8 +238,9 @@ def append_report_row(auction_id, name, article, start_price, final_price, statu
             body=body,
         ).execute()
 
-        logger.info(f"📝 Запись в отчет: аукцион {auction_id}, статус '{status}'")
+        logger.info(f"📝 Запись в отчет: {len(values)} строк")
 
     except Exception as e:
         logger.error(f"❌ Ошибка записи в отчет Google Sheets: {e}")
-        raise
\ No newline at end of file
+        raise
+
@@ -0,0 +1,327 @@
+import asyncio
+import datetime
+import decimal
+import logging
+import time
+
+import pytz
+
+from config import TIMEZONE, MIN_STEP, EXTEND_THRESHOLD_MIN, EXTEND_TO_MIN
+
+logger = logging.getLogger(__name__)
+
+# Ставка целиком на стороне Redis: проверка статуса, окончания, бана и минимального шага,
+# подъём цены, продление по правилу 10 минут, участник и запись в поток для Postgres.
+# Суммы в копейках, время в миллисекундах epoch.
+# KEYS: lot, participants, stream, ban пользователя
+# ARGV: user_id, amount (-1 — шагом), increment, min_step, now_ms, threshold_ms, extend_ms
+PLACE_BID_LUA = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status then
+    return {'not_found', 0, 0, 0, 0}
+end
+local price = tonumber(redis.call('HGET', KEYS[1], 'price'))
+local end_ms = tonumber(redis.call('HGET', KEYS[1], 'end_ms'))
+local now_ms = tonumber(ARGV[5])
+if status ~= 'active' or now_ms >= end_ms then
+    return {'not_active', price, 0, end_ms, 0}
+end
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    return {'banned', price, 0, end_ms, 0}
+end
+
+local amount = tonumber(ARGV[2])
+if amount < 0 then
+    amount = price + tonumber(ARGV[3])
+end
+if amount < price + tonumber(ARGV[4]) then
+    return {'too_low', price, amount, end_ms, 0}
+end
+
+local extended = 0
+if end_ms - now_ms < tonumber(ARGV[6]) then
+    end_ms = now_ms + tonumber(ARGV[7])
+    extended = 1
+end
+redis.call('HSET', KEYS[1], 'price', amount, 'end_ms', end_ms, 'leader', ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('XADD', KEYS[3], '*',
+    'auction_id', redis.call('HGET', KEYS[1], 'auction_id'),
+    'user_id', ARGV[1], 'amount', amount, 'end_ms', end_ms, 'ts', now_ms)
+return {'accepted', price, amount, end_ms, extended}
+"""
+
+# Загрузка лота, только если его ещё нет в Redis (состояние в Redis свежее Postgres)
+LOAD_LOT_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'auction_id', ARGV[1], 'status', 'active', 'price', ARGV[2], 'end_ms', ARGV[3])
+if #ARGV > 3 then
+    redis.call('SADD', KEYS[2], unpack(ARGV, 4))
+end
+return 1
+"""
+
+# Закрытие лота для ставок, если время вышло; иначе возвращает актуальный end_ms
+CLOSE_LOT_LUA = """
+local end_ms = tonumber(redis.call('HGET', KEYS[1], 'end_ms'))
+if not end_ms then
+    return 0
+end
+if ARGV[1] == '0' and tonumber(ARGV[2]) < end_ms then
+    return end_ms
+end
+redis.call('HSET', KEYS[1], 'status', 'finished')
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return 0
+"""
+
+
+def to_kopecks(value) -> int:
+    return int((decimal.Decimal(str(value)) * 100).to_integral_value(decimal.ROUND_HALF_UP))
+
+
+def from_kopecks(value) -> decimal.Decimal:
+    return decimal.Decimal(int(value)) / 100
+
+
+class RedisHotState:
+    """
+    Горячее состояние активных лотов в Redis: цена, end_time, лидер и участники.
+    Ставка принимается Lua-скриптом атомарно и без обращения к Postgres;
+    принятые ставки пишутся в поток Redis, а run_writer переносит их в bid_log/lots
+    (идемпотентно по id записи потока). Postgres остаётся долговременным хранилищем:
+    лоты загружаются из него при старте и лениво после рестарта Redis.
+    Баны зеркалируются ключами с истечением (set_ban/sync_bans) и проверяются тем же
+    скриптом — как и в Postgres, бан с другой реплики действует сразу.
+
+    client — redis.asyncio.Redis (decode_responses=True) или совместимый,
+    например fakeredis.aioredis.FakeRedis (для Lua нужен lupa).
+    """
+
+    GROUP = "pg-writer"
+    CONSUMER = "writer"
+
+    def __init__(
+            self,
+            client,
+            prefix: str = "auction",
+            stream: str = "auction:bids",
+            batch_size: int = 200,
+            finished_ttl_sec: int = 86400,
+            min_step=MIN_STEP,
+            extend_threshold_min: int = EXTEND_THRESHOLD_MIN,
+            extend_to_min: int = EXTEND_TO_MIN,
+    ):
+        self.client = client
+        self.prefix = prefix
+        self.stream = stream
+        self.batch_size = batch_size
+        self.finished_ttl_sec = finished_ttl_sec
+        self.min_step = to_kopecks(min_step)
+        self.threshold_ms = extend_threshold_min * 60_000
+        self.extend_ms = extend_to_min * 60_000
+        self.tz = pytz.timezone(TIMEZONE)
+        self._place_bid = client.register_script(PLACE_BID_LUA)
+        self._load_lot = client.register_script(LOAD_LOT_LUA)
+        self._close_lot = client.register_script(CLOSE_LOT_LUA)
+        self._write_lock = asyncio.Lock()
+        self._group_ready = False
+
+    @classmethod
+    def from_url(cls, host: str, port: int, **kwargs) -> "RedisHotState":
+        from redis import asyncio as aioredis
+        client = aioredis.Redis(host=host, port=port, decode_responses=True)
+        return cls(client, **kwargs)
+
+    def _lot_key(self, auction_id: int) -> str:
+        return f"{self.prefix}:{auction_id}"
+
+    def _participants_key(self, auction_id: int) -> str:
+        return f"{self.prefix}:{auction_id}:participants"
+
+    def _ban_key(self, user_id: int) -> str:
+        return f"{self.prefix}:banned:{user_id}"
+
+    def _to_ms(self, value: datetime.datetime) -> int:
+        if value.tzinfo is None:
+            value = self.tz.localize(value)
+        return int(value.timestamp() * 1000)
+
+    def _from_ms(self, value) -> datetime.datetime:
+        """Naive-время в TIMEZONE, как колонки TIMESTAMP в БД"""
+        return datetime.datetime.fromtimestamp(int(value) / 1000, self.tz).replace(tzinfo=None)
+
+    # --- Лоты ---
+
+    async def load_lot(self, lot: dict, participants=()) -> bool:
+        """Загружает активный лот из строки Postgres; False — лот уже в Redis"""
+        auction_id = lot['auction_id']
+        loaded = await self._load_lot(
+            keys=[self._lot_key(auction_id), self._participants_key(auction_id)],
+            args=[
+                auction_id,
+                to_kopecks(lot.get('current_price') or lot.get('start_price') or 0),
+                self._to_ms(lot['end_time']),
+                *participants,
+            ],
+        )
+        return bool(loaded)
+
+    async def close_lot(self, auction_id: int, force: bool = False) -> datetime.datetime | None:
+        """Закрывает лот для ставок. Если ставка успела продлить лот (и не force),
+        лот не закрывается и возвращается новое end_time."""
+        end_ms = await self._close_lot(
+            keys=[self._lot_key(auction_id), self._participants_key(auction_id)],
+            args=["1" if force else "0", int(time.time() * 1000), self.finished_ttl_sec],
+        )
+        return self._from_ms(end_ms) if int(end_ms) else None
+
+    async def overlay(self, lot: dict) -> dict:
+        """Подставляет в строку лота цену и end_time из Redis (Postgres может отставать)"""
+        if not lot:
+            return lot
+        state = await self.client.hgetall(self._lot_key(lot['auction_id']))
+        if state:
+            lot['current_price'] = from_kopecks(state['price'])
+            lot['end_time'] = self._from_ms(state['end_ms'])
+        return lot
+
+    async def get_participants(self, auction_id: int) -> list[dict]:
+        members = await self.client.smembers(self._participants_key(auction_id))
+        return [{'user_id': int(user_id)} for user_id in members]
+
+    # --- Баны ---
+
+    async def set_ban(self, user_id: int, until: datetime.datetime | None):
+        """Ставит (до until) или снимает бан пользователя"""
+        until_ms = self._to_ms(until) if until else 0
+        if until_ms > time.time() * 1000:
+            await self.client.set(self._ban_key(user_id), 1, pxat=until_ms)
+        else:
+            await self.client.delete(self._ban_key(user_id))
+
+    async def sync_bans(self, bans: list[dict]):
+        """Восстанавливает баны из Postgres (строки user_id, banned_until), например после рестарта Redis"""
+        now_ms = time.time() * 1000
+        async with self.client.pipeline(transaction=False) as pipe:
+            for ban in bans:
+                until_ms = self._to_ms(ban['banned_until'])
+                if until_ms > now_ms:
+                    pipe.set(self._ban_key(ban['user_id']), 1, pxat=until_ms)
+            await pipe.execute()
+
+    # --- Ставки ---
+
+    async def place_bid(self, auction_id: int, user_id: int, amount=None, increment=None) -> dict:
+        """Тот же результат, что и AsyncDatabase.place_bid"""
+        outcome, previous, accepted, end_ms, extended = await self._place_bid(
+            keys=[
+                self._lot_key(auction_id),
+                self._participants_key(auction_id),
+                self.stream,
+                self._ban_key(user_id),
+            ],
+            args=[
+                user_id,
+                to_kopecks(amount) if amount is not None else -1,
+                to_kopecks(increment or 0),
+                self.min_step,
+                int(time.time() * 1000),
+                self.threshold_ms,
+                self.extend_ms,
+            ],
+        )
+        return {
+            'outcome': outcome,
+            'previous_price': from_kopecks(previous),
+            'amount': from_kopecks(accepted),
+            'end_time': self._from_ms(end_ms) if int(end_ms) else None,
+            'extended': bool(int(extended)),
+        }
+
+    # --- Запись в Postgres ---
+
+    async def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            await self.client.xgroup_create(self.stream, self.GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def _read_batch(self, stream_id: str, block_ms: int | None) -> list:
+        """Порция записей потока для группы: "0" — недописанные, ">" — новые"""
+        response = await self.client.xreadgroup(
+            self.GROUP, self.CONSUMER, {self.stream: stream_id},
+            count=self.batch_size, block=block_ms,
+        )
+        return response[0][1] if response else []
+
+    async def _write_batch(self, db, entries: list) -> int:
+        """Переносит порцию ставок в Postgres и подтверждает её; возвращает число записей.
+        Повтор той же порции безопасен: apply_hot_bids идемпотентен по id записи"""
+        if not entries:
+            return 0
+
+        rows = [
+            {
+                "stream_id": entry_id,
+                "auction_id": int(fields['auction_id']),
+                "user_id": int(fields['user_id']),
+                "amount": str(from_kopecks(fields['amount'])),
+                "end_time": self._from_ms(fields['end_ms']),
+                "created_at": self._from_ms(fields['ts']),
+            }
+            for entry_id, fields in entries
+            # Запись уже удалена из потока (дописана параллельно) — только подтверждаем
+            if fields
+        ]
+        if rows:
+            await db.apply_hot_bids(rows)
+
+        ids = [entry_id for entry_id, _ in entries]
+        await self.client.xack(self.stream, self.GROUP, *ids)
+        await self.client.xdel(self.stream, *ids)
+        return len(entries)
+
+    async def drain(self, db) -> int:
+        """Синхронно дописывает в Postgres все принятые ставки (перед завершением лота)"""
+        await self._ensure_group()
+        written = 0
+        async with self._write_lock:
+            # Сначала недописанные (прочитанные, но не подтверждённые), затем новые
+            for stream_id in ("0", ">"):
+                while True:
+                    count = await self._write_batch(db, await self._read_batch(stream_id, block_ms=None))
+                    written += count
+                    if count < self.batch_size:
+                        break
+        return written
+
+    async def run_writer(self, db, block_ms: int = 1000, retry_delay: float = 5.0):
+        """Фоновая запись ставок из потока в Postgres, пока задачу не отменят.
+        Блокирующее чтение идёт вне _write_lock, чтобы drain при завершении лота его не ждал;
+        прочитанную порцию drain может дописать раньше — повтор ничего не задвоит"""
+        while True:
+            try:
+                # Сначала недописанное с прошлого запуска или после ошибки, затем новые ставки
+                await self.drain(db)
+                while True:
+                    entries = await self._read_batch(">", block_ms=block_ms)
+                    if entries:
+                        async with self._write_lock:
+                            await self._write_batch(db, entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Порция осталась неподтверждённой — drain повторит её с теми же id
+                logger.error(f"❌ Ошибка записи ставок из Redis в БД: {e}")
+                await asyncio.sleep(retry_delay)
+
+    async def close(self):
+        await self.client.aclose()
@@ -21,17 +21,35 @@ CREATE TABLE IF NOT EXISTS lots (
                                     end_time TIMESTAMP,
                                     status TEXT DEFAULT 'pending', -- pending / active / finished
                                     winner_user_id BIGINT,
+                                    sheet_hash TEXT, -- хэш строки LOTS_BASE для диффовой синхронизации
+                                    channel_message_id BIGINT, -- пост лота в канале
+                                    channel_message_kind TEXT, -- photo / text
+                                    finished_at TIMESTAMP, -- когда лот закрыт для ставок
                                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Таблица ставок
-CREATE TABLE IF NOT EXISTS bids (
-                                    id SERIAL PRIMARY KEY,
-                                    auction_id INTEGER NOT NULL REFERENCES lots(auction_id) ON DELETE CASCADE,
-                                    user_id BIGINT NOT NULL,
-                                    amount DECIMAL(10,2) NOT NULL,
-                                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                    UNIQUE(auction_id, user_id, amount)
+-- Журнал ставок: только INSERT, секция на каждый лот (bid_log_<auction_id>) создаётся ботом.
+-- Секции по умолчанию нет: так давние секции отсоединяются через DETACH CONCURRENTLY.
+CREATE TABLE IF NOT EXISTS bid_log (
+                                       id BIGSERIAL,
+                                       auction_id INTEGER NOT NULL,
+                                       user_id BIGINT NOT NULL,
+                                       amount DECIMAL(10,2) NOT NULL,
+                                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                       stream_id TEXT, -- id записи потока Redis (hot_state), для идемпотентной записи
+                                       PRIMARY KEY (auction_id, id)
+) PARTITION BY LIST (auction_id);
+
+-- Последняя ставка каждого участника по лоту
+CREATE OR REPLACE VIEW latest_bids AS
+SELECT DISTINCT ON (auction_id, user_id) auction_id, user_id, amount, created_at
+FROM bid_log
+ORDER BY auction_id, user_id, id DESC;
+
+-- Выполненные однократные миграции (применяет бот при подключении)
+CREATE TABLE IF NOT EXISTS schema_migrations (
+                                                 name TEXT PRIMARY KEY,
+                                                 applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Таблица платежей (обновлена для ЮКассы)
@@ -40,24 +58,63 @@ CREATE TABLE IF NOT EXISTS payments (
                                         auction_id INTEGER NOT NULL,
                                         user_id BIGINT NOT NULL,
                                         amount DECIMAL(10,2) NOT NULL,
-                                        payment_status TEXT DEFAULT 'pending', -- pending / completed / failed / canceled
+                                        payment_status TEXT DEFAULT 'pending', -- pending / completed / expired
                                         payment_id TEXT UNIQUE, -- ID платежа в ЮKassa
                                         payment_url TEXT, -- Ссылка на оплату
                                         description TEXT,
                                         paid_at TIMESTAMP,
+                                        expires_at TIMESTAMP, -- дедлайн оплаты
+                                        processed_at TIMESTAMP, -- бот подтвердил оплату или закрыл просроченный платёж
                                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Outbox строк отчёта: пишется в одной транзакции со сменой статуса, выгружается в REPORT пачками
+CREATE TABLE IF NOT EXISTS report_outbox (
+                                             id BIGSERIAL PRIMARY KEY,
+                                             auction_id INTEGER,
+                                             name TEXT,
+                                             article TEXT,
+                                             start_price DECIMAL(10,2),
+                                             final_price DECIMAL(10,2),
+                                             status TEXT,
+                                             attempts INTEGER DEFAULT 0,
+                                             next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                             last_error TEXT,
+                                             sent_at TIMESTAMP,
+                                             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Входящие уведомления ЮKassa (идемпотентность повторных доставок)
+CREATE TABLE IF NOT EXISTS webhook_events (
+                                              event_key TEXT PRIMARY KEY,
+                                              payment_id TEXT,
+                                              payload JSONB,
+                                              received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                              processed_at TIMESTAMP
+);
+
+-- file_id Telegram для картинок лотов (повторная отправка без скачивания по URL)
+CREATE TABLE IF NOT EXISTS media_cache (
+                                           url TEXT PRIMARY KEY,
+                                           file_id TEXT NOT NULL,
+                                           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Индексы для оптимизации
 CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id);
 CREATE INDEX IF NOT EXISTS idx_lots_auction_id ON lots(auction_id);
 CREATE INDEX IF NOT EXISTS idx_lots_status ON lots(status);
 CREATE INDEX IF NOT EXISTS idx_lots_end_time ON lots(end_time);
-CREATE INDEX IF NOT EXISTS idx_bids_auction_id ON bids(auction_id);
-CREATE INDEX IF NOT EXISTS idx_bids_user_id ON bids(user_id);
+CREATE INDEX IF NOT EXISTS idx_bid_log_ranked ON bid_log(auction_id, amount DESC, id) INCLUDE (user_id);
+CREATE INDEX IF NOT EXISTS idx_bid_log_user ON bid_log(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_bid_log_stream ON bid_log(auction_id, stream_id);
 CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id);
 CREATE INDEX IF NOT EXISTS idx_payments_auction_user ON payments(auction_id, user_id);
 CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(payment_status);
+CREATE INDEX IF NOT EXISTS idx_payments_open ON payments(payment_status, expires_at) WHERE processed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_report_outbox_unsent ON report_outbox(next_attempt_at) WHERE sent_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_webhook_events_unprocessed ON webhook_events(received_at) WHERE processed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_lots_finished_at ON lots(finished_at) WHERE status = 'finished';
 
 -- Таблица для логов (опционально)
 CREATE TABLE IF NOT EXISTS bot_logs (
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """
+    Выбор ведущей реплики через advisory lock Postgres.
+    Блокировка берётся на отдельном соединении и живёт, пока живо соединение:
+    при падении реплики или обрыве связи Postgres снимает её сам (TCP keepalive
+    сервера выставлен по health_check_sec), и лидером становится следующая.
+    Лидер регулярно проверяет соединение; если проверка упала или не уложилась
+    в health_check_sec, он слагает полномочия (on_demoted, не дольше
+    health_check_sec) и закрывает соединение — блокировка освобождается сразу,
+    даже если соединение на деле живо, а не держится до переподключения.
+
+    on_elected() / on_demoted() — корутины, вызываются при смене роли.
+    """
+
+    def __init__(
+            self,
+            db_uri: str,
+            lock_key: int,
+            on_elected,
+            on_demoted,
+            retry_sec: float = 5.0,
+            health_check_sec: float = 5.0,
+    ):
+        self.db_uri = db_uri
+        self.lock_key = lock_key
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.retry_sec = retry_sec
+        self.health_check_sec = health_check_sec
+        self.is_leader = False
+
+    async def _set_leader(self, value: bool):
+        if self.is_leader == value:
+            return
+        self.is_leader = value
+        if value:
+            logger.info("👑 Реплика стала ведущей")
+            await self.on_elected()
+        else:
+            logger.warning("🪑 Реплика больше не ведущая")
+            await self.on_demoted()
+
+    async def _hold(self, conn: asyncpg.Connection):
+        """Проверяет соединение с блокировкой, пока оно живо"""
+        while True:
+            await asyncio.sleep(self.health_check_sec)
+            await conn.fetchval("SELECT 1", timeout=self.health_check_sec)
+
+    async def run(self):
+        """Борется за лидерство, пока задачу не отменят"""
+        while True:
+            conn = None
+            try:
+                keepalive = str(max(1, int(self.health_check_sec)))
+                conn = await asyncpg.connect(
+                    self.db_uri,
+                    server_settings={
+                        "tcp_keepalives_idle": keepalive,
+                        "tcp_keepalives_interval": keepalive,
+                        "tcp_keepalives_count": "3",
+                    },
+                )
+                while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_key):
+                    await asyncio.sleep(self.retry_sec)
+                await self._set_leader(True)
+                await self._hold(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⏳ Соединение для выбора лидера прервано: {e}")
+            finally:
+                try:
+                    # Зависшая остановка задач не должна удерживать блокировку
+                    await asyncio.wait_for(asyncio.shield(self._set_leader(False)), self.health_check_sec)
+                except asyncio.TimeoutError:
+                    logger.error("❌ Задачи ведущей реплики не остановились вовремя, блокировка снимается")
+                except Exception as e:
+                    logger.error(f"❌ Ошибка при снятии лидерства: {e}")
+                if conn is not None and not conn.is_closed():
+                    # Закрытие соединения снимает advisory lock
+                    conn.terminate()
+            await asyncio.sleep(self.retry_sec)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LifecycleExecutor:
+    """
+    Пакетная обработка старта и завершения лотов.
+    События таймеров, пришедшие в пределах batch_window_sec, собираются в один прогон:
+    старты и завершения выполняются параллельно (не более concurrency одновременно),
+    затем запущенные лоты публикуются в канал — темп публикаций ограничивает
+    сам on_publish. По каждому прогону пишется тайминг, последний хранится в last_run.
+
+    on_start(auction_id) -> lot | None  — активирует лот, возвращает его для публикации
+    on_publish(auction_id, lot)         — публикует лот в канал
+    on_finish(auction_id)               — завершает лот
+    """
+
+    def __init__(self, on_start, on_publish, on_finish, concurrency: int = 10, batch_window_sec: float = 0.2):
+        self.on_start = on_start
+        self.on_publish = on_publish
+        self.on_finish = on_finish
+        self.batch_window_sec = batch_window_sec
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.last_run: dict | None = None
+        self._pending: dict[tuple[str, int], None] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._runs: set[asyncio.Task] = set()
+
+    async def submit_start(self, auction_id: int):
+        self._submit("start", auction_id)
+
+    async def submit_finish(self, auction_id: int):
+        self._submit("finish", auction_id)
+
+    def _submit(self, kind: str, auction_id: int):
+        self._pending[(kind, auction_id)] = None
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window_sec)
+        batch = list(self._pending)
+        self._pending.clear()
+        self._flush_task = None
+
+        # Публикация прошлого прогона может ещё идти — новый прогон не ждёт её
+        task = asyncio.create_task(self.run(batch))
+        self._runs.add(task)
+        task.add_done_callback(self._runs.discard)
+
+    async def _bounded(self, kind: str, auction_id: int):
+        async with self.semaphore:
+            if kind == "start":
+                return await self.on_start(auction_id)
+            return await self.on_finish(auction_id)
+
+    async def run(self, batch: list[tuple[str, int]]) -> dict:
+        started_at = time.monotonic()
+        results = await asyncio.gather(
+            *(self._bounded(kind, auction_id) for kind, auction_id in batch),
+            return_exceptions=True,
+        )
+        processed_at = time.monotonic()
+
+        for (kind, auction_id), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Ошибка {kind} лота {auction_id}: {result}")
+
+        to_publish = [
+            (auction_id, result)
+            for (kind, auction_id), result in zip(batch, results)
+            if kind == "start" and isinstance(result, dict)
+        ]
+        for auction_id, lot in to_publish:
+            try:
+                await self.on_publish(auction_id, lot)
+            except Exception as e:
+                logger.error(f"❌ Ошибка публикации лота {auction_id}: {e}")
+        finished_at = time.monotonic()
+
+        self.last_run = {
+            "starts": sum(1 for kind, _ in batch if kind == "start"),
+            "finishes": sum(1 for kind, _ in batch if kind == "finish"),
+            "published": len(to_publish),
+            "process_sec": round(processed_at - started_at, 3),
+            "total_sec": round(finished_at - started_at, 3),
+        }
+        logger.info(
+            f"⚙️ Прогон лотов: стартов {self.last_run['starts']}, завершений {self.last_run['finishes']} "
+            f"за {self.last_run['process_sec']} с, публикаций {self.last_run['published']} "
+            f"(всего {self.last_run['total_sec']} с)"
+        )
+        return self.last_run
+
+    async def close(self):
+        tasks = list(self._runs)
+        if self._flush_task is not None:
+            tasks.append(self._flush_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,65 @@
+import datetime
+import logging
+
+from apscheduler.jobstores.base import JobLookupError
+
+logger = logging.getLogger(__name__)
+
+
+class LotTimers:
+    """
+    Точные таймеры старта и завершения лотов: по одной date-задаче APScheduler
+    на событие, с id по auction_id. Повторная установка заменяет таймер,
+    поэтому продление end_time просто переставляет задачу завершения.
+    Время из БД (naive) трактуется в часовом поясе планировщика.
+    С enabled=False (реплика не ведущая) таймеры не ставятся — их восстановит
+    rebuild на ведущей реплике.
+    """
+
+    def __init__(self, scheduler, on_start, on_finish, enabled: bool = True):
+        self.scheduler = scheduler
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.enabled = enabled
+
+    @staticmethod
+    def _job_id(kind: str, auction_id: int) -> str:
+        return f"lot_{kind}:{auction_id}"
+
+    def _arm(self, kind: str, func, auction_id: int, run_date: datetime.datetime):
+        if not self.enabled:
+            return
+        self.scheduler.add_job(
+            func,
+            "date",
+            run_date=run_date,
+            args=[auction_id],
+            id=self._job_id(kind, auction_id),
+            replace_existing=True,
+            # Просроченный таймер (например, после рестарта) срабатывает сразу
+            misfire_grace_time=None,
+        )
+        logger.debug(f"⏱ Таймер {kind} для лота {auction_id} установлен на {run_date}")
+
+    def arm_start(self, auction_id: int, start_time: datetime.datetime):
+        self._arm("start", self.on_start, auction_id, start_time)
+
+    def arm_finish(self, auction_id: int, end_time: datetime.datetime):
+        self._arm("finish", self.on_finish, auction_id, end_time)
+
+    def cancel(self, auction_id: int):
+        for kind in ("start", "finish"):
+            try:
+                self.scheduler.remove_job(self._job_id(kind, auction_id))
+            except JobLookupError:
+                pass
+
+    def rebuild(self, lots: list[dict]):
+        """Восстановление таймеров по строкам лотов (status, start_time, end_time) при старте"""
+        for lot in lots:
+            auction_id = lot.get('auction_id')
+            if lot.get('status') == "pending" and lot.get('start_time'):
+                self.arm_start(auction_id, lot.get('start_time'))
+            elif lot.get('status') == "active" and lot.get('end_time'):
+                self.arm_finish(auction_id, lot.get('end_time'))
+        logger.info(f"⏱ Таймеры лотов восстановлены: {len(lots)}")
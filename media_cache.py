@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+import aiohttp
+from aiogram.utils.exceptions import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """
+    Кэш file_id Telegram для картинок лотов.
+    Первая успешная отправка по URL сохраняет file_id (в памяти и в таблице media_cache),
+    дальше фото отправляется ссылкой на уже загруженный файл — Telegram не скачивает
+    картинку заново. prefetch() при синхронизации проверяет URL и, если задан
+    prefetch_chat, заранее загружает картинку, чтобы получить file_id до старта лота.
+    """
+
+    def __init__(
+            self,
+            bot,
+            db,
+            prefetch_chat=None,
+            concurrency: int = 5,
+            timeout_sec: float = 15.0,
+    ):
+        self.bot = bot
+        self.db = db
+        self.prefetch_chat = prefetch_chat
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = aiohttp.ClientTimeout(total=timeout_sec)
+        self.hits = 0
+        self.misses = 0
+        self._file_ids: dict[str, str] = {}
+        self._session: aiohttp.ClientSession | None = None
+
+    async def load(self):
+        self._file_ids = await self.db.get_media_file_ids()
+        logger.info(f"🖼 Кэш медиа загружен: {len(self._file_ids)}")
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        return self._session
+
+    async def remember(self, url: str, message):
+        """Сохраняет file_id самого большого размера фото из отправленного сообщения"""
+        if not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        if self._file_ids.get(url) == file_id:
+            return
+        self._file_ids[url] = file_id
+        await self.db.save_media_file_id(url, file_id)
+
+    async def send_photo(self, chat_id, url: str, **kwargs):
+        """send_photo по file_id из кэша, а без него — по URL с запоминанием file_id"""
+        file_id = self._file_ids.get(url)
+        if file_id:
+            try:
+                message = await self.bot.send_photo(chat_id, photo=file_id, **kwargs)
+                self.hits += 1
+                return message
+            except BadRequest as e:
+                # file_id больше не действителен — загружаем по URL заново
+                logger.warning(f"⚠️ file_id для {url} отклонён: {e}")
+                self._file_ids.pop(url, None)
+
+        self.misses += 1
+        message = await self.bot.send_photo(chat_id, photo=url, **kwargs)
+        await self.remember(url, message)
+        return message
+
+    async def _check_url(self, url: str) -> str | None:
+        """None, если по URL отдаётся картинка, иначе описание ошибки"""
+        try:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    return f"HTTP {resp.status}"
+                content_type = resp.headers.get("Content-Type", "")
+                if not content_type.startswith("image/"):
+                    return f"не картинка ({content_type or 'без Content-Type'})"
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return f"недоступен ({e.__class__.__name__})"
+
+    async def _prefetch_one(self, url: str) -> str | None:
+        async with self.semaphore:
+            error = await self._check_url(url)
+            if error or not self.prefetch_chat:
+                return error
+            try:
+                message = await self.bot.send_photo(self.prefetch_chat, photo=url, disable_notification=True)
+                await self.remember(url, message)
+                await self.bot.delete_message(self.prefetch_chat, message.message_id)
+            except BadRequest as e:
+                return f"Telegram: {e}"
+            return None
+
+    async def prefetch(self, urls) -> dict[str, str]:
+        """Проверяет (и при возможности загружает) картинки без file_id.
+        Возвращает {url: ошибка} для битых ссылок."""
+        urls = [url for url in dict.fromkeys(urls) if url and url not in self._file_ids]
+        if not urls:
+            return {}
+        errors = await asyncio.gather(*(self._prefetch_one(url) for url in urls))
+        broken = {url: error for url, error in zip(urls, errors) if error}
+        logger.info(f"🖼 Проверено картинок: {len(urls)}, битых: {len(broken)}")
+        return broken
+
+    def stats(self) -> dict:
+        return {"size": len(self._file_ids), "hits": self.hits, "misses": self.misses}
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -1,122 +1,430 @@
-import psycopg2
+import asyncio
+import contextlib
+import decimal
+import hashlib
 import json
 import datetime
 import logging
-from psycopg2.extras import DictCursor
+import asyncpg
+import pytz
+
+from cache import TTLCache
+
+from config import TIMEZONE, MIN_STEP, EXTEND_THRESHOLD_MIN, EXTEND_TO_MIN, MAX_UNPAID_WARNINGS
 
 logger = logging.getLogger(__name__)
 
+# Канал LISTEN/NOTIFY, в который публикуются изменения статусов платежей
+PAYMENT_EVENTS_CHANNEL = "payment_events"
+
+# Advisory lock, под которым процессы по очереди применяют SCHEMA_SQL и миграции
+SCHEMA_LOCK_KEY = 715000
+
+# Ошибки, после которых соединение из пула считается мёртвым и запрос можно повторить
+RECONNECT_ERRORS = (
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InterfaceError,
+    ConnectionError,
+)
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        user_name TEXT,
+        warnings INTEGER DEFAULT 0,
+        banned_until TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS lots (
+        auction_id INTEGER PRIMARY KEY,
+        name TEXT,
+        article TEXT,
+        start_price DECIMAL(10,2),
+        current_price DECIMAL(10,2),
+        images TEXT,
+        video_url TEXT,
+        description TEXT,
+        start_time TIMESTAMP,
+        end_time TIMESTAMP,
+        status TEXT DEFAULT 'pending',
+        winner_user_id BIGINT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bid_log (
+        id BIGSERIAL,
+        auction_id INTEGER NOT NULL,
+        user_id BIGINT NOT NULL,
+        amount DECIMAL(10,2) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (auction_id, id)
+    ) PARTITION BY LIST (auction_id)
+    """,
+    """
+    ALTER TABLE bid_log ADD COLUMN IF NOT EXISTS stream_id TEXT
+    """,
+    """
+    CREATE OR REPLACE VIEW latest_bids AS
+    SELECT DISTINCT ON (auction_id, user_id) auction_id, user_id, amount, created_at
+    FROM bid_log
+    ORDER BY auction_id, user_id, id DESC
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payments (
+        id SERIAL PRIMARY KEY,
+        auction_id INTEGER,
+        user_id BIGINT,
+        amount DECIMAL(10,2),
+        payment_status TEXT DEFAULT 'pending',
+        payment_id TEXT,
+        paid_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS report_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        auction_id INTEGER,
+        name TEXT,
+        article TEXT,
+        start_price DECIMAL(10,2),
+        final_price DECIMAL(10,2),
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        sent_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS media_cache (
+        url TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS webhook_events (
+        event_key TEXT PRIMARY KEY,
+        payment_id TEXT,
+        payload JSONB,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP
+    )
+    """,
+    """
+    ALTER TABLE lots ADD COLUMN IF NOT EXISTS sheet_hash TEXT
+    """,
+    """
+    ALTER TABLE lots
+        ADD COLUMN IF NOT EXISTS channel_message_id BIGINT,
+        ADD COLUMN IF NOT EXISTS channel_message_kind TEXT
+    """,
+    """
+    ALTER TABLE lots ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP
+    """,
+    """
+    ALTER TABLE payments
+        ADD COLUMN IF NOT EXISTS payment_url TEXT,
+        ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_lots_auction_id ON lots(auction_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_lots_status ON lots(status);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_lots_end_time ON lots(end_time);
+    """,
+    """
+    DROP INDEX IF EXISTS idx_bids_auction_amount;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_auction_user ON payments(auction_id, user_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_bid_log_ranked ON bid_log(auction_id, amount DESC, id) INCLUDE (user_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_bid_log_user ON bid_log(user_id);
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_bid_log_stream ON bid_log(auction_id, stream_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_payments_open ON payments(payment_status, expires_at) WHERE processed_at IS NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_report_outbox_unsent ON report_outbox(next_attempt_at) WHERE sent_at IS NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_webhook_events_unprocessed ON webhook_events(received_at) WHERE processed_at IS NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_lots_finished_at ON lots(finished_at) WHERE status = 'finished';
+    """
+]
+
+
+def to_db_time(value: datetime.datetime | None) -> datetime.datetime | None:
+    """Приводит aware-datetime к локальному naive-времени (колонки TIMESTAMP без зоны)"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(pytz.timezone(TIMEZONE)).replace(tzinfo=None)
+
+
+def active_ban_until(user: dict | None) -> datetime.datetime | None:
+    """Окончание действующего бана пользователя или None"""
+    banned_until = user.get('banned_until') if user else None
+    if isinstance(banned_until, str):
+        banned_until = datetime.datetime.fromisoformat(banned_until)
+    if banned_until and banned_until > datetime.datetime.now():
+        return banned_until
+    return None
+
+
+def lot_content_hash(lot: dict) -> str:
+    """Хэш содержимого строки лота из таблицы — по нему sync_lots находит изменённые лоты"""
+    start_time = to_db_time(lot.get("start_time"))
+    payload = json.dumps(
+        [
+            lot.get("name"),
+            lot.get("article"),
+            str(lot.get("start_price")),
+            lot.get("images"),
+            lot.get("video_url"),
+            lot.get("description"),
+            start_time.isoformat() if start_time else None,
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
-class Database:
-    def __init__(self, db_uri: str):
+
+class AsyncDatabase:
+    """Доступ к БД: пул соединений asyncpg, кэш подготовленных
+    запросов на каждом соединении и переподключение при обрыве связи с БД."""
+
+    def __init__(
+            self,
+            db_uri: str,
+            min_size: int = 2,
+            max_size: int = 10,
+            command_timeout: float = 10.0,
+            statement_cache_size: int = 256,
+            lot_cache_size: int = 1024,
+            lot_cache_ttl: float = 10.0,
+            user_cache_size: int = 10000,
+            user_cache_ttl: float = 300.0,
+    ):
         self.db_uri = db_uri
-        self.connection = psycopg2.connect(self.db_uri, cursor_factory=DictCursor)
-        self.cursor = self.connection.cursor()
-        self.init_tables()
-
-    def init_tables(self):
-        """Инициализация таблиц если их нет"""
-        tables = [
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                user_name TEXT,
-                warnings INTEGER DEFAULT 0,
-                banned_until TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS lots (
-                auction_id INTEGER PRIMARY KEY,
-                name TEXT,
-                article TEXT,
-                start_price DECIMAL(10,2),
-                current_price DECIMAL(10,2),
-                images TEXT,
-                video_url TEXT,
-                description TEXT,
-                start_time TIMESTAMP,
-                end_time TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                winner_user_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS bids (
-                id SERIAL PRIMARY KEY,
-                auction_id INTEGER REFERENCES lots(auction_id),
-                user_id BIGINT,
-                amount DECIMAL(10,2),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(auction_id, user_id, amount)
-            )
-            """,
-            """
-            CREATE TABLE IF NOT EXISTS payments (
-                id SERIAL PRIMARY KEY,
-                auction_id INTEGER,
-                user_id BIGINT,
-                amount DECIMAL(10,2),
-                payment_status TEXT DEFAULT 'pending',
-                payment_id TEXT,
-                paid_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self.statement_cache_size = statement_cache_size
+        self.pool: asyncpg.Pool | None = None
+        self._pool_lock = asyncio.Lock()
+        # Кэш строк лотов и списка pending/active; сбрасывается мутаторами лотов
+        self.lot_cache = TTLCache(maxsize=lot_cache_size, ttl=lot_cache_ttl)
+        # Кэш строк users; сбрасывается при бане/предупреждении
+        self.user_cache = TTLCache(maxsize=user_cache_size, ttl=user_cache_ttl)
+
+    async def connect(self) -> asyncpg.Pool:
+        async with self._pool_lock:
+            if self.pool is not None:
+                return self.pool
+            pool = await asyncpg.create_pool(
+                self.db_uri,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                command_timeout=self.command_timeout,
+                statement_cache_size=self.statement_cache_size,
+                max_inactive_connection_lifetime=300,
             )
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_lots_auction_id ON lots(auction_id);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_lots_status ON lots(status);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_lots_end_time ON lots(end_time);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_bids_auction_id ON bids(auction_id);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_bids_user_id ON bids(user_id);
-            """,
-            """
-            CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id);
-            """
-        ]
-
-        for table_sql in tables:
+            async with pool.acquire() as conn:
+                await conn.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK_KEY)
+                try:
+                    for table_sql in SCHEMA_SQL:
+                        try:
+                            await conn.execute(table_sql)
+                        except Exception as e:
+                            logger.error(f"❌ Error creating table/index: {e}")
+                    try:
+                        await self._migrate_bid_partitions(conn)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка переноса ставок по секциям: {e}")
+                finally:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", SCHEMA_LOCK_KEY)
+            self.pool = pool
+            logger.info(f"✅ Пул соединений с БД создан ({self.min_size}..{self.max_size})")
+            return pool
+
+    async def _migrate_bid_partitions(self, conn):
+        """
+        Однократный перенос ставок в секции по лотам — из bid_log_default прежней схемы
+        или из старой таблицы bids; заодно создаются секции незавершённых лотов.
+        После него у bid_log нет секции по умолчанию (иначе DETACH CONCURRENTLY
+        недоступен). Выполняется под SCHEMA_LOCK_KEY, отметка — в schema_migrations.
+        """
+        name = "bid_log_per_lot_partitions"
+        if await conn.fetchval("SELECT 1 FROM schema_migrations WHERE name = $1", name):
+            return
+
+        async with conn.transaction():
+            source = None
+            if await conn.fetchval("SELECT to_regclass('bid_log_default') IS NOT NULL"):
+                await conn.execute("ALTER TABLE bid_log DETACH PARTITION bid_log_default")
+                source = "bid_log_default"
+            elif (
+                    await conn.fetchval("SELECT to_regclass('bids') IS NOT NULL")
+                    and not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM bid_log)")
+            ):
+                source = "bids"
+
+            q_lots = "SELECT auction_id FROM lots WHERE status IN ('pending', 'active')"
+            auction_ids = {row['auction_id'] for row in await conn.fetch(q_lots)}
+            if source:
+                rows = await conn.fetch(f"SELECT DISTINCT auction_id FROM {source}")
+                auction_ids |= {row['auction_id'] for row in rows}
+            for auction_id in sorted(auction_ids):
+                partition = self._bid_partition(auction_id)
+                await conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF bid_log FOR VALUES IN ({int(auction_id)})"
+                )
+
+            if source == "bid_log_default":
+                # id выданы той же последовательностью bid_log — сохраняем их
+                await conn.execute("""
+                    INSERT INTO bid_log (id, auction_id, user_id, amount, created_at, stream_id)
+                    SELECT id, auction_id, user_id, amount, created_at, stream_id FROM bid_log_default
+                """)
+                await conn.execute("DROP TABLE bid_log_default")
+            elif source == "bids":
+                await conn.execute("""
+                    INSERT INTO bid_log (auction_id, user_id, amount, created_at)
+                    SELECT auction_id, user_id, amount, created_at FROM bids ORDER BY id
+                """)
+            await conn.execute("INSERT INTO schema_migrations (name) VALUES ($1)", name)
+        logger.info(f"📚 Ставки разнесены по секциям лотов ({source or 'без переноса'}): {len(auction_ids)}")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logger.info("🔌 Пул соединений с БД закрыт")
+
+    async def _run(self, method: str, query: str, *args, retry: bool = False):
+        """
+        Выполняет запрос на соединении из пула; при обрыве связи — один повтор.
+        Если соединение не удалось получить, запрос ещё не отправлен и повторяется всегда.
+        Обрыв во время запроса повторяется только с retry=True: сервер мог успеть
+        закоммитить, поэтому так можно лишь для чтения и идемпотентных записей.
+        """
+        for attempt in range(2):
+            pool = self.pool or await self.connect()
+            sent = False
+            try:
+                async with pool.acquire() as conn:
+                    if conn.is_closed():
+                        raise ConnectionError("соединение из пула уже закрыто")
+                    sent = True
+                    return await getattr(conn, method)(query, *args)
+            except RECONNECT_ERRORS as e:
+                if attempt or (sent and not retry):
+                    raise
+                logger.warning(f"⏳ Потеряно соединение с БД, переподключаюсь: {e}")
+                await pool.expire_connections()
+
+    async def listen(self, channel: str, handler, reconnect_delay: float = 5.0, health_check_sec: float = 30.0):
+        """
+        LISTEN на отдельном соединении (вне пула), пока задачу не отменят.
+        handler(payload: str) вызывается на каждое уведомление; при обрыве
+        соединение переустанавливается.
+        """
+        while True:
+            conn = None
             try:
-                self.execute(table_sql)
+                conn = await asyncpg.connect(self.db_uri)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: closed.set())
+                await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: handler(payload))
+                logger.info(f"👂 Подписка на канал {channel} установлена")
+
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout=health_check_sec)
+                    except asyncio.TimeoutError:
+                        await conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"❌ Error creating table/index: {e}")
+                logger.warning(f"⏳ Подписка на канал {channel} прервана: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(reconnect_delay)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Соединение из пула с открытой транзакцией"""
+        pool = self.pool or await self.connect()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    def invalidate_lot(self, auction_id: int | None = None):
+        """Сбрасывает кэш лота (или только списка, если auction_id не задан)"""
+        if auction_id is not None:
+            self.lot_cache.invalidate(("lot", auction_id))
+        self.lot_cache.invalidate(("active_or_pending",))
+
+    def invalidate_user(self, user_id: int):
+        self.user_cache.invalidate(("user", user_id))
 
-    def execute(self, query, params=None):
+    def cache_stats(self) -> dict:
+        return {"lots": self.lot_cache.stats(), "users": self.user_cache.stats()}
+
+    # execute по умолчанию не повторяется после обрыва (запись могла пройти);
+    # fetchone/fetchall — чтение, повторяются. Идемпотентные записи передают retry явно.
+
+    async def execute(self, query, *args, retry: bool = False):
         try:
-            self.cursor.execute(query, params or ())
-            self.connection.commit()
-            return self.cursor
+            return await self._run("execute", query, *args, retry=retry)
         except Exception as e:
             logger.error(f"❌ Ошибка выполнения запроса: {e}")
-            self.connection.rollback()
             raise
 
-    def fetchone(self, query, params=None):
+    async def fetchone(self, query, *args, retry: bool = True):
         try:
-            self.cursor.execute(query, params or ())
-            result = self.cursor.fetchone()
+            result = await self._run("fetchrow", query, *args, retry=retry)
             return dict(result) if result else None
         except Exception as e:
             logger.error(f"❌ Ошибка fetchone: {e}")
             return None
 
-    def fetchall(self, query, params=None):
+    async def fetchall(self, query, *args, retry: bool = True):
         try:
-            self.cursor.execute(query, params or ())
-            results = self.cursor.fetchall()
+            results = await self._run("fetch", query, *args, retry=retry)
             return [dict(row) for row in results]
         except Exception as e:
             logger.error(f"❌ Ошибка fetchall: {e}")
@@ -124,170 +432,799 @@ class Database:
 
     # --- Users ---
 
-    def upsert_user(self, user_id: int, user_name: str):
+    async def upsert_user(self, user_id: int, user_name: str):
+        """Регистрирует пользователя и возвращает его строку.
+        Если пользователь есть в кэше с тем же именем — запись в БД не выполняется."""
+        cached = self.user_cache.get(("user", user_id))
+        if cached is not None and cached.get('user_name') == user_name:
+            return cached
+
         q = """
         INSERT INTO users (user_id, user_name)
-        VALUES (%s, %s)
+        VALUES ($1, $2)
         ON CONFLICT (user_id) DO UPDATE SET user_name = EXCLUDED.user_name
+        RETURNING *
         """
-        self.execute(q, (user_id, user_name))
+        user = await self.fetchone(q, user_id, user_name)
+        if user is not None:
+            self.user_cache.set(("user", user_id), user)
         logger.debug(f"👤 User upserted: {user_id}")
+        return user
 
-    def get_user(self, user_id: int):
-        q = "SELECT * FROM users WHERE user_id = %s"
-        return self.fetchone(q, (user_id,))
+    async def get_user(self, user_id: int):
+        key = ("user", user_id)
+        cached = self.user_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        q = "SELECT * FROM users WHERE user_id = $1"
+        user = await self.fetchone(q, user_id)
+        if user is not None:
+            self.user_cache.set(key, user)
+            return dict(user)
+        return None
 
-    def add_warning_auto_ban(self, user_id: int, ban_days: int):
-        """Используется при неоплате — увеличивает warnings и при >=3 ставит бан."""
-        user = self.get_user(user_id)
-        if user is None:
-            return
-        warnings = user.get('warnings', 0) + 1
-        banned_until = None
-        if warnings >= 3:
-            banned_until = datetime.datetime.now() + datetime.timedelta(days=ban_days)
-            logger.info(f"🔨 Автобан пользователя {user_id} на {ban_days} дней (warnings={warnings})")
-        q = "UPDATE users SET warnings = %s, banned_until = %s WHERE user_id = %s"
-        self.execute(q, (warnings, banned_until, user_id))
-
-    def set_ban(self, user_id: int, until: datetime.datetime | None):
-        q = "UPDATE users SET banned_until = %s WHERE user_id = %s"
-        self.execute(q, (until, user_id))
+    async def is_banned(self, user_id: int) -> bool:
+        return active_ban_until(await self.get_user(user_id)) is not None
+
+    async def add_warning_auto_ban(self, user_id: int, ban_days: int) -> datetime.datetime | None:
+        """Используется при неоплате — увеличивает warnings и при >=3 ставит бан.
+        Одним UPDATE: счётчик из кэша может быть устаревшим (другой процесс или реплика).
+        Возвращает срок бана, если он поставлен."""
+        q = """
+        UPDATE users
+        SET warnings = COALESCE(warnings, 0) + 1,
+            banned_until = CASE WHEN COALESCE(warnings, 0) + 1 >= $2 THEN $3 ELSE banned_until END
+        WHERE user_id = $1
+        RETURNING warnings
+        """
+        banned_until = datetime.datetime.now() + datetime.timedelta(days=ban_days)
+        user = await self.fetchone(q, user_id, MAX_UNPAID_WARNINGS, banned_until, retry=False)
+        self.invalidate_user(user_id)
+        if user is None or user['warnings'] < MAX_UNPAID_WARNINGS:
+            return None
+        logger.info(f"🔨 Автобан пользователя {user_id} на {ban_days} дней (warnings={user['warnings']})")
+        return banned_until
+
+    async def set_ban(self, user_id: int, until: datetime.datetime | None):
+        q = "UPDATE users SET banned_until = $1 WHERE user_id = $2"
+        await self.execute(q, to_db_time(until), user_id, retry=True)
+        self.invalidate_user(user_id)
         logger.info(f"🔨 Set ban for user {user_id}: {until}")
 
-    def increment_warning(self, user_id: int):
-        user = self.get_user(user_id)
-        if user is None:
-            return
-        warnings = user.get('warnings', 0) + 1
-        q = "UPDATE users SET warnings = %s WHERE user_id = %s"
-        self.execute(q, (warnings, user_id))
-        logger.info(f"⚠ Warning added for user {user_id} (total: {warnings})")
+    async def get_active_bans(self) -> list[dict]:
+        """Действующие баны (user_id, banned_until) — для зеркала в Redis"""
+        q = "SELECT user_id, banned_until FROM users WHERE banned_until > $1"
+        return await self.fetchall(q, datetime.datetime.now())
+
+    async def increment_warning(self, user_id: int):
+        q = "UPDATE users SET warnings = COALESCE(warnings, 0) + 1 WHERE user_id = $1 RETURNING warnings"
+        user = await self.fetchone(q, user_id, retry=False)
+        self.invalidate_user(user_id)
+        if user is not None:
+            logger.info(f"⚠ Warning added for user {user_id} (total: {user['warnings']})")
 
     # --- Lots ---
 
-    def lot_exists(self, auction_id: int) -> bool:
-        q = "SELECT 1 FROM lots WHERE auction_id = %s"
-        return self.fetchone(q, (auction_id,)) is not None
+    async def lot_exists(self, auction_id: int) -> bool:
+        q = "SELECT 1 FROM lots WHERE auction_id = $1"
+        return await self.fetchone(q, auction_id) is not None
 
-    def create_lot(self, auction_id, name, article, start_price, images, video_url, description, start_time):
+    async def create_lot(self, auction_id, name, article, start_price, images, video_url, description, start_time):
         q = """
         INSERT INTO lots (auction_id, name, article, start_price, current_price,
                           images, video_url, description, start_time, status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending')
+        VALUES ($1, $2, $3, $4, $4, $5, $6, $7, $8, 'pending')
         """
         images_json = json.dumps(images) if isinstance(images, list) else images
-        self.execute(
+        await self.execute(
             q,
-            (
-                auction_id,
-                name,
-                article,
-                start_price,
-                start_price,
-                images_json,
-                video_url,
-                description,
-                start_time,
-            ),
+            auction_id,
+            name,
+            article,
+            start_price,
+            images_json,
+            video_url,
+            description,
+            to_db_time(start_time),
         )
+        self.invalidate_lot(auction_id)
         logger.info(f"📦 Lot created: {auction_id} '{name}'")
 
-    def get_lots_to_start(self):
-        now = datetime.datetime.now()
-        q = "SELECT auction_id FROM lots WHERE start_time <= %s AND status = 'pending'"
-        return self.fetchall(q, (now,))
+    async def sync_lots(self, lots: list[dict]) -> dict:
+        """
+        Диффовая синхронизация лотов из Google Sheets за несколько запросов:
+        один SELECT хэшей, один многострочный INSERT новых лотов и один UPDATE
+        только тех pending-лотов, у которых строка в таблице изменилась.
+        Возвращает {"created": [...], "updated": [...]} с номерами аукционов.
+        """
+        records = {}
+        for lot in lots:
+            images = lot.get("images")
+            records[lot["auction_id"]] = {
+                "auction_id": lot["auction_id"],
+                "name": lot.get("name"),
+                "article": lot.get("article"),
+                "start_price": decimal.Decimal(str(lot.get("start_price"))),
+                "images": json.dumps(images) if isinstance(images, list) else images,
+                "video_url": lot.get("video_url"),
+                "description": lot.get("description"),
+                "start_time": to_db_time(lot.get("start_time")),
+                "sheet_hash": lot_content_hash(lot),
+            }
+
+        columns = """
+            auction_id int, name text, article text, start_price numeric, images text,
+            video_url text, description text, start_time timestamp, sheet_hash text
+        """
+        q_known = "SELECT auction_id, status, sheet_hash FROM lots WHERE auction_id = ANY($1::int[])"
+        q_insert = f"""
+        INSERT INTO lots (auction_id, name, article, start_price, current_price,
+                          images, video_url, description, start_time, status, sheet_hash)
+        SELECT s.auction_id, s.name, s.article, s.start_price, s.start_price,
+               s.images, s.video_url, s.description, s.start_time, 'pending', s.sheet_hash
+        FROM jsonb_to_recordset($1::jsonb) AS s({columns})
+        ON CONFLICT (auction_id) DO NOTHING
+        RETURNING auction_id
+        """
+        q_update = f"""
+        UPDATE lots l
+        SET name = s.name,
+            article = s.article,
+            start_price = s.start_price,
+            current_price = s.start_price,
+            images = s.images,
+            video_url = s.video_url,
+            description = s.description,
+            start_time = s.start_time,
+            sheet_hash = s.sheet_hash
+        FROM jsonb_to_recordset($1::jsonb) AS s({columns})
+        WHERE l.auction_id = s.auction_id
+          AND l.status = 'pending'
+          AND l.sheet_hash IS DISTINCT FROM s.sheet_hash
+        RETURNING l.auction_id
+        """
+
+        created, updated = [], []
+        async with self.transaction() as conn:
+            known = {
+                row["auction_id"]: row
+                for row in await conn.fetch(q_known, list(records))
+            }
+            new_rows = [r for auction_id, r in records.items() if auction_id not in known]
+            changed_rows = [
+                r for auction_id, r in records.items()
+                if auction_id in known
+                and known[auction_id]["status"] == "pending"
+                and known[auction_id]["sheet_hash"] != r["sheet_hash"]
+            ]
+            if new_rows:
+                rows = await conn.fetch(q_insert, json.dumps(new_rows, default=str, ensure_ascii=False))
+                created = [row["auction_id"] for row in rows]
+            if changed_rows:
+                rows = await conn.fetch(q_update, json.dumps(changed_rows, default=str, ensure_ascii=False))
+                updated = [row["auction_id"] for row in rows]
 
-    def set_lot_status(self, auction_id: int, status: str):
-        q = "UPDATE lots SET status = %s WHERE auction_id = %s"
-        self.execute(q, (status, auction_id))
-        logger.debug(f"📊 Lot {auction_id} status changed to {status}")
+        for auction_id in created + updated:
+            self.invalidate_lot(auction_id)
+        if created or updated:
+            logger.info(f"📦 Синхронизация лотов: создано {len(created)}, обновлено {len(updated)}")
+        return {"created": created, "updated": updated}
+
+    async def start_lot(self, auction_id: int, end_time: datetime.datetime, force: bool = False):
+        """
+        Запускает лот: pending -> active с end_time, только если время старта наступило.
+        С force — любой неактивный лот, без проверки времени. Условие в UPDATE, поэтому
+        из двух одновременных запусков (таймер, админ, другая реплика) сработает один.
+        Возвращает строку запущенного лота или None.
+        """
+        q = """
+        UPDATE lots SET status = 'active', end_time = $2
+        WHERE auction_id = $1
+          AND (status = 'pending' OR ($3 AND status <> 'active'))
+          AND ($3 OR start_time <= $4)
+        RETURNING *
+        """
+        lot = await self.fetchone(q, auction_id, to_db_time(end_time), force, datetime.datetime.now(), retry=False)
+        self.invalidate_lot(auction_id)
+        if lot is not None:
+            logger.debug(f"📊 Lot {auction_id} status changed to active, ends at {end_time}")
+        return lot
 
-    def set_lot_end_time(self, auction_id: int, end_time: datetime.datetime):
-        q = "UPDATE lots SET end_time = %s WHERE auction_id = %s"
-        self.execute(q, (end_time, auction_id))
-        logger.debug(f"⏰ Lot {auction_id} end_time set to {end_time}")
+    async def finish_lot(self, auction_id: int, force: bool = False, no_bids_report: str | None = None):
+        """
+        Закрывает лот для ставок: active -> finished, только если end_time наступил
+        (или force). Ставка блокирует строку лота (place_bid), поэтому продлённый ею лот
+        не закроется, а после смены статуса ставки по лоту уже не принимаются —
+        победителя выбирают только после этого.
+        Если ставок не было и задан no_bids_report — в той же транзакции кладёт строку
+        отчёта в report_outbox (итоговая цена пустая).
+        Возвращает {"has_bids": ...} или None, если лот не закрыт (продлён, не активен).
+        """
+        q_finish = """
+        UPDATE lots SET status = 'finished', finished_at = $2
+        WHERE auction_id = $1
+          AND status = 'active'
+          AND ($3 OR end_time IS NULL OR end_time <= $2)
+        RETURNING auction_id, name, article, start_price
+        """
+        q_report = """
+        INSERT INTO report_outbox (auction_id, name, article, start_price, final_price, status,
+                                   created_at, next_attempt_at)
+        VALUES ($1, $2, $3, $4, NULL, $5, $6, $6)
+        """
+        now = datetime.datetime.now()
+        try:
+            async with self.transaction() as conn:
+                lot = await conn.fetchrow(q_finish, auction_id, now, force)
+                if lot is None:
+                    return None
+                # Отдельный запрос видит все ставки, закоммиченные до смены статуса
+                has_bids = await conn.fetchval(
+                    "SELECT EXISTS (SELECT 1 FROM bid_log WHERE auction_id = $1)", auction_id,
+                )
+                if not has_bids and no_bids_report:
+                    await conn.execute(
+                        q_report, auction_id, lot['name'], lot['article'], lot['start_price'], no_bids_report, now,
+                    )
+        finally:
+            self.invalidate_lot(auction_id)
+        logger.debug(f"📊 Lot {auction_id} status changed to finished")
+        return {"has_bids": has_bids}
 
-    def get_lot(self, auction_id: int):
+    async def get_lot(self, auction_id: int, fresh: bool = False):
+        """Строка лота; fresh=True — мимо кэша (перед сменой статуса лота)"""
+        lot = None if fresh else self.lot_cache.get(("lot", auction_id))
+        if lot is not None:
+            return dict(lot)
         q = """
-        SELECT * FROM lots WHERE auction_id = %s
+        SELECT * FROM lots WHERE auction_id = $1
         """
-        return self.fetchone(q, (auction_id,))
+        lot = await self.fetchone(q, auction_id)
+        if lot is not None:
+            self.lot_cache.set(("lot", auction_id), lot)
+            return dict(lot)
+        return None
 
-    def update_current_price(self, auction_id: int, amount):
-        q = "UPDATE lots SET current_price = %s WHERE auction_id = %s"
-        self.execute(q, (amount, auction_id))
-        logger.debug(f"💰 Lot {auction_id} price updated to {amount}")
+    async def set_channel_message(self, auction_id: int, message_id: int, kind: str):
+        """Запоминает пост лота в канале (kind: photo / text), чтобы его редактировать"""
+        q = "UPDATE lots SET channel_message_id = $1, channel_message_kind = $2 WHERE auction_id = $3"
+        await self.execute(q, message_id, kind, auction_id, retry=True)
+        self.invalidate_lot(auction_id)
 
-    def set_winner(self, auction_id: int, user_id: int | None):
-        q = "UPDATE lots SET winner_user_id = %s WHERE auction_id = %s"
-        self.execute(q, (user_id, auction_id))
-        logger.info(f"👑 Winner set for lot {auction_id}: {user_id}")
+    async def get_live_channel_posts(self) -> list[int]:
+        """Активные лоты, у которых есть пост в канале"""
+        q = """
+        SELECT auction_id FROM lots
+        WHERE status = 'active' AND channel_message_id IS NOT NULL
+        ORDER BY end_time
+        """
+        return [row['auction_id'] for row in await self.fetchall(q)]
 
-    def get_active_or_pending_lots(self):
+    async def get_active_or_pending_lots(self):
+        rows = self.lot_cache.get(("active_or_pending",))
+        if rows is not None:
+            return list(rows)
         q = """
         SELECT auction_id, name, current_price, status
         FROM lots
         WHERE status IN ('pending','active')
         ORDER BY start_time ASC
         """
-        return self.fetchall(q)
+        rows = await self.fetchall(q)
+        self.lot_cache.set(("active_or_pending",), rows)
+        return list(rows)
 
-    def get_finished_lots_to_close(self):
-        now = datetime.datetime.now()
+    async def get_lots_for_timers(self):
+        """Незавершённые лоты для восстановления таймеров старта/завершения"""
         q = """
-        SELECT auction_id FROM lots
-        WHERE status = 'active' AND end_time IS NOT NULL AND end_time <= %s
+        SELECT auction_id, status, start_time, end_time
+        FROM lots
+        WHERE status IN ('pending','active')
         """
-        return self.fetchall(q, (now,))
+        return await self.fetchall(q)
 
     # --- Bids ---
 
-    def add_bid(self, auction_id: int, user_id: int, amount):
-        # Удаляем старую ставку этого пользователя
-        q_delete = "DELETE FROM bids WHERE auction_id = %s AND user_id = %s"
-        self.execute(q_delete, (auction_id, user_id))
+    # Ставки хранятся в журнале bid_log (только INSERT), секционированном по лоту:
+    # у каждого лота своя секция bid_log_<id>, секции по умолчанию нет — ставка
+    # по лоту без секции не примется. Последняя ставка участника — представление latest_bids.
 
-        # Добавляем новую ставку
-        q = "INSERT INTO bids (auction_id, user_id, amount) VALUES (%s, %s, %s)"
-        self.execute(q, (auction_id, user_id, amount))
-        logger.debug(f"💰 Bid added: auction {auction_id}, user {user_id}, amount {amount}")
+    @staticmethod
+    def _bid_partition(auction_id: int) -> str:
+        return f"bid_log_{int(auction_id)}"
 
-    def get_bids_desc(self, auction_id: int):
-        q = "SELECT user_id, amount FROM bids WHERE auction_id = %s ORDER BY amount DESC"
-        return self.fetchall(q, (auction_id,))
+    async def ensure_bid_partition(self, auction_id: int, lock_timeout_ms: int = 2000) -> bool:
+        """
+        Создаёт секцию журнала ставок для лота; False — не удалось (лот запускать нельзя).
+        Таблица создаётся отдельно и присоединяется через ATTACH PARTITION: ему нужна
+        лишь SHARE UPDATE EXCLUSIVE на bid_log, и ставки по другим лотам не ждут.
+        lock_timeout не даёт ожиданию блокировки затянуться.
+        """
+        partition = self._bid_partition(auction_id)
+        q_attached = """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_inherits
+            WHERE inhrelid = to_regclass($1) AND inhparent = 'bid_log'::regclass
+        )
+        """
+        try:
+            if await self._run("fetchval", q_attached, partition, retry=True):
+                return True
+            async with self.transaction() as conn:
+                await conn.execute("SELECT set_config('lock_timeout', $1, true)", f"{int(lock_timeout_ms)}ms")
+                await conn.execute(f"CREATE TABLE IF NOT EXISTS {partition} (LIKE bid_log INCLUDING DEFAULTS)")
+                await conn.execute(f"ALTER TABLE bid_log ATTACH PARTITION {partition} FOR VALUES IN ({int(auction_id)})")
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания секции {partition}: {e}")
+            return False
+        logger.debug(f"📚 Создана секция {partition}")
+        return True
 
-    def get_participants(self, auction_id: int):
-        q = "SELECT DISTINCT user_id FROM bids WHERE auction_id = %s"
-        return self.fetchall(q, (auction_id,))
+    async def detach_finished_bid_partitions(
+            self,
+            older_than: datetime.timedelta,
+            limit: int = 50,
+            lock_timeout_ms: int = 2000,
+    ) -> list[int]:
+        """
+        Отсоединяет секции завершённых давно лотов: их ставки уходят из горячего
+        журнала, но таблицы bid_log_<id> остаются в БД как архив.
+        DETACH CONCURRENTLY не блокирует ставки по другим лотам; прерванное
+        отсоединение (секция в состоянии detach pending) доводится через FINALIZE.
+        """
+        q = """
+        SELECT l.auction_id, i.inhdetachpending AS pending
+        FROM lots l
+        JOIN pg_class c ON c.relname = 'bid_log_' || l.auction_id
+        JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'bid_log'::regclass
+        WHERE l.status = 'finished' AND l.end_time < $1
+          AND NOT EXISTS (
+              SELECT 1 FROM payments p
+              WHERE p.auction_id = l.auction_id AND p.processed_at IS NULL
+          )
+        ORDER BY l.end_time
+        LIMIT $2
+        """
+        rows = await self.fetchall(q, datetime.datetime.now() - older_than, limit)
+        if not rows:
+            return []
+
+        detached = []
+        pool = self.pool or await self.connect()
+        # CONCURRENTLY нельзя выполнять в транзакции — lock_timeout ставится на сессию
+        async with pool.acquire() as conn:
+            await conn.execute(f"SET lock_timeout = '{int(lock_timeout_ms)}ms'")
+            try:
+                for row in rows:
+                    auction_id = row['auction_id']
+                    mode = "FINALIZE" if row['pending'] else "CONCURRENTLY"
+                    try:
+                        partition = self._bid_partition(auction_id)
+                        await conn.execute(f"ALTER TABLE bid_log DETACH PARTITION {partition} {mode}")
+                    except asyncpg.exceptions.LockNotAvailableError:
+                        logger.warning(f"⏳ Секция ставок лота {auction_id} занята, отсоединим позже")
+                        continue
+                    detached.append(auction_id)
+            finally:
+                await conn.execute("RESET lock_timeout")
+        if detached:
+            logger.info(f"📚 Отсоединены секции ставок лотов: {detached}")
+        return detached
+
+    async def place_bid(
+            self,
+            auction_id: int,
+            user_id: int,
+            amount=None,
+            increment=None,
+            min_step=MIN_STEP,
+            extend_threshold_min: int = EXTEND_THRESHOLD_MIN,
+            extend_to_min: int = EXTEND_TO_MIN,
+    ):
+        """
+        Атомарная ставка одним запросом: блокирует строку лота, проверяет статус,
+        окончание (end_time), бан и минимальный шаг, записывает ставку, поднимает current_price и
+        продлевает end_time по правилу 10 минут.
+        Сумма задаётся явно (amount) или шагом от текущей цены (increment).
+        Возвращает dict с outcome: accepted / too_low / banned / not_active / not_found.
+        """
+        q = """
+        WITH lot AS (
+            SELECT auction_id, status, current_price, end_time
+            FROM lots
+            WHERE auction_id = $1
+            FOR UPDATE
+        ),
+        bid AS (
+            SELECT COALESCE($3::numeric, lot.current_price + $4::numeric) AS amount
+            FROM lot
+        ),
+        banned AS (
+            SELECT EXISTS (
+                SELECT 1 FROM users WHERE user_id = $2 AND banned_until > $5
+            ) AS is_banned
+        ),
+        upd AS (
+            UPDATE lots l
+            SET current_price = bid.amount,
+                end_time = CASE
+                    WHEN l.end_time IS NOT NULL AND l.end_time - $5 < make_interval(mins => $7)
+                        THEN $5 + make_interval(mins => $8)
+                    ELSE l.end_time
+                END
+            FROM lot, bid, banned
+            WHERE l.auction_id = lot.auction_id
+              AND lot.status = 'active'
+              AND (lot.end_time IS NULL OR lot.end_time > $5)
+              AND NOT banned.is_banned
+              AND bid.amount >= lot.current_price + $6
+            RETURNING l.current_price, l.end_time,
+                      l.end_time IS DISTINCT FROM lot.end_time AS extended
+        ),
+        ins AS (
+            INSERT INTO bid_log (auction_id, user_id, amount, created_at)
+            SELECT $1, $2, current_price, $5 FROM upd
+        )
+        SELECT
+            CASE
+                WHEN lot.auction_id IS NULL THEN 'not_found'
+                WHEN lot.status <> 'active' OR lot.end_time <= $5 THEN 'not_active'
+                WHEN banned.is_banned THEN 'banned'
+                WHEN upd.current_price IS NOT NULL THEN 'accepted'
+                ELSE 'too_low'
+            END AS outcome,
+            lot.current_price AS previous_price,
+            COALESCE(upd.current_price, bid.amount) AS amount,
+            COALESCE(upd.end_time, lot.end_time) AS end_time,
+            COALESCE(upd.extended, FALSE) AS extended
+        FROM banned
+        LEFT JOIN lot ON TRUE
+        LEFT JOIN bid ON TRUE
+        LEFT JOIN upd ON TRUE
+        """
+        now = datetime.datetime.now()
+        result = await self._run(
+            "fetchrow",
+            q,
+            auction_id,
+            user_id,
+            amount,
+            increment,
+            now,
+            min_step,
+            extend_threshold_min,
+            extend_to_min,
+        )
+        result = dict(result)
+        if result['outcome'] == "accepted":
+            self.invalidate_lot(auction_id)
+        logger.debug(f"💰 Bid {result['outcome']}: auction {auction_id}, user {user_id}, amount {result['amount']}")
+        return result
+
+    async def apply_hot_bids(self, rows: list[dict]):
+        """
+        Запись ставок, принятых в Redis (hot_state), одним запросом: строки журнала
+        (повтор той же записи потока игнорируется по stream_id) и цена/end_time лотов.
+        rows: stream_id, auction_id, user_id, amount, end_time, created_at.
+        """
+        q = """
+        WITH s AS (
+            SELECT * FROM jsonb_to_recordset($1::jsonb) AS s(
+                stream_id text, auction_id int, user_id bigint, amount numeric,
+                end_time timestamp, created_at timestamp
+            )
+        ),
+        ins AS (
+            INSERT INTO bid_log (auction_id, user_id, amount, created_at, stream_id)
+            SELECT auction_id, user_id, amount, created_at, stream_id FROM s
+            ON CONFLICT (auction_id, stream_id) DO NOTHING
+        ),
+        agg AS (
+            SELECT auction_id, MAX(amount) AS amount, MAX(end_time) AS end_time
+            FROM s GROUP BY auction_id
+        )
+        UPDATE lots l
+        SET current_price = GREATEST(l.current_price, agg.amount),
+            end_time = GREATEST(l.end_time, agg.end_time)
+        FROM agg
+        WHERE l.auction_id = agg.auction_id
+        RETURNING l.auction_id
+        """
+        # Повтор после обрыва безопасен: дубли строк отсекаются по stream_id, цена и end_time — GREATEST
+        updated = await self._run("fetch", q, json.dumps(rows, default=str), retry=True)
+        for row in updated:
+            self.invalidate_lot(row['auction_id'])
+
+    async def iter_ranked_bidders(self, auction_id: int, limit: int | None = None, batch_size: int = 50):
+        """
+        Участники лота по убыванию их лучшей ставки, лениво.
+        Ставки читаются курсором по idx_bid_log_ranked (index-only scan) порциями
+        по batch_size, поэтому для победителя и пары следующих по очереди не нужно
+        сортировать все ставки лота. Используйте через contextlib.aclosing,
+        чтобы соединение вернулось в пул при досрочном выходе.
+        """
+        q = """
+        SELECT user_id, amount FROM bid_log
+        WHERE auction_id = $1
+        ORDER BY amount DESC, id
+        """
+        seen = set()
+        async with self.transaction() as conn:
+            async for row in conn.cursor(q, auction_id, prefetch=batch_size):
+                if row['user_id'] in seen:
+                    continue
+                seen.add(row['user_id'])
+                yield dict(row)
+                if limit is not None and len(seen) >= limit:
+                    return
+
+    async def get_participants(self, auction_id: int):
+        q = "SELECT DISTINCT user_id FROM bid_log WHERE auction_id = $1"
+        return await self.fetchall(q, auction_id)
+
+    async def get_user_auctions(self, user_id: int, limit: int = 10):
+        q = """
+        SELECT DISTINCT b.auction_id, l.start_time, l.status
+        FROM bid_log b
+        JOIN lots l ON b.auction_id = l.auction_id
+        WHERE b.user_id = $1
+        ORDER BY l.start_time DESC
+        LIMIT $2
+        """
+        return await self.fetchall(q, user_id, limit)
 
     # --- Payments ---
 
-    def insert_payment(self, auction_id: int, user_id: int, amount, payment_id: str, status: str = "pending"):
+    # Состояния платежа победителя:
+    #   pending   (processed_at IS NULL) — ждём оплату до expires_at
+    #   completed (processed_at IS NULL) — оплата отмечена (webhook), бот ещё не подтвердил
+    #   completed (processed_at задан)   — оплата подтверждена, строка отчёта в outbox
+    #   expired   (processed_at задан)   — время вышло, лот предложен следующему
+
+    async def create_payment_offer(
+            self,
+            auction_id: int,
+            user_id: int,
+            amount,
+            payment_id: str,
+            payment_url: str,
+            expires_at: datetime.datetime,
+    ):
+        """Назначает победителя и создаёт платёж с дедлайном одной транзакцией"""
+        q = """
+        WITH winner AS (
+            UPDATE lots SET winner_user_id = $2 WHERE auction_id = $1
+        )
+        INSERT INTO payments (auction_id, user_id, amount, payment_status, payment_id,
+                              payment_url, expires_at, created_at)
+        VALUES ($1, $2, $3, 'pending', $4, $5, $6, $7)
+        """
+        await self.execute(
+            q, auction_id, user_id, amount, payment_id, payment_url,
+            to_db_time(expires_at), datetime.datetime.now(),
+        )
+        self.invalidate_lot(auction_id)
+        logger.info(f"💳 Payment offer: auction {auction_id}, user {user_id}, amount {amount}, id {payment_id}")
+
+    async def get_open_payments(self, expiring_within_sec: float | None = None, limit: int = 500):
+        """Платежи, ожидающие оплаты и ещё не просроченные;
+        expiring_within_sec — только те, чей дедлайн наступит в ближайшие N секунд"""
+        now = datetime.datetime.now()
+        horizon = now + datetime.timedelta(seconds=expiring_within_sec) if expiring_within_sec is not None else None
+        q = """
+        SELECT payment_id, auction_id, user_id, amount, expires_at
+        FROM payments
+        WHERE payment_status = 'pending' AND processed_at IS NULL AND expires_at > $1
+          AND ($2::timestamp IS NULL OR expires_at <= $2)
+        ORDER BY expires_at
+        LIMIT $3
+        """
+        return await self.fetchall(q, now, horizon, limit)
+
+    async def get_paid_unprocessed_payments(self, limit: int = 500):
+        q = """
+        SELECT payment_id FROM payments
+        WHERE payment_status = 'completed' AND processed_at IS NULL
+        LIMIT $1
+        """
+        return await self.fetchall(q, limit)
+
+    async def complete_payment(self, payment_id: str, report_status: str):
+        """
+        Подтверждает оплату (ровно один раз) и в той же транзакции кладёт строку отчёта
+        с итоговой ценой в report_outbox. Возвращает платёж или None, если он уже
+        обработан или просрочен.
+        """
+        q = """
+        WITH pay AS (
+            UPDATE payments
+            SET payment_status = 'completed',
+                paid_at = COALESCE(paid_at, $3),
+                processed_at = $3
+            WHERE payment_id = $1
+              AND processed_at IS NULL
+              AND payment_status IN ('pending', 'completed')
+            RETURNING auction_id, user_id, amount
+        ),
+        report AS (
+            INSERT INTO report_outbox (auction_id, name, article, start_price, final_price, status,
+                                       created_at, next_attempt_at)
+            SELECT l.auction_id, l.name, l.article, l.start_price, pay.amount, $2, $3, $3
+            FROM pay
+            JOIN lots l ON l.auction_id = pay.auction_id
+        )
+        SELECT auction_id, user_id, amount FROM pay
+        """
+        row = await self._run("fetchrow", q, payment_id, report_status, datetime.datetime.now())
+        if row is None:
+            return None
+        logger.info(f"💳 Payment {payment_id} completed, report queued")
+        return dict(row)
+
+    # --- Media ---
+
+    async def get_media_file_ids(self) -> dict[str, str]:
+        rows = await self.fetchall("SELECT url, file_id FROM media_cache")
+        return {row['url']: row['file_id'] for row in rows}
+
+    async def save_media_file_id(self, url: str, file_id: str):
+        q = """
+        INSERT INTO media_cache (url, file_id, created_at)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (url) DO UPDATE SET file_id = EXCLUDED.file_id, created_at = EXCLUDED.created_at
+        """
+        await self.execute(q, url, file_id, datetime.datetime.now(), retry=True)
+
+    # --- Webhook ЮKassa ---
+
+    async def record_webhook_event(self, event_key: str, payment_id: str, payload: dict) -> bool:
+        """Сохраняет входящее уведомление; False — такое уже приходило (повторная доставка)"""
+        q = """
+        INSERT INTO webhook_events (event_key, payment_id, payload, received_at)
+        VALUES ($1, $2, $3::jsonb, $4)
+        ON CONFLICT (event_key) DO NOTHING
+        RETURNING event_key
+        """
+        row = await self._run(
+            "fetchrow", q, event_key, payment_id,
+            json.dumps(payload, ensure_ascii=False), datetime.datetime.now(),
+        )
+        return row is not None
+
+    async def apply_payment_webhook(self, event_key: str, payment_id: str) -> bool:
+        """
+        Отмечает платёж оплаченным по payment_id (индекс), закрывает событие webhook
+        и публикует NOTIFY в PAYMENT_EVENTS_CHANNEL — всё одним запросом.
+        Возвращает True, если статус платежа изменился.
+        """
+        q = f"""
+        WITH pay AS (
+            UPDATE payments
+            SET payment_status = 'completed',
+                paid_at = COALESCE(paid_at, $3)
+            WHERE payment_id = $1
+              AND payment_status = 'pending'
+              AND processed_at IS NULL
+            RETURNING payment_id, auction_id, user_id, payment_status
+        ),
+        evt AS (
+            UPDATE webhook_events SET processed_at = $3 WHERE event_key = $2
+        )
+        SELECT pg_notify(
+            '{PAYMENT_EVENTS_CHANNEL}',
+            json_build_object(
+                'payment_id', payment_id,
+                'auction_id', auction_id,
+                'user_id', user_id,
+                'status', payment_status
+            )::text
+        )
+        FROM pay
+        """
+        rows = await self._run("fetch", q, payment_id, event_key, datetime.datetime.now())
+        return bool(rows)
+
+    async def get_unprocessed_webhook_events(self, limit: int = 500):
         q = """
-        INSERT INTO payments (auction_id, user_id, amount, payment_status, payment_id)
-        VALUES (%s, %s, %s, %s, %s)
+        SELECT event_key, payment_id FROM webhook_events
+        WHERE processed_at IS NULL
+        ORDER BY received_at
+        LIMIT $1
         """
-        self.execute(q, (auction_id, user_id, amount, status, payment_id))
-        logger.info(f"💳 Payment created: auction {auction_id}, user {user_id}, amount {amount}, id {payment_id}")
+        return await self.fetchall(q, limit)
 
-    def update_payment_status(self, auction_id: int, user_id: int, status: str):
+    async def expire_due_payments(self, limit: int = 100):
+        """Переводит просроченные pending-платежи в expired и возвращает их"""
         q = """
         UPDATE payments
-        SET payment_status = %s,
-            paid_at = CASE WHEN %s = 'completed' THEN NOW() ELSE paid_at END
-        WHERE auction_id = %s AND user_id = %s
-        ORDER BY created_at DESC
-        LIMIT 1
+        SET payment_status = 'expired',
+            processed_at = $1
+        WHERE id IN (
+            SELECT id FROM payments
+            WHERE payment_status = 'pending' AND processed_at IS NULL AND expires_at <= $1
+            ORDER BY expires_at
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING payment_id, auction_id, user_id, amount
+        """
+        return [dict(row) for row in await self._run("fetch", q, datetime.datetime.now(), limit)]
+
+    async def get_lots_awaiting_offer(
+            self,
+            grace_sec: float,
+            horizon: datetime.timedelta,
+            limit: int = 50,
+    ) -> list[int]:
         """
-        self.execute(q, (status, status, auction_id, user_id))
-        logger.info(f"💳 Payment status updated: auction {auction_id}, user {user_id}, status {status}")
+        Завершённые лоты, по которым оплату никому не предложили: есть участник,
+        которому лот ещё не предлагали, и нет ни открытого, ни оплаченного платежа
+        (сбой между завершением лота или просрочкой платежа и созданием нового).
+        grace_sec — сколько ждать после завершения/просрочки, чтобы не пересечься
+        с предложением, которое ещё создаётся. Смотрятся только лоты, завершённые
+        за последние horizon (idx_lots_finished_at), — цена прохода не растёт с историей.
+        """
+        q = """
+        SELECT l.auction_id
+        FROM lots l
+        WHERE l.status = 'finished'
+          AND l.finished_at > $3
+          AND l.finished_at <= $1
+          AND NOT EXISTS (
+              SELECT 1 FROM payments p
+              WHERE p.auction_id = l.auction_id
+                AND (p.processed_at IS NULL OR p.processed_at > $1 OR p.payment_status = 'completed')
+          )
+          AND EXISTS (
+              SELECT 1 FROM bid_log b
+              WHERE b.auction_id = l.auction_id
+                AND NOT EXISTS (
+                    SELECT 1 FROM payments p
+                    WHERE p.auction_id = b.auction_id AND p.user_id = b.user_id
+                )
+          )
+        ORDER BY l.finished_at
+        LIMIT $2
+        """
+        now = datetime.datetime.now()
+        since = now - datetime.timedelta(seconds=grace_sec)
+        return [row['auction_id'] for row in await self.fetchall(q, since, limit, now - horizon)]
+
+    async def get_next_bidder(self, auction_id: int):
+        """Старшая ставка пользователя, которому этот лот ещё не предлагали к оплате"""
+        q = "SELECT DISTINCT user_id FROM payments WHERE auction_id = $1"
+        offered = {row['user_id'] for row in await self.fetchall(q, auction_id)}
+        async with contextlib.aclosing(self.iter_ranked_bidders(auction_id)) as bidders:
+            async for bidder in bidders:
+                if bidder['user_id'] not in offered:
+                    return bidder
+        return None
+
+    # --- Report outbox ---
+
+    async def get_pending_reports(self, limit: int = 100):
+        q = """
+        SELECT id, auction_id, name, article, start_price, final_price, status, created_at
+        FROM report_outbox
+        WHERE sent_at IS NULL AND next_attempt_at <= $1
+        ORDER BY id
+        LIMIT $2
+        """
+        return await self.fetchall(q, datetime.datetime.now(), limit)
+
+    async def mark_reports_sent(self, ids: list[int]):
+        q = "UPDATE report_outbox SET sent_at = $2 WHERE id = ANY($1::bigint[])"
+        await self.execute(q, ids, datetime.datetime.now(), retry=True)
+        logger.debug(f"📝 Report rows sent: {ids}")
 
-    def get_latest_payment(self, auction_id: int, user_id: int):
+    async def mark_reports_failed(self, ids: list[int], error: str, base_delay: float, max_delay: float):
+        """Экспоненциальная задержка перед следующей попыткой: base_delay * 2^attempts, не больше max_delay"""
         q = """
-        SELECT payment_status FROM payments
-        WHERE auction_id = %s AND user_id = %s
-        ORDER BY id DESC LIMIT 1
+        UPDATE report_outbox
+        SET attempts = attempts + 1,
+            last_error = $2,
+            next_attempt_at = $3 + make_interval(secs => LEAST($4 * power(2, attempts), $5))
+        WHERE id = ANY($1::bigint[])
         """
-        result = self.fetchone(q, (auction_id, user_id))
-        return result.get('payment_status') if result else None
\ No newline at end of file
+        await self.execute(q, ids, error[:500], datetime.datetime.now(), base_delay, max_delay)
+        logger.warning(f"⚠ Report rows failed, will retry: {ids}")
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class BidNotifier:
+    """
+    Уведомления участников о новых ставках.
+    Ставки по лоту копятся window_sec секунд, после чего каждый участник получает
+    одно сообщение с последней ценой. Рассылка идёт в фоне, параллельно,
+    но не более concurrency отправок одновременно.
+    """
+
+    def __init__(self, bot, get_participants, window_sec: float = 2.0, concurrency: int = 10):
+        self.bot = bot
+        self.get_participants = get_participants
+        self.window_sec = window_sec
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.sent = 0
+        self.coalesced = 0
+        self._pending: dict[int, tuple[int, float]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def notify(self, auction_id: int, bidder_id: int, amount):
+        """Ставит уведомление в очередь и сразу возвращает управление обработчику ставки"""
+        if auction_id in self._pending:
+            self.coalesced += 1
+        self._pending[auction_id] = (bidder_id, amount)
+        if auction_id not in self._tasks:
+            self._tasks[auction_id] = asyncio.create_task(self._flush_later(auction_id))
+
+    async def _flush_later(self, auction_id: int):
+        try:
+            await asyncio.sleep(self.window_sec)
+            # Ставки, пришедшие во время рассылки, попадут уже в следующее окно
+            del self._tasks[auction_id]
+            bidder_id, amount = self._pending.pop(auction_id)
+
+            participants = await self.get_participants(auction_id)
+            await asyncio.gather(*(
+                self._send(participant.get('user_id'), auction_id, amount)
+                for participant in participants
+                if participant.get('user_id') != bidder_id
+            ))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления участников: {e}")
+        finally:
+            if self._tasks.get(auction_id) is asyncio.current_task():
+                del self._tasks[auction_id]
+
+    async def _send(self, user_id: int, auction_id: int, amount):
+        text = (
+            f"🔔 Новая ставка по аукциону №{auction_id}!\n"
+            f"💰 Сумма: {amount}₽\n\n"
+            f"Проверьте свою карточку лота, чтобы сделать ставку!"
+        )
+        async with self.semaphore:
+            for attempt in range(2):
+                try:
+                    await self.bot.send_message(user_id, text)
+                    self.sent += 1
+                    return
+                except RetryAfter as e:
+                    if attempt:
+                        break
+                    await asyncio.sleep(e.timeout)
+                except TelegramAPIError as e:
+                    logger.debug(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+                    return
+        logger.debug(f"Не удалось отправить уведомление пользователю {user_id}: flood control")
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._pending.clear()
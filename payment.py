@@ -1,29 +1,28 @@
+import asyncio
+import concurrent.futures
+import functools
+import glob
+import io
+import os
+import random
 import uuid
 import qrcode
-import json
-import requests
+import aiohttp
 import logging
-from typing import Tuple
+from typing import Optional, Tuple
 
-from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
+from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, QR_WORKERS, QR_CACHE_SIZE
 
 logger = logging.getLogger(__name__)
 
+YOOKASSA_API_URL = "https://api.yookassa.ru/v3/payments"
 
-def generate_payment_url(auction_id: int, user_id: int, amount: float) -> Tuple[str, str]:
-    """
-    Создание платежа в ЮKassa и получение ссылки на оплату.
-    Возвращает (payment_url, payment_id)
-    """
-    payment_id = str(uuid.uuid4())
+# Отрисовка QR — CPU-работа, её выносим из event loop в отдельный пул
+_qr_executor = concurrent.futures.ThreadPoolExecutor(max_workers=QR_WORKERS, thread_name_prefix="qr")
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {YOOKASSA_SECRET_KEY}",
-        "Idempotence-Key": payment_id
-    }
 
-    payload = {
+def _payment_payload(auction_id: int, user_id: int, amount: float) -> dict:
+    return {
         "amount": {
             "value": f"{amount:.2f}",
             "currency": "RUB"
@@ -41,77 +40,146 @@ def generate_payment_url(auction_id: int, user_id: int, amount: float) -> Tuple[
         }
     }
 
-    try:
-        logger.info(f"💳 Создание платежа ЮKassa: аукцион {auction_id}, сумма {amount}₽")
 
-        response = requests.post(
-            "https://api.yookassa.ru/v3/payments",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=10
-        )
+def _fallback_payment_url(auction_id: int, user_id: int, amount: float) -> str:
+    return f"https://yoomoney.ru/transfer?to={YOOKASSA_SHOP_ID}&sum={amount}&label={auction_id}_{user_id}"
 
-        if response.status_code == 200:
-            payment_data = response.json()
-            payment_url = payment_data.get("confirmation", {}).get("confirmation_url", "")
-            payment_id = payment_data.get("id", payment_id)
 
-            logger.info(f"✅ Платеж ЮKassa создан: {payment_id}")
-            logger.debug(f"🔗 Ссылка на оплату: {payment_url}")
-
-            return payment_url, payment_id
-        else:
-            logger.error(f"❌ Ошибка API ЮKassa: {response.status_code} - {response.text}")
-            # Fallback URL если API не работает
-            return f"https://yoomoney.ru/transfer?to={YOOKASSA_SHOP_ID}&sum={amount}&label={auction_id}_{user_id}", payment_id
-
-    except requests.exceptions.Timeout:
-        logger.error(f"❌ Таймаут при создании платежа ЮKassa")
-        return f"https://yoomoney.ru/transfer?to={YOOKASSA_SHOP_ID}&sum={amount}&label={auction_id}_{user_id}", payment_id
-    except Exception as e:
-        logger.error(f"❌ Ошибка создания платежа ЮKassa: {e}")
-        return f"https://yoomoney.ru/transfer?to={YOOKASSA_SHOP_ID}&sum={amount}&label={auction_id}_{user_id}", payment_id
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def generate_qr_png(payment_url: str) -> bytes:
+    """PNG с QR-кодом в памяти, без файлов на диске; результат кэшируется по ссылке"""
+    img = qrcode.make(payment_url)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
 
 
-def generate_qr(payment_url: str) -> str:
-    """Генерация QR-кода для оплаты"""
+async def render_qr(payment_url: str) -> Optional[bytes]:
+    """Асинхронная генерация QR-кода в пуле потоков; None при ошибке"""
     try:
         logger.info(f"🖼 Генерация QR-кода для ссылки")
-        img = qrcode.make(payment_url)
-        path = f"qr_{uuid.uuid4().hex[:8]}.png"
-        img.save(path)
-        logger.info(f"✅ QR-код сохранен: {path}")
-        return path
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_qr_executor, generate_qr_png, payment_url)
     except Exception as e:
         logger.error(f"❌ Ошибка генерации QR-кода: {e}")
-        # Возвращаем дефолтный путь
-        return f"qr_error.png"
+        return None
 
 
-def check_payment_status(payment_id: str) -> str:
-    """Проверка статуса платежа в ЮKassa"""
-    headers = {
-        "Authorization": f"Bearer {YOOKASSA_SECRET_KEY}",
-    }
+def cleanup_legacy_qr_files(*directories: str) -> int:
+    """Удаляет qr_*.png, оставшиеся от прежней генерации QR в файлы; возвращает число удалённых файлов"""
+    removed = 0
+    for directory in directories:
+        for path in glob.glob(os.path.join(directory, "qr_*.png")):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось удалить {path}: {e}")
+    if removed:
+        logger.info(f"🧹 Удалено старых QR-файлов: {removed}")
+    return removed
 
-    try:
-        response = requests.get(
-            f"https://api.yookassa.ru/v3/payments/{payment_id}",
+
+class YooKassaClient:
+    """
+    Асинхронный клиент ЮKassa для вызова из корутин бота.
+    Держит общий keep-alive пул соединений, ограничивает число одновременных
+    запросов и повторяет сетевые ошибки, 429 и 5xx с экспоненциальной задержкой
+    и джиттером. Повтор создания платежа идёт с тем же Idempotence-Key,
+    поэтому дубль платежа не создаётся.
+    """
+
+    def __init__(
+            self,
+            secret_key: str = YOOKASSA_SECRET_KEY,
+            max_connections: int = 20,
+            concurrency: int = 10,
+            retries: int = 3,
+            backoff_sec: float = 0.5,
+    ):
+        self.secret_key = secret_key
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff_sec = backoff_sec
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": f"Bearer {self.secret_key}"},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _request(self, method: str, url: str, timeout: float, **kwargs) -> Optional[Tuple[int, dict]]:
+        """(HTTP-статус, JSON-ответ) или None, если попытки исчерпаны"""
+        session = self._get_session()
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    async with session.request(
+                            method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs
+                    ) as response:
+                        if response.status != 429 and response.status < 500:
+                            return response.status, await response.json(content_type=None)
+                        last_error = f"{response.status} - {await response.text()}"
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = repr(e)
+
+            if attempt < self.retries:
+                # Full jitter: случайная пауза до backoff * 2^attempt
+                await asyncio.sleep(random.uniform(0, self.backoff_sec * 2 ** attempt))
+
+        logger.error(f"❌ ЮKassa недоступна ({method} {url}): {last_error}")
+        return None
+
+    async def create_payment(self, auction_id: int, user_id: int, amount: float) -> Tuple[str, str]:
+        """Создание платежа в ЮKassa: возвращает (payment_url, payment_id)"""
+        payment_id = str(uuid.uuid4())
+        headers = {
+            "Content-Type": "application/json",
+            "Idempotence-Key": payment_id,
+        }
+
+        logger.info(f"💳 Создание платежа ЮKassa: аукцион {auction_id}, сумма {amount}₽")
+        result = await self._request(
+            "POST",
+            YOOKASSA_API_URL,
+            timeout=10,
             headers=headers,
-            timeout=5
+            json=_payment_payload(auction_id, user_id, amount),
         )
 
-        if response.status_code == 200:
-            payment_data = response.json()
-            status = payment_data.get("status", "pending")
+        if result and result[0] == 200:
+            payment_data = result[1]
+            payment_url = payment_data.get("confirmation", {}).get("confirmation_url", "")
+            payment_id = payment_data.get("id", payment_id)
+
+            logger.info(f"✅ Платеж ЮKassa создан: {payment_id}")
+            logger.debug(f"🔗 Ссылка на оплату: {payment_url}")
+            return payment_url, payment_id
+
+        if result:
+            logger.error(f"❌ Ошибка API ЮKassa: {result[0]} - {result[1]}")
+        # Fallback URL если API не работает
+        return _fallback_payment_url(auction_id, user_id, amount), payment_id
+
+    async def get_payment_status(self, payment_id: str) -> str:
+        """Проверка статуса платежа в ЮKassa"""
+        result = await self._request("GET", f"{YOOKASSA_API_URL}/{payment_id}", timeout=5)
+
+        if result and result[0] == 200:
+            status = result[1].get("status", "pending")
             logger.debug(f"🔍 Статус платежа {payment_id}: {status}")
             return status
-        else:
-            logger.warning(f"⚠️ Не удалось проверить статус платежа {payment_id}: {response.status_code}")
-            return "pending"
-    except requests.exceptions.Timeout:
-        logger.warning(f"⚠️ Таймаут при проверке статуса платежа {payment_id}")
+
+        if result:
+            logger.warning(f"⚠️ Не удалось проверить статус платежа {payment_id}: {result[0]}")
         return "pending"
-    except Exception as e:
-        logger.error(f"❌ Ошибка проверки статуса платежа {payment_id}: {e}")
-        return "pending"
\ No newline at end of file
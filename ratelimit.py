@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+
+def per_worker(value: float, workers: int, minimum: float = 1) -> float:
+    """Доля общего лимита на один из workers процессов, но не меньше minimum
+    (и не больше самого лимита)"""
+    return max(min(value, minimum), value / workers)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._urgent = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Забирает токены, если они есть; не ждёт"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1, urgent: bool = False):
+        """Ждёт, пока накопятся токены; ожидающие обслуживаются по очереди.
+        urgent=True обходит очередь: обычные ожидающие пропускают вперёд срочных"""
+        if urgent:
+            self._urgent += 1
+            try:
+                while not self.try_acquire(tokens):
+                    await asyncio.sleep((tokens - self.tokens) / self.rate)
+            finally:
+                self._urgent -= 1
+            return
+
+        async with self._lock:
+            while True:
+                if not self._urgent and self.try_acquire(tokens):
+                    return
+                # Пока ждут срочные, токены копятся для них
+                wait = tokens if self._urgent else tokens - self.tokens
+                await asyncio.sleep(wait / self.rate)
+
+    def refund(self, tokens: float = 1):
+        """Возвращает токены, взятые под операцию, которая не состоялась"""
+        self.tokens = min(self.capacity, self.tokens + tokens)
@@ -0,0 +1,63 @@
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeTime:
+    fake = FakeTime()
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+
+def test_entries_expire_after_ttl(clock):
+    lots = TTLCache(maxsize=10, ttl=10)
+    lots.set("a", 1)
+    lots.set("b", 2, ttl=30)
+
+    clock.now += 9.9
+    assert lots.get("a") == 1
+    clock.now += 0.1
+    assert lots.get("a") is None
+    assert "a" not in lots
+    assert lots.get("b") == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    lots = TTLCache(maxsize=2, ttl=10)
+    lots.set("a", 1)
+    lots.set("b", 2)
+    lots.get("a")
+    lots.set("c", 3)
+
+    assert "a" in lots
+    assert "b" not in lots
+    assert len(lots) == 2
+
+
+def test_falsy_values_are_cached(clock):
+    lots = TTLCache(maxsize=10, ttl=10)
+    lots.set("empty", [])
+    assert lots.get("empty", "miss") == []
+    assert lots.get("missing", "miss") == "miss"
+
+
+def test_invalidate_and_stats(clock):
+    lots = TTLCache(maxsize=10, ttl=10)
+    lots.set("a", 1)
+    lots.set("b", 2)
+    lots.get("a")
+    lots.get("zzz")
+    lots.invalidate("a", "zzz")
+    lots.clear()
+
+    assert lots.stats() == {"size": 0, "hits": 1, "misses": 1, "invalidations": 2, "hit_rate": 0.5}
@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.utils.exceptions import RetryAfter
+
+from channel_updater import ChannelPostUpdater
+from ratelimit import TokenBucket
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeBot:
+    def __init__(self, retry_after: int = 0):
+        self.edits = []
+        self.retry_after = retry_after
+
+    async def edit_message_caption(self, chat_id, message_id, caption, reply_markup, parse_mode):
+        if self.retry_after:
+            self.retry_after, timeout = 0, self.retry_after
+            raise RetryAfter(timeout)
+        self.edits.append(("caption", message_id, caption))
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup, parse_mode):
+        self.edits.append(("text", message_id, text))
+
+
+class Lots:
+    """Состояние лотов, которое читает апдейтер в момент правки"""
+
+    def __init__(self, prices: dict[int, int]):
+        self.rows = {
+            auction_id: {
+                'channel_message_id': 100 + auction_id,
+                'channel_message_kind': "photo",
+                'status': "active",
+                'price': price,
+            }
+            for auction_id, price in prices.items()
+        }
+
+    async def get(self, auction_id):
+        row = self.rows.get(auction_id)
+        return dict(row) if row else None
+
+    @staticmethod
+    def render(auction_id, lot):
+        return f"lot {auction_id}: {lot['price']} ({lot['status']})", None
+
+
+def make_updater(bot, lots, min_interval_sec: float = 0.05) -> ChannelPostUpdater:
+    return ChannelPostUpdater(
+        bot,
+        "@channel",
+        get_lot=lots.get,
+        render=lots.render,
+        limiter=TokenBucket(rate=1000, capacity=1000),
+        min_interval_sec=min_interval_sec,
+    )
+
+
+async def settle(updater: ChannelPostUpdater):
+    while updater._tasks:
+        await asyncio.gather(*list(updater._tasks.values()))
+
+
+def test_bursts_coalesce_into_one_edit_with_latest_state():
+    async def scenario():
+        bot, lots = FakeBot(), Lots({1: 100})
+        updater = make_updater(bot, lots)
+        for price in (150, 200, 250):
+            lots.rows[1]['price'] = price
+            updater.mark_dirty(1)
+        await settle(updater)
+        return bot, updater
+
+    bot, updater = run(scenario())
+    assert bot.edits == [("caption", 101, "lot 1: 250 (active)")]
+    assert updater.stats()["edits"] == 1
+
+
+def test_unchanged_caption_is_not_sent_again():
+    async def scenario():
+        bot, lots = FakeBot(), Lots({1: 100})
+        updater = make_updater(bot, lots, min_interval_sec=0)
+        updater.mark_dirty(1)
+        await settle(updater)
+        updater.mark_dirty(1)
+        await settle(updater)
+        return bot, updater
+
+    bot, updater = run(scenario())
+    assert len(bot.edits) == 1
+    assert updater.skipped == 1
+
+
+def test_edits_of_one_post_respect_min_interval():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        bot, lots = FakeBot(), Lots({1: 100})
+        updater = make_updater(bot, lots, min_interval_sec=0.1)
+        updater.mark_dirty(1)
+        await settle(updater)
+        first_at = loop.time()
+        lots.rows[1]['price'] = 200
+        updater.mark_dirty(1)
+        await settle(updater)
+        return bot, loop.time() - first_at
+
+    bot, elapsed = run(scenario())
+    assert len(bot.edits) == 2
+    assert elapsed >= 0.09
+
+
+def test_retry_after_is_waited_and_retried_once():
+    async def scenario():
+        bot, lots = FakeBot(retry_after=1), Lots({1: 100})
+        updater = make_updater(bot, lots)
+        updater.mark_dirty(1)
+        await settle(updater)
+        return bot
+
+    bot = run(scenario())
+    assert bot.edits == [("caption", 101, "lot 1: 100 (active)")]
+
+
+def test_finished_lot_is_forgotten_after_final_edit():
+    async def scenario():
+        bot, lots = FakeBot(), Lots({1: 100})
+        updater = make_updater(bot, lots, min_interval_sec=0)
+        lots.rows[1]['status'] = "finished"
+        updater.mark_dirty(1)
+        await settle(updater)
+        return updater
+
+    updater = run(scenario())
+    assert 1 not in updater._last_caption
+    assert 1 not in updater._last_edit_at
+
+
+def test_refresh_budget_rotates_through_posts():
+    async def scenario():
+        bot, lots = FakeBot(), Lots({1: 1, 2: 2, 3: 3, 4: 4, 5: 5})
+        updater = make_updater(bot, lots, min_interval_sec=0)
+        passes = []
+        for _ in range(3):
+            passes.append(sorted(updater.refresh([1, 2, 3, 4, 5], budget=2)))
+            await settle(updater)
+            await asyncio.sleep(0.001)
+        everything = updater.refresh([1, 2, 3])
+        await settle(updater)
+        return passes, everything
+
+    passes, everything = run(scenario())
+    assert passes[0] == [1, 2]
+    assert passes[1] == [3, 4]
+    # Пятый ещё не проверялся — он первый; затем самый давний из проверенных
+    assert passes[2] == [1, 5]
+    assert sorted(everything) == [1, 2, 3]
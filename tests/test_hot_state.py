@@ -0,0 +1,381 @@
+import asyncio
+import datetime
+import decimal
+import os
+import time
+import uuid
+
+import pytest
+import pytz
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from config import TIMEZONE
+from hot_state import RedisHotState
+
+TZ = pytz.timezone(TIMEZONE)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def now_plus(**delta) -> datetime.datetime:
+    return datetime.datetime.now(TZ).replace(tzinfo=None) + datetime.timedelta(**delta)
+
+
+def make_state(**kwargs) -> RedisHotState:
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    return RedisHotState(client, min_step=50, extend_threshold_min=10, extend_to_min=10, **kwargs)
+
+
+def emulate_block(state: RedisHotState):
+    """fakeredis отвечает на XREADGROUP BLOCK сразу; как настоящий Redis, ждём block мс"""
+    xreadgroup = state.client.xreadgroup
+
+    async def blocking_xreadgroup(*args, block=None, **kwargs):
+        response = await xreadgroup(*args, block=block, **kwargs)
+        if not response and block:
+            await asyncio.sleep(block / 1000)
+        return response
+
+    state.client.xreadgroup = blocking_xreadgroup
+
+
+def lot_row(auction_id=1, price=1000, **end_delta) -> dict:
+    return {
+        'auction_id': auction_id,
+        'status': "active",
+        'current_price': decimal.Decimal(price),
+        'end_time': now_plus(**(end_delta or {'hours': 1})),
+    }
+
+
+class FakeDB:
+    """Записывает строки apply_hot_bids; первые fail_times вызовов падают"""
+
+    def __init__(self, fail_times: int = 0):
+        self.fail_times = fail_times
+        self.calls = []
+
+    async def apply_hot_bids(self, rows):
+        self.calls.append(rows)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("db is down")
+
+    @property
+    def stream_ids(self) -> list[str]:
+        return [row['stream_id'] for rows in self.calls for row in rows]
+
+
+# --- Lua: ставки ---
+
+def test_place_bid_accepted_by_step_and_by_amount():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row(price=1000))
+
+        by_step = await state.place_bid(1, 10, increment=100)
+        by_amount = await state.place_bid(1, 11, amount=1500)
+        participants = await state.get_participants(1)
+        stream_len = await state.client.xlen(state.stream)
+        await state.close()
+        return by_step, by_amount, participants, stream_len
+
+    by_step, by_amount, participants, stream_len = run(scenario())
+    assert by_step['outcome'] == "accepted"
+    assert by_step['previous_price'] == 1000
+    assert by_step['amount'] == 1100
+    assert by_amount['outcome'] == "accepted"
+    assert by_amount['previous_price'] == 1100
+    assert by_amount['amount'] == 1500
+    assert not by_amount['extended']
+    assert {int(row['user_id']) for row in participants} == {10, 11}
+    assert stream_len == 2
+
+
+def test_place_bid_too_low():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row(price=1000))
+        result = await state.place_bid(1, 10, amount=1049)
+        stream_len = await state.client.xlen(state.stream)
+        await state.close()
+        return result, stream_len
+
+    result, stream_len = run(scenario())
+    assert result['outcome'] == "too_low"
+    assert result['previous_price'] == 1000
+    assert stream_len == 0
+
+
+def test_place_bid_not_found_and_not_active():
+    async def scenario():
+        state = make_state()
+        missing = await state.place_bid(404, 10, increment=50)
+        await state.load_lot(lot_row(auction_id=2, minutes=-1))
+        expired = await state.place_bid(2, 10, increment=50)
+        await state.close()
+        return missing, expired
+
+    missing, expired = run(scenario())
+    assert missing['outcome'] == "not_found"
+    assert expired['outcome'] == "not_active"
+
+
+def test_place_bid_banned_until_ban_expires_or_is_lifted():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row())
+
+        await state.set_ban(10, now_plus(days=30))
+        banned = await state.place_bid(1, 10, increment=50)
+        await state.set_ban(10, None)
+        unbanned = await state.place_bid(1, 10, increment=50)
+
+        # Истёкший бан в Redis не попадает
+        await state.sync_bans([
+            {'user_id': 11, 'banned_until': now_plus(days=-1)},
+            {'user_id': 12, 'banned_until': now_plus(days=1)},
+        ])
+        expired_ban = await state.place_bid(1, 11, increment=50)
+        synced_ban = await state.place_bid(1, 12, increment=50)
+        ttl_ms = await state.client.pttl(state._ban_key(12))
+        await state.close()
+        return banned, unbanned, expired_ban, synced_ban, ttl_ms
+
+    banned, unbanned, expired_ban, synced_ban, ttl_ms = run(scenario())
+    assert banned['outcome'] == "banned"
+    assert unbanned['outcome'] == "accepted"
+    assert expired_ban['outcome'] == "accepted"
+    assert synced_ban['outcome'] == "banned"
+    assert 0 < ttl_ms <= 86_400_000
+
+
+def test_place_bid_extends_by_ten_minute_rule():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row(minutes=5))
+        before_ms = time.time() * 1000
+        result = await state.place_bid(1, 10, increment=50)
+        overlay = await state.overlay(lot_row(minutes=5))
+        await state.close()
+        return result, before_ms, overlay
+
+    result, before_ms, overlay = run(scenario())
+    assert result['outcome'] == "accepted"
+    assert result['extended']
+    end_ms = state_ms(result['end_time'])
+    assert end_ms >= before_ms + 10 * 60_000 - 1000
+    assert overlay['end_time'] == result['end_time']
+    assert overlay['current_price'] == 1050
+
+
+def state_ms(value: datetime.datetime) -> int:
+    return int(TZ.localize(value).timestamp() * 1000)
+
+
+def test_load_lot_keeps_existing_state():
+    async def scenario():
+        state = make_state()
+        first = await state.load_lot(lot_row(price=1000))
+        await state.place_bid(1, 10, amount=2000)
+        second = await state.load_lot(lot_row(price=1000))
+        overlay = await state.overlay(lot_row(price=1000))
+        await state.close()
+        return first, second, overlay
+
+    first, second, overlay = run(scenario())
+    assert first is True
+    assert second is False
+    assert overlay['current_price'] == 2000
+
+
+# --- Lua: закрытие лота ---
+
+def test_close_lot_returns_new_end_when_extended():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row(minutes=5))
+        extended_to = await state.close_lot(1)
+        still_open = await state.place_bid(1, 10, increment=50)
+        closed = await state.close_lot(1, force=True)
+        after_close = await state.place_bid(1, 11, increment=50)
+        ttl = await state.client.ttl(state._lot_key(1))
+        missing = await state.close_lot(404)
+        await state.close()
+        return extended_to, still_open, closed, after_close, ttl, missing
+
+    extended_to, still_open, closed, after_close, ttl, missing = run(scenario())
+    assert extended_to is not None
+    assert still_open['outcome'] == "accepted"
+    assert closed is None
+    assert after_close['outcome'] == "not_active"
+    assert 0 < ttl <= 86400
+    assert missing is None
+
+
+def test_close_lot_after_end_time():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row(minutes=-1))
+        closed = await state.close_lot(1)
+        status = await state.client.hget(state._lot_key(1), 'status')
+        await state.close()
+        return closed, status
+
+    closed, status = run(scenario())
+    assert closed is None
+    assert status == "finished"
+
+
+# --- Запись потока в Postgres ---
+
+def test_drain_writes_all_bids_and_empties_stream():
+    async def scenario():
+        state = make_state(batch_size=2)
+        await state.load_lot(lot_row(price=1000))
+        for user_id in range(5):
+            await state.place_bid(1, user_id, increment=50)
+        db = FakeDB()
+        written = await state.drain(db)
+        stream_len = await state.client.xlen(state.stream)
+        again = await state.drain(db)
+        await state.close()
+        return db, written, stream_len, again
+
+    db, written, stream_len, again = run(scenario())
+    assert written == 5
+    assert again == 0
+    assert stream_len == 0
+    rows = [row for rows in db.calls for row in rows]
+    assert [decimal.Decimal(row['amount']) for row in rows] == [1050, 1100, 1150, 1200, 1250]
+    assert all(row['auction_id'] == 1 for row in rows)
+    assert len(set(db.stream_ids)) == 5
+
+
+def test_drain_redelivers_failed_batch_with_same_stream_ids():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row())
+        await state.place_bid(1, 10, increment=50)
+        await state.place_bid(1, 11, increment=50)
+        db = FakeDB(fail_times=1)
+        with pytest.raises(ConnectionError):
+            await state.drain(db)
+        pending = await state.client.xpending(state.stream, state.GROUP)
+        written = await state.drain(db)
+        stream_len = await state.client.xlen(state.stream)
+        await state.close()
+        return db, pending, written, stream_len
+
+    db, pending, written, stream_len = run(scenario())
+    assert pending['pending'] == 2
+    assert written == 2
+    assert stream_len == 0
+    failed, retried = db.calls
+    assert [row['stream_id'] for row in failed] == [row['stream_id'] for row in retried]
+
+
+def test_run_writer_retries_after_db_error():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row())
+        await state.place_bid(1, 10, increment=50)
+        db = FakeDB(fail_times=1)
+        emulate_block(state)
+        writer = asyncio.create_task(state.run_writer(db, block_ms=10, retry_delay=0.01))
+        await asyncio.sleep(0.05)
+        await state.place_bid(1, 11, increment=50)
+
+        deadline = time.monotonic() + 5
+        while await state.client.xlen(state.stream) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        stream_len = await state.client.xlen(state.stream)
+
+        writer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await writer
+        await state.close()
+        return db, stream_len
+
+    db, stream_len = run(scenario())
+    assert stream_len == 0
+    # Порция, упавшая при старте, повторена с теми же id; новая ставка записана следом
+    failed, retried, *rest = db.calls
+    assert [row['stream_id'] for row in retried] == [row['stream_id'] for row in failed]
+    assert len(set(db.stream_ids)) == 2
+    assert [row['user_id'] for rows in db.calls[1:] for row in rows] == [10, 11]
+
+
+def test_drain_does_not_wait_for_blocked_writer_read():
+    async def scenario():
+        state = make_state()
+        await state.load_lot(lot_row())
+        db = FakeDB()
+        emulate_block(state)
+        writer = asyncio.create_task(state.run_writer(db, block_ms=5000))
+        await asyncio.sleep(0.05)
+
+        await state.place_bid(1, 10, increment=50)
+        started = time.monotonic()
+        written = await state.drain(db)
+        elapsed = time.monotonic() - started
+
+        writer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await writer
+        await state.close()
+        return db, written, elapsed
+
+    db, written, elapsed = run(scenario())
+    assert written == 1
+    assert elapsed < 1
+    assert len(db.stream_ids) == 1
+
+
+# --- apply_hot_bids на настоящей БД ---
+
+@pytest.mark.skipif(not os.getenv("TEST_DB_URI"), reason="нужна тестовая БД: TEST_DB_URI")
+def test_apply_hot_bids_is_idempotent():
+    pytest.importorskip("asyncpg")
+    from models import AsyncDatabase
+
+    async def scenario():
+        db = AsyncDatabase(os.environ["TEST_DB_URI"], min_size=1, max_size=2)
+        await db.connect()
+        auction_id = int(uuid.uuid4().int % 1_000_000_000) + 1_000_000_000
+        try:
+            await db.create_lot(auction_id, "test", "T-1", 1000, [], None, "", now_plus())
+            assert await db.ensure_bid_partition(auction_id)
+            end_time = now_plus(hours=1).replace(microsecond=0)
+            rows = [
+                {
+                    "stream_id": f"{1700000000000 + i}-0",
+                    "auction_id": auction_id,
+                    "user_id": 10 + i,
+                    "amount": str(1050 + 50 * i),
+                    "end_time": end_time,
+                    "created_at": now_plus(),
+                }
+                for i in range(3)
+            ]
+            await db.apply_hot_bids(rows)
+            # Повтор той же порции (сбой до XACK) и порция с более старой ценой
+            await db.apply_hot_bids(rows)
+            await db.apply_hot_bids([{**rows[0], "stream_id": "1600000000000-0", "amount": "1000"}])
+
+            count = await db._run("fetchval", "SELECT COUNT(*) FROM bid_log WHERE auction_id = $1", auction_id)
+            lot = await db._run("fetchrow", "SELECT * FROM lots WHERE auction_id = $1", auction_id)
+            return count, lot, end_time
+        finally:
+            await db._run("execute", f"DROP TABLE IF EXISTS {db._bid_partition(auction_id)}")
+            await db._run("execute", "DELETE FROM lots WHERE auction_id = $1", auction_id)
+            await db.close()
+
+    count, lot, end_time = run(scenario())
+    assert count == 4
+    assert lot['current_price'] == 1150
+    assert lot['end_time'] == end_time
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+import leader
+from leader import LeaderElector
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeConnection:
+    """Соединение с advisory lock: lock_free — свободна ли блокировка,
+    health — что делает проверка SELECT 1 (ok / fail / hang)"""
+
+    def __init__(self, lock_free: bool = True, health: str = "ok"):
+        self.lock_free = lock_free
+        self.health = health
+        self.terminated = False
+
+    async def fetchval(self, query, *args, timeout=None):
+        if "pg_try_advisory_lock" in query:
+            return self.lock_free
+        if self.health == "fail":
+            raise ConnectionError("connection lost")
+        if self.health == "hang":
+            await asyncio.wait_for(asyncio.Event().wait(), timeout)
+        return 1
+
+    def is_closed(self) -> bool:
+        return self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+class Roles:
+    def __init__(self, demote_delay: float = 0):
+        self.demote_delay = demote_delay
+        self.events = []
+
+    async def on_elected(self):
+        self.events.append("elected")
+
+    async def on_demoted(self):
+        self.events.append("demoting")
+        await asyncio.sleep(self.demote_delay)
+        self.events.append("demoted")
+
+
+def make_elector(monkeypatch, connections: list[FakeConnection], roles: Roles) -> LeaderElector:
+    async def connect(db_uri, server_settings=None):
+        assert int(server_settings["tcp_keepalives_count"]) > 0
+        return connections.pop(0)
+
+    monkeypatch.setattr(leader.asyncpg, "connect", connect)
+    return LeaderElector(
+        "postgresql://test",
+        715001,
+        on_elected=roles.on_elected,
+        on_demoted=roles.on_demoted,
+        retry_sec=0.01,
+        health_check_sec=0.05,
+    )
+
+
+async def run_for(elector: LeaderElector, seconds: float):
+    task = asyncio.create_task(elector.run())
+    await asyncio.sleep(seconds)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.parametrize("health", ["fail", "hang"])
+def test_failed_health_check_demotes_and_releases_lock(monkeypatch, health):
+    sick = FakeConnection(health=health)
+    standby = FakeConnection(lock_free=False)
+    roles = Roles()
+    elector = make_elector(monkeypatch, [sick, standby], roles)
+
+    run(run_for(elector, 0.3))
+
+    assert roles.events[:3] == ["elected", "demoting", "demoted"]
+    assert sick.terminated
+    # Блокировку забрала другая реплика — эта ждёт, не становясь лидером
+    assert not elector.is_leader
+    assert standby.terminated
+
+
+def test_stuck_demotion_does_not_hold_lock(monkeypatch):
+    sick = FakeConnection(health="fail")
+    roles = Roles(demote_delay=10)
+    elector = make_elector(monkeypatch, [sick, FakeConnection(lock_free=False)], roles)
+
+    async def scenario():
+        task = asyncio.create_task(elector.run())
+        await asyncio.sleep(0.2)
+        terminated = sick.terminated
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return terminated
+
+    assert run(scenario())
+    assert roles.events == ["elected", "demoting"]
+
+
+def test_healthy_leader_keeps_lock_until_cancelled(monkeypatch):
+    conn = FakeConnection()
+    roles = Roles()
+    elector = make_elector(monkeypatch, [conn], roles)
+
+    async def scenario():
+        task = asyncio.create_task(elector.run())
+        await asyncio.sleep(0.2)
+        held = elector.is_leader and not conn.terminated
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return held
+
+    assert run(scenario())
+    assert roles.events == ["elected", "demoting", "demoted"]
+    assert conn.terminated
@@ -0,0 +1,114 @@
+import asyncio
+
+from lifecycle import LifecycleExecutor
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Recorder:
+    """on_start/on_finish/on_publish с учётом параллельности и порядка вызовов"""
+
+    def __init__(self, delay: float = 0.01, fail_start=()):
+        self.delay = delay
+        self.fail_start = set(fail_start)
+        self.events = []
+        self.active = 0
+        self.max_active = 0
+
+    async def _work(self, event):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            self.events.append(event)
+        finally:
+            self.active -= 1
+
+    async def on_start(self, auction_id):
+        await self._work(("start", auction_id))
+        if auction_id in self.fail_start:
+            raise RuntimeError("start failed")
+        # Лот, который уже стартовал, возвращает None и не публикуется
+        return {'auction_id': auction_id} if auction_id > 0 else None
+
+    async def on_finish(self, auction_id):
+        await self._work(("finish", auction_id))
+
+    async def on_publish(self, auction_id, lot):
+        self.events.append(("publish", auction_id))
+
+
+def make_executor(recorder: Recorder, concurrency: int = 10) -> LifecycleExecutor:
+    return LifecycleExecutor(
+        on_start=recorder.on_start,
+        on_publish=recorder.on_publish,
+        on_finish=recorder.on_finish,
+        concurrency=concurrency,
+        batch_window_sec=0.02,
+    )
+
+
+def test_events_within_window_run_as_one_batch():
+    async def scenario():
+        recorder = Recorder()
+        executor = make_executor(recorder)
+        await executor.submit_start(1)
+        await executor.submit_finish(2)
+        await executor.submit_start(3)
+        await executor.submit_start(1)  # повтор того же события схлопывается
+        await asyncio.sleep(0.2)
+        await executor.close()
+        return recorder, executor
+
+    recorder, executor = run(scenario())
+    assert executor.last_run["starts"] == 2
+    assert executor.last_run["finishes"] == 1
+    assert executor.last_run["published"] == 2
+    processed = [event for event in recorder.events if event[0] != "publish"]
+    published = [event for event in recorder.events if event[0] == "publish"]
+    assert sorted(processed) == [("finish", 2), ("start", 1), ("start", 3)]
+    # Публикации идут после обработки всего пакета, в порядке поступления
+    assert recorder.events[-2:] == published == [("publish", 1), ("publish", 3)]
+
+
+def test_concurrency_is_bounded():
+    async def scenario():
+        recorder = Recorder(delay=0.02)
+        executor = make_executor(recorder, concurrency=3)
+        result = await executor.run([("finish", i) for i in range(10)])
+        return recorder, result
+
+    recorder, result = run(scenario())
+    assert result["finishes"] == 10
+    assert recorder.max_active == 3
+
+
+def test_failed_or_skipped_start_is_not_published_and_does_not_stop_batch():
+    async def scenario():
+        recorder = Recorder(fail_start={2})
+        executor = make_executor(recorder)
+        return recorder, await executor.run([("start", 1), ("start", 2), ("start", -3), ("finish", 4)])
+
+    recorder, result = run(scenario())
+    assert result["published"] == 1
+    assert ("publish", 1) in recorder.events
+    assert ("finish", 4) in recorder.events
+
+
+def test_next_window_starts_new_batch():
+    async def scenario():
+        recorder = Recorder()
+        executor = make_executor(recorder)
+        await executor.submit_start(1)
+        await asyncio.sleep(0.1)
+        first = executor.last_run
+        await executor.submit_finish(1)
+        await asyncio.sleep(0.1)
+        await executor.close()
+        return first, executor.last_run
+
+    first, second = run(scenario())
+    assert (first["starts"], first["finishes"]) == (1, 0)
+    assert (second["starts"], second["finishes"]) == (0, 1)
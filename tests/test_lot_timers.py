@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("apscheduler")
+
+from apscheduler.jobstores.base import JobLookupError
+
+from lot_timers import LotTimers
+
+
+class FakeScheduler:
+    """Хранит задачи по id, как APScheduler с replace_existing=True"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, func, trigger, run_date, args, id, replace_existing, misfire_grace_time):
+        assert trigger == "date"
+        assert replace_existing
+        self.jobs[id] = (func, run_date, args)
+
+    def remove_job(self, job_id):
+        if job_id not in self.jobs:
+            raise JobLookupError(job_id)
+        del self.jobs[job_id]
+
+
+async def on_start(auction_id):
+    pass
+
+
+async def on_finish(auction_id):
+    pass
+
+
+def at(minutes: int) -> datetime.datetime:
+    return datetime.datetime(2026, 1, 1, 12, 0) + datetime.timedelta(minutes=minutes)
+
+
+def make_timers(enabled: bool = True) -> tuple[LotTimers, FakeScheduler]:
+    scheduler = FakeScheduler()
+    return LotTimers(scheduler, on_start, on_finish, enabled=enabled), scheduler
+
+
+def test_rearm_replaces_timer_of_same_lot():
+    timers, scheduler = make_timers()
+    timers.arm_finish(1, at(0))
+    timers.arm_finish(1, at(10))  # ставка продлила лот
+    timers.arm_finish(2, at(5))
+
+    assert set(scheduler.jobs) == {"lot_finish:1", "lot_finish:2"}
+    assert scheduler.jobs["lot_finish:1"] == (on_finish, at(10), [1])
+
+
+def test_start_and_finish_timers_are_independent():
+    timers, scheduler = make_timers()
+    timers.arm_start(1, at(0))
+    timers.arm_finish(1, at(720))
+
+    assert scheduler.jobs["lot_start:1"] == (on_start, at(0), [1])
+    assert scheduler.jobs["lot_finish:1"] == (on_finish, at(720), [1])
+
+
+def test_cancel_removes_both_timers_and_ignores_missing():
+    timers, scheduler = make_timers()
+    timers.arm_start(1, at(0))
+    timers.arm_finish(2, at(0))
+
+    timers.cancel(1)
+    timers.cancel(1)
+    timers.cancel(404)
+
+    assert set(scheduler.jobs) == {"lot_finish:2"}
+
+
+def test_disabled_timers_are_not_armed():
+    timers, scheduler = make_timers(enabled=False)
+    timers.arm_start(1, at(0))
+    timers.rebuild([{'auction_id': 2, 'status': "active", 'end_time': at(0)}])
+    assert scheduler.jobs == {}
+
+    timers.enabled = True
+    timers.arm_start(1, at(0))
+    assert set(scheduler.jobs) == {"lot_start:1"}
+
+
+def test_rebuild_arms_by_status():
+    timers, scheduler = make_timers()
+    timers.arm_finish(1, at(0))
+    timers.rebuild([
+        {'auction_id': 1, 'status': "active", 'start_time': at(-60), 'end_time': at(30)},
+        {'auction_id': 2, 'status': "pending", 'start_time': at(15), 'end_time': None},
+        {'auction_id': 3, 'status': "finished", 'start_time': at(-60), 'end_time': at(-1)},
+        {'auction_id': 4, 'status': "pending", 'start_time': None, 'end_time': None},
+        {'auction_id': 5, 'status': "active", 'start_time': at(-60), 'end_time': None},
+    ])
+
+    assert set(scheduler.jobs) == {"lot_finish:1", "lot_start:2"}
+    assert scheduler.jobs["lot_finish:1"][1] == at(30)
+    assert scheduler.jobs["lot_start:2"][1] == at(15)
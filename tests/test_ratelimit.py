@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+
+import ratelimit
+from ratelimit import TokenBucket, per_worker
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeTime:
+    """Подменяет time в модуле ratelimit: часы двигаются только вручную"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeTime:
+    fake = FakeTime()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    return fake
+
+
+def test_burst_then_refill_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    clock.now += 0.4  # 0.8 токена
+    assert not bucket.try_acquire()
+    clock.now += 0.1
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_refill_is_capped_by_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.try_acquire(2)
+    clock.now += 60
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire()
+
+
+def test_refund_returns_tokens_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.try_acquire()
+    bucket.refund()
+    bucket.refund()
+    assert bucket.tokens == 2
+    assert bucket.try_acquire(2)
+
+
+def test_acquire_waits_for_tokens_in_order():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        order = []
+
+        async def take(name):
+            await bucket.acquire()
+            order.append((name, time.monotonic()))
+
+        started = time.monotonic()
+        await asyncio.gather(*(take(i) for i in range(4)))
+        return order, started
+
+    order, started = run(scenario())
+    assert [name for name, _ in order] == [0, 1, 2, 3]
+    # Первый токен из запаса, остальные три — по 1/50 с
+    assert order[-1][1] - started >= 3 / 50 * 0.9
+
+
+def test_urgent_acquire_goes_ahead_of_queued_waiters():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        bucket.try_acquire()
+        order = []
+
+        async def take(name, urgent=False):
+            await bucket.acquire(urgent=urgent)
+            order.append(name)
+
+        queued = [asyncio.create_task(take(f"edit{i}")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        await take("publish", urgent=True)
+        await asyncio.gather(*queued)
+        return order
+
+    order = run(scenario())
+    assert order[0] == "publish"
+    assert order[1:] == ["edit0", "edit1", "edit2"]
+
+
+def test_per_worker_share_keeps_floor_and_never_exceeds_limit():
+    # Ставки: 1/с и запас 3 на 4 воркера — не ниже одной ставки в секунду и одной в запасе
+    assert per_worker(1, 4) == 1
+    assert per_worker(3, 4) == 1
+    assert per_worker(8, 4) == 2
+    # Лимит ниже нижней границы не поднимается
+    assert per_worker(0.5, 4) == 0.5
+    # Общий лимит канала делится строго
+    assert per_worker(20 / 60, 4, minimum=0) == pytest.approx(20 / 60 / 4)
+    assert per_worker(5, 1) == 5
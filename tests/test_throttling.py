@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.dispatcher.handler import CancelHandler
+
+import cache
+import ratelimit
+from throttling import BidThrottlingMiddleware
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeTime:
+    fake = FakeTime()
+    monkeypatch.setattr(ratelimit, "time", fake)
+    monkeypatch.setattr(cache, "time", fake)
+    return fake
+
+
+class FakeCallback:
+    def __init__(self, callback_id: str, data: str, user_id: int = 10):
+        self.id = callback_id
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text: str):
+        self.answers.append(text)
+
+
+class FakeMessage:
+    def __init__(self, text: str, user_id: int = 10):
+        self.text = text
+        self.from_user = SimpleNamespace(id=user_id)
+        self.replies = []
+
+    def is_command(self) -> bool:
+        return self.text.startswith("/")
+
+    def get_command(self, pure: bool = False) -> str:
+        return self.text.split()[0].lstrip("/")
+
+    def get_args(self) -> str:
+        return self.text.partition(" ")[2]
+
+    async def reply(self, text: str):
+        self.replies.append(text)
+
+
+def make_middleware() -> BidThrottlingMiddleware:
+    return BidThrottlingMiddleware(user_rate=1, user_burst=3, lot_rate=0.5, lot_burst=2)
+
+
+def passes(coro) -> bool:
+    try:
+        run(coro)
+    except CancelHandler:
+        return False
+    return True
+
+
+def test_per_lot_limit_does_not_spend_user_budget(clock):
+    middleware = make_middleware()
+    assert middleware.allow(10, 1)
+    assert middleware.allow(10, 1)
+    # Третья ставка по лоту 1 упирается в бакет лота; токен пользователя возвращается
+    assert not middleware.allow(10, 1)
+    assert middleware.allow(10, 2)
+    assert not middleware.allow(10, 2)  # пользовательский запас (3) исчерпан
+
+
+def test_buckets_are_per_user_and_refill(clock):
+    middleware = make_middleware()
+    assert [middleware.allow(10, None) for _ in range(4)] == [True, True, True, False]
+    assert middleware.allow(11, None)
+
+    clock.now += 1
+    assert middleware.allow(10, None)
+    assert not middleware.allow(10, None)
+
+
+def test_duplicate_callback_is_dropped_silently(clock):
+    middleware = make_middleware()
+    callback = FakeCallback("cb-1", "bidquick:5:50")
+    assert passes(middleware.on_pre_process_callback_query(callback, {}))
+    assert not passes(middleware.on_pre_process_callback_query(callback, {}))
+    assert callback.answers == []
+    assert middleware.stats()["duplicates"] == 1
+
+
+def test_frequent_callbacks_get_short_answer(clock):
+    middleware = make_middleware()
+    results = [
+        passes(middleware.on_pre_process_callback_query(FakeCallback(f"cb-{i}", "bidquick:5:50"), {}))
+        for i in range(3)
+    ]
+    throttled = FakeCallback("cb-4", "bidquick:5:50")
+    assert not passes(middleware.on_pre_process_callback_query(throttled, {}))
+    assert results == [True, True, False]
+    assert len(throttled.answers) == 1
+    assert middleware.stats()["throttled"] == 2
+
+
+def test_other_callbacks_and_messages_are_not_throttled(clock):
+    middleware = make_middleware()
+    for i in range(10):
+        assert passes(middleware.on_pre_process_callback_query(FakeCallback(f"j-{i}", "join:5"), {}))
+        assert passes(middleware.on_pre_process_message(FakeMessage("/start"), {}))
+        assert passes(middleware.on_pre_process_message(FakeMessage("hello"), {}))
+
+
+def test_bid_command_warns_once_per_series(clock):
+    middleware = make_middleware()
+    messages = [FakeMessage(f"/bid 5 {1000 + i}") for i in range(5)]
+    results = [passes(middleware.on_pre_process_message(message, {})) for message in messages]
+
+    assert results == [True, True, False, False, False]
+    assert sum(len(message.replies) for message in messages) == 1
+
+    clock.now += 11  # окно предупреждения прошло, бакет лота пополнился
+    late = FakeMessage("/bid 5 2000")
+    assert passes(middleware.on_pre_process_message(late, {}))
@@ -0,0 +1,99 @@
+import logging
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from cache import TTLCache
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BidThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты ставок до хендлеров: token bucket на пользователя
+    и на пару (пользователь, лот). Кнопки bidquick: с повторным callback id
+    отбрасываются, слишком частые нажатия получают короткий ответ без обращения
+    к БД. Бакеты живут в ограниченном кэше и забываются после простоя.
+    """
+
+    def __init__(
+            self,
+            user_rate: float = 1.0,
+            user_burst: float = 3,
+            lot_rate: float = 0.5,
+            lot_burst: float = 2,
+            max_buckets: int = 50000,
+    ):
+        super().__init__()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.lot_rate = lot_rate
+        self.lot_burst = lot_burst
+        # Простаивающий дольше idle_ttl бакет всё равно был бы полным
+        idle_ttl = max(user_burst / user_rate, lot_burst / lot_rate) + 60
+        self.buckets = TTLCache(maxsize=max_buckets, ttl=idle_ttl)
+        self.seen_callbacks = TTLCache(maxsize=max_buckets, ttl=60)
+        self.warned = TTLCache(maxsize=max_buckets, ttl=10)
+        self.throttled = 0
+        self.duplicates = 0
+
+    def _bucket(self, key, rate: float, capacity: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+        self.buckets.set(key, bucket)
+        return bucket
+
+    def allow(self, user_id: int, auction_id: int | None) -> bool:
+        user_bucket = self._bucket(("user", user_id), self.user_rate, self.user_burst)
+        if not user_bucket.try_acquire():
+            return False
+        if auction_id is None:
+            return True
+        lot_bucket = self._bucket(("lot", user_id, auction_id), self.lot_rate, self.lot_burst)
+        if not lot_bucket.try_acquire():
+            user_bucket.refund()
+            return False
+        return True
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        if not callback.data or not callback.data.startswith("bidquick:"):
+            return
+
+        if callback.id in self.seen_callbacks:
+            self.duplicates += 1
+            raise CancelHandler()
+        self.seen_callbacks.set(callback.id, True)
+
+        try:
+            auction_id = int(callback.data.split(":")[1])
+        except (IndexError, ValueError):
+            auction_id = None
+
+        if not self.allow(callback.from_user.id, auction_id):
+            self.throttled += 1
+            await callback.answer("⏳ Слишком часто. Подождите пару секунд.")
+            raise CancelHandler()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if not message.is_command() or message.get_command(pure=True) != "bid":
+            return
+
+        try:
+            auction_id = int(message.get_args().split()[0])
+        except (IndexError, ValueError):
+            auction_id = None
+
+        user_id = message.from_user.id
+        if not self.allow(user_id, auction_id):
+            self.throttled += 1
+            # Предупреждаем один раз за серию, остальные команды просто отбрасываем
+            if user_id not in self.warned:
+                self.warned.set(user_id, True)
+                await message.reply("⏳ Слишком частые ставки. Подождите пару секунд.")
+            raise CancelHandler()
+
+    def stats(self) -> dict:
+        return {"buckets": len(self.buckets), "throttled": self.throttled, "duplicates": self.duplicates}
@@ -1,81 +1,152 @@
-import time
-import json
-import psycopg2
-from flask import Flask, request
-from psycopg2 import OperationalError
-
-from config import DB_URI, YOOKASSA_SECRET_KEY
-from models import Database
-
-
-def wait_for_db(db_uri, max_retries=30, delay=2):
+import asyncio
+import logging
+
+from aiohttp import web
+
+from config import (
+    DB_URI,
+    DB_POOL_MIN_SIZE,
+    DB_COMMAND_TIMEOUT_SEC,
+    WEBHOOK_PATH,
+    WEBHOOK_LISTEN_HOST,
+    WEBHOOK_LISTEN_PORT,
+    WEBHOOK_DB_POOL_MAX_SIZE,
+    WEBHOOK_REPLAY_INTERVAL_SEC,
+)
+from models import AsyncDatabase
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+db = AsyncDatabase(
+    DB_URI,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=WEBHOOK_DB_POOL_MAX_SIZE,
+    command_timeout=DB_COMMAND_TIMEOUT_SEC,
+)
+
+# Обработка уведомлений идёт после ответа ЮKassa
+background_tasks: set[asyncio.Task] = set()
+
+
+async def wait_for_db(max_retries=30, delay=2):
     """Ждем пока база данных станет доступной"""
     for i in range(max_retries):
         try:
-            conn = psycopg2.connect(db_uri)
-            conn.close()
-            print("✅ Database is ready!")
+            await db.connect()
+            logger.info("✅ Database is ready!")
             return True
-        except OperationalError as e:
-            print(f"⏳ Database not ready yet (attempt {i + 1}/{max_retries}): {e}")
+        except Exception as e:
+            logger.warning(f"⏳ Database not ready yet (attempt {i + 1}/{max_retries}): {e}")
             if i < max_retries - 1:
-                time.sleep(delay)
+                await asyncio.sleep(delay)
     return False
 
 
-# Ожидаем готовности БД перед подключением
-if not wait_for_db(DB_URI):
-    print("❌ Failed to connect to database after multiple attempts")
-    exit(1)
+async def process_event(event_key: str, payment_id: str):
+    """Отмечает платёж оплаченным; бот получает NOTIFY и подтверждает оплату"""
+    try:
+        if await db.apply_payment_webhook(event_key, payment_id):
+            logger.info(f"💳 Payment {payment_id} marked as completed")
+        else:
+            logger.info(f"💳 Payment {payment_id} already processed or unknown")
+    except Exception as e:
+        # Событие останется необработанным и будет повторено replay_loop
+        logger.error(f"❌ Ошибка обработки события {event_key}: {e}")
 
-db = Database(DB_URI)
-app = Flask(__name__)
 
+def spawn(event_key: str, payment_id: str):
+    task = asyncio.create_task(process_event(event_key, payment_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-@app.route("/yookassa_webhook", methods=["POST"])
-def yookassa_webhook():
-    try:
-        # ЮKassa отправляет JSON
-        data = request.get_json()
 
-        if not data:
-            return "No data", 400
+async def replay_pending_events():
+    events = await db.get_unprocessed_webhook_events()
+    for event in events:
+        await process_event(event.get('event_key'), event.get('payment_id'))
+    if events:
+        logger.info(f"🔁 Повторно обработано событий webhook: {len(events)}")
 
-        event = data.get("event")
-        if event != "payment.succeeded":
-            return "Ignored", 200
 
-        payment_data = data.get("object", {})
-        payment_id = payment_data.get("id")
-        status = payment_data.get("status")
-        metadata = payment_data.get("metadata", {})
+async def replay_loop(app: web.Application):
+    while True:
+        await asyncio.sleep(WEBHOOK_REPLAY_INTERVAL_SEC)
+        try:
+            await replay_pending_events()
+        except Exception as e:
+            logger.error(f"❌ Ошибка повторной обработки событий: {e}")
 
-        auction_id = metadata.get("auction_id")
-        user_id = metadata.get("user_id")
-        order_id = metadata.get("order_id")
 
-        if not all([auction_id, user_id, order_id]):
-            return "Missing metadata", 400
+async def yookassa_webhook(request: web.Request):
+    # ЮKassa отправляет JSON
+    try:
+        data = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        return web.Response(text="Invalid JSON", status=400)
+
+    if not isinstance(data, dict) or not data:
+        return web.Response(text="No data", status=400)
+
+    event = data.get("event")
+    if event != "payment.succeeded":
+        return web.Response(text="Ignored")
+
+    payment_data = data.get("object") or {}
+    payment_id = payment_data.get("id")
+    if not payment_id:
+        return web.Response(text="Missing payment id", status=400)
+    if payment_data.get("status") != "succeeded":
+        return web.Response(text="Ignored")
+
+    # Одно и то же уведомление ЮKassa может прислать несколько раз
+    event_key = f"{event}:{payment_id}"
+    try:
+        is_new = await db.record_webhook_event(event_key, payment_id, data)
+    except Exception as e:
+        # Не подтверждаем получение — ЮKassa повторит доставку
+        logger.error(f"❌ Webhook error: {e}")
+        return web.Response(text="Error", status=500)
 
-        # Проверяем подпись (опционально, но рекомендуется)
-        # ЮKassa отправляет заголовок с подписью
+    if not is_new:
+        logger.info(f"🔁 Повторная доставка {event_key}, пропускаем")
+        return web.Response(text="Duplicate")
 
-        if status == "succeeded":
-            # Помечаем платеж успешным
-            db.update_payment_status(int(auction_id), int(user_id), "completed")
-            print(f"Payment {payment_id} for auction {auction_id}, user {user_id} marked as completed")
+    spawn(event_key, payment_id)
+    return web.Response(text="OK")
 
-        return "OK", 200
 
-    except Exception as e:
-        print(f"Webhook error: {e}")
-        return "Error", 500
+async def health(request: web.Request):
+    return web.Response(text="OK")
+
+
+async def on_startup(app: web.Application):
+    if not await wait_for_db():
+        raise RuntimeError("❌ Failed to connect to database after multiple attempts")
+    # События, принятые до рестарта, но не успевшие обработаться
+    await replay_pending_events()
+    app["replay_task"] = asyncio.create_task(replay_loop(app))
+
+
+async def on_shutdown(app: web.Application):
+    app["replay_task"].cancel()
+    await asyncio.gather(app["replay_task"], return_exceptions=True)
+    # Даём дообработаться уже принятым уведомлениям
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await db.close()
 
 
-@app.route("/health", methods=["GET"])
-def health():
-    return "OK", 200
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=64 * 1024)
+    app.router.add_post(WEBHOOK_PATH, yookassa_webhook)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    web.run_app(create_app(), host=WEBHOOK_LISTEN_HOST, port=WEBHOOK_LISTEN_PORT, access_log=None)